@@ -0,0 +1,100 @@
+# Bulk recording of Observations which have been archived.
+#
+# Shared by the mark_as_archived.py and lta.py scripts. Observations are looked
+# up in chunks rather than one at a time, or by range of obsid in the
+# database, their SubbandData and Beams are marked with a couple of UPDATEs,
+# and the status of the Observations and Fields concerned is then recalculated
+# in a single set-based pass.
+
+import operator
+
+from django.db import transaction
+from django.db.models import Q
+
+from .models import ArchiveSite, Constants, Field, Observation, Beam, SubbandData
+from .status import update_observations, update_fields
+from .utils import chunked
+
+def obsid_range(lower, upper):
+    """
+    Return a Q object matching the Observations whose obsids, such as
+    "L12345", are numbered lower to upper inclusive.
+
+    obsids are strings, so they are only ordered numerically among those with
+    the same number of digits; the range is matched separately for each.
+    """
+    ranges = [Q(pk__in=[])]
+    for digits in range(len(str(lower)), len(str(upper)) + 1):
+        first = max(lower, 10 ** (digits - 1) if digits > 1 else 0)
+        last = min(upper, 10 ** digits - 1)
+        ranges.append(Q(
+            obsid__gte="L%d" % first, obsid__lte="L%d" % last,
+            obsid__regex=r"^L[0-9]{%d}$" % digits
+        ))
+    return reduce(operator.or_, ranges)
+
+def _mark(selections, location):
+    # Mark the Observations in each of the QuerySets selections as archived
+    # at location, creating the ArchiveSite if need be, and return the set
+    # of their obsids.
+    site, created = ArchiveSite.objects.get_or_create(name=location)
+    matched = set()
+    observations, fields = set(), set()
+    with transaction.commit_on_success():
+        for selection in selections:
+            found = list(selection.values_list('pk', flat=True))
+            matched.update(found)
+            for ids in chunked(found):
+                SubbandData.objects.filter(beam__observation__in=ids).update(archive=site)
+                beams = Beam.objects.filter(observation__in=ids)
+                beams.update(archived=Constants.TRUE)
+                for observation, field in beams.values_list('observation', 'field').order_by():
+                    observations.add(observation)
+                    fields.add(field)
+
+        # As with Beam.save(), only Observations with Beams are updated.
+        for ids in chunked(observations):
+            update_observations(Observation.objects.filter(pk__in=ids))
+        for ids in chunked(fields):
+            update_fields(Field.objects.filter(pk__in=ids))
+    return matched
+
+def mark_archived(obsids, location):
+    """
+    Record that all the data of the Observations listed in obsids has been
+    archived at location, creating the ArchiveSite if need be.
+
+    Returns a tuple of two lists: the obsids which were marked, and those
+    which aren't in the database.
+    """
+    obsids = sorted(set(obsids))
+    matched = _mark(
+        [Observation.objects.filter(pk__in=ids) for ids in chunked(obsids)], location
+    )
+    return (
+        [obsid for obsid in obsids if obsid in matched],
+        [obsid for obsid in obsids if obsid not in matched]
+    )
+
+def mark_range_archived(ranges, location):
+    """
+    As mark_archived(), for the Observations numbered within each of ranges,
+    a list of (lower, upper) tuples as taken by obsid_range(). The ranges are
+    matched in the database rather than listed.
+
+    Returns a tuple of the list of obsids which were marked, in numerical
+    order, and the number within ranges which aren't in the database.
+    """
+    merged = []
+    for lower, upper in sorted(ranges):
+        if merged and lower <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], upper)
+        elif lower <= upper:
+            merged.append([lower, upper])
+    matched = _mark(
+        [Observation.objects.filter(obsid_range(lower, upper)) for lower, upper in merged], location
+    )
+    return (
+        sorted(matched, key=lambda obsid: int(obsid[1:])),
+        sum(upper - lower + 1 for lower, upper in merged) - len(matched)
+    )
@@ -0,0 +1,78 @@
+# In-memory cross-matching of positions against Fields.
+#
+# The positions of all candidate Fields are loaded once and held as an array
+# of unit vectors; large numbers of positions can then be matched against
+# them in a few vectorised operations, rather than issuing a near_position()
+# query for each.
+
+import numpy as np
+
+from .models import Field
+
+def unit_vectors(ra, dec):
+    """
+    Convert arrays of ra, dec (in radians) to an N x 3 array of Cartesian
+    unit vectors.
+    """
+    ra = np.asarray(ra, dtype=float)
+    dec = np.asarray(dec, dtype=float)
+    return np.column_stack(
+        (np.cos(dec) * np.cos(ra), np.cos(dec) * np.sin(ra), np.sin(dec))
+    )
+
+
+class FieldMatcher(object):
+    # Number of positions matched at a time, to bound the size of the
+    # positions x fields array.
+    CHUNK_SIZE = 1024
+
+    def __init__(self, fields):
+        self.fields = list(fields)
+        self.vectors = unit_vectors(
+            [field.ra for field in self.fields],
+            [field.dec for field in self.fields]
+        ).reshape(-1, 3)
+
+    @classmethod
+    def for_survey(cls, survey_name, calibrator=None):
+        """
+        Build a matcher for the Fields of the named Survey, optionally
+        restricted to (non-)calibrators.
+        """
+        fields = Field.objects.filter(survey__name=survey_name)
+        if calibrator is not None:
+            fields = fields.filter(calibrator=calibrator)
+        return cls(fields)
+
+    def match(self, positions, threshold=None):
+        """
+        Find the nearest Field to each of a sequence of (ra, dec) positions,
+        given in radians.
+
+        Returns a list of (field, separation) tuples, with separation in
+        radians. If there are no Fields, or the nearest is further away than
+        threshold, field is None.
+        """
+        if not len(positions):
+            return []
+        if not self.fields:
+            return [(None, None)] * len(positions)
+
+        positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        vectors = unit_vectors(positions[:, 0], positions[:, 1])
+        nearest = np.concatenate([
+            np.argmax(np.dot(vectors[i:i+self.CHUNK_SIZE], self.vectors.T), axis=1)
+            for i in xrange(0, len(vectors), self.CHUNK_SIZE)
+        ])
+        # The chord length gives a more accurate separation than the arc
+        # cosine of the dot product for small angles.
+        chords = np.sqrt(((vectors - self.vectors[nearest])**2).sum(axis=1))
+        separations = 2 * np.arcsin(np.clip(chords / 2, 0, 1))
+
+        results = []
+        for index, separation in zip(nearest, separations):
+            if threshold is not None and separation > threshold:
+                results.append((None, float(separation)))
+            else:
+                results.append((self.fields[index], float(separation)))
+        return results
@@ -0,0 +1,58 @@
+# Reading of the grid files in the metadata directory, which list the
+# positions of a Survey's Fields, one per line: a name, a sexagesimal right
+# ascension and declination and, optionally, a description.
+#
+# Shared by the create_survey.py, synthetic_data.py and benchmark.py scripts.
+
+from .utils import hms_to_radians, dms_to_radians
+
+def parse_angle(ra, dec):
+    """
+    Convert sexagesimal strings, as found in the grid files, to radians.
+    Declinations may be separated with either colons or full stops.
+    """
+    hours, minutes, seconds = ra.split(":")
+    ra = hms_to_radians(int(hours), int(minutes), float(seconds))
+    degrees, minutes, seconds = dec.replace(":", ".", 2).split(".", 2)
+    sign = -1 if degrees.startswith("-") else 1
+    dec = sign * dms_to_radians(abs(int(degrees)), int(minutes), float(seconds))
+    return ra, dec
+
+def read_grid(filename):
+    """
+    Return a list of (name, ra, dec, description) tuples for the fields
+    listed in filename.
+    """
+    fields = []
+    with open(filename, 'r') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            split_string = line.split(None, 3)
+            ra, dec = parse_angle(split_string[1], split_string[2])
+            description = split_string[3].strip() if len(split_string) == 4 else ""
+            fields.append((split_string[0], ra, dec, description))
+    return fields
+
+def insert_grid(survey, filename, calibrator=False):
+    """
+    Create a Field in survey for each of those listed in filename. Returns
+    the number created.
+    """
+    # Imported here so that synthetic_data.py can read the grids without a
+    # database.
+    from .models import SurveyStats, Field, Constants
+    from .pixels import sky_pixel
+
+    fields = [
+        Field(
+            name=name, ra=ra, dec=dec, pixel=sky_pixel(ra, dec),
+            description=description, survey=survey, calibrator=calibrator,
+            status_code=Field.status_code_for(Constants.FALSE, Constants.FALSE, 0, calibrator)
+        ) for name, ra, dec, description in read_grid(filename)
+    ]
+    # bulk_create() bypasses Field.save(), so we set the pixel and status code
+    # ourselves and recount the survey's stats.
+    Field.objects.bulk_create(fields)
+    SurveyStats.recount([survey.pk])
+    return len(fields)
@@ -0,0 +1,225 @@
+# Bulk creation of Observations, and their Beams and SubbandData, from
+# parsets.
+#
+# Parsets are written in batches, each within a single transaction, using
+# bulk_create() for every table. Ingest is incremental: Observations are
+# recorded along with a hash of their parset, so that unchanged parsets can be
+# skipped and changed ones updated in place. The status of the affected
+# Observations and Fields is then recalculated with set-based queries (see
+# status.py) rather than by the per-object cascade in Beam.save().
+
+import os
+import hashlib
+from collections import defaultdict
+
+from django.db import transaction
+
+from .models import Station, Subband, Survey, Field, Observation
+from .models import ParsetText, ParsetKey, Beam, SubbandData
+from .models import SurveyStats
+from .subbands import SubbandSet
+from .status import update_observations, update_fields, update_beam_counts
+from .utils import chunked
+
+BATCH_SIZE = 200
+
+def obsid_from_filename(filename):
+    return os.path.basename(filename).rstrip(".parset")
+
+def parset_hash(text):
+    return hashlib.sha1(text).hexdigest()
+
+def bulk_upload(parsets, survey_name, batch_size=BATCH_SIZE):
+    """
+    Create or update Observations in survey_name for each of parsets.
+
+    Each parset should provide the interface of load_data.Parset: filename,
+    text, antennaset, clock, filter, stations and positions attributes;
+    start_time() and duration() methods; get_field(beam, survey_name), which
+    returns the Field observed by a beam (or None), and get_subbands(beam).
+
+    Observations which already exist with the same parset are skipped. Those
+    whose parset has changed are updated in place: their Beams, and hence any
+    SubbandData, are only replaced if the beams, fields or subbands differ.
+
+    Returns a tuple of the number of Observations created, the number
+    updated, and a list of (obsid, beam number) tuples for beams which didn't
+    match any Field and were therefore skipped.
+    """
+    # Raise DoesNotExist early if the survey is unknown.
+    Survey.objects.get(name=survey_name)
+    stations = dict(Station.objects.values_list('name', 'pk'))
+    subbands = set(Subband.objects.values_list('pk', flat=True))
+
+    n_created, n_updated = 0, 0
+    unmatched = []
+    for batch in chunked(parsets, batch_size):
+        with transaction.commit_on_success():
+            created, updated, batch_unmatched = _upload_batch(
+                batch, survey_name, stations, subbands
+            )
+        n_created += created
+        n_updated += updated
+        unmatched.extend(batch_unmatched)
+    return n_created, n_updated, unmatched
+
+def _beam_layouts(obsids):
+    # Map obsid to a dict of beam number -> (field id, sorted list of
+    # subbands) for the existing Beams of obsids.
+    layouts = defaultdict(dict)
+    unencoded = {}
+    for ids in chunked(obsids):
+        for pk, obsid, beam_number, field_id, subband_ranges, n_subbands in Beam.objects.filter(
+            observation__in=ids
+        ).values_list('pk', 'observation', 'beam', 'field', 'subband_ranges', 'n_subbands').order_by():
+            layouts[obsid][beam_number] = (
+                field_id, list(SubbandSet.decode(subband_ranges))
+            )
+            if n_subbands == 0:
+                unencoded[pk] = (obsid, beam_number)
+    # Beams in a database which predates subband_ranges, and which hasn't
+    # been through encode_subbands, only have their subbands in the
+    # old table. Treating them as empty would relay them, losing their
+    # SubbandData.
+    for ids in chunked(unencoded):
+        for pk, subband in Beam.legacy_subbands.through.objects.filter(
+            beam__in=ids
+        ).values_list('beam', 'subband').order_by('beam', 'subband'):
+            layouts[unencoded[pk][0]][unencoded[pk][1]][1].append(subband)
+    return layouts
+
+def _upload_batch(parsets, survey_name, stations, subbands):
+    existing = {}
+    for ids in chunked([obsid_from_filename(parset.filename) for parset in parsets]):
+        existing.update(
+            Observation.objects.filter(pk__in=ids).values_list('obsid', 'parset_hash')
+        )
+
+    new_observations = []
+    changed_observations = []
+    station_links = []
+    # Beam number -> (field id, sorted list of subbands), for each obsid.
+    layouts = {}
+    unmatched = []
+
+    for parset in parsets:
+        obsid = obsid_from_filename(parset.filename)
+        digest = parset_hash(parset.text)
+        if existing.get(obsid) == digest:
+            continue
+        observation = Observation(
+            obsid=obsid,
+            antennaset=parset.antennaset,
+            start_time=parset.start_time(),
+            duration=parset.duration(),
+            parset=parset.text,
+            parset_hash=digest,
+            clock=parset.clock,
+            filter=parset.filter
+        )
+        if obsid in existing:
+            changed_observations.append(observation)
+        else:
+            new_observations.append(observation)
+        station_links.extend(
+            Observation.stations.through(observation_id=obsid, station_id=station)
+            for station in set(stations[name] for name in parset.stations if name in stations)
+        )
+        layouts[obsid] = {}
+        for beam_number in range(len(parset.positions)):
+            field = parset.get_field(beam_number, survey_name)
+            if field:
+                layouts[obsid][beam_number] = (field.pk, sorted(
+                    subbands.intersection(parset.get_subbands(beam_number))
+                ))
+            else:
+                unmatched.append((obsid, beam_number))
+
+    # Beams which need creating, in order of obsid and beam number, and the
+    # Fields and Observations whose status might change as a result.
+    beams = []
+    field_ids = set()
+    relaid = []
+    changed_obsids = [observation.obsid for observation in changed_observations]
+    old_layouts = _beam_layouts(changed_obsids)
+    for observation in new_observations + changed_observations:
+        obsid = observation.obsid
+        if obsid in old_layouts and old_layouts[obsid] == layouts[obsid]:
+            continue
+        if obsid in existing:
+            relaid.append(obsid)
+            field_ids.update(field_id for field_id, sb in old_layouts[obsid].itervalues())
+        for beam_number, (field_id, beam_subbands) in sorted(layouts[obsid].iteritems()):
+            beam = Beam(observation_id=obsid, field_id=field_id, beam=beam_number)
+            beam.set_subband_numbers(beam_subbands)
+            beams.append(beam)
+            field_ids.add(field_id)
+
+    for observation in changed_observations:
+        Observation.objects.filter(pk=observation.obsid).update(**dict(
+            (name, getattr(observation, name)) for name in (
+                'antennaset', 'start_time', 'duration', 'parset_hash',
+                'clock', 'filter'
+            )
+        ))
+    for ids in chunked(changed_obsids):
+        Observation.stations.through.objects.filter(observation__in=ids).delete()
+        ParsetText.objects.filter(observation__in=ids).delete()
+        ParsetKey.objects.filter(observation__in=ids).delete()
+    for ids in chunked(relaid):
+        # Deleting the Beams also deletes their SubbandData. They are
+        # recounted below, with the new ones.
+        Beam.objects.filter(observation__in=ids).delete()
+    Observation.objects.bulk_create(new_observations)
+    ParsetText.objects.bulk_create([
+        ParsetText(observation_id=observation.obsid, data=ParsetText.compress(observation.parset))
+        for observation in new_observations + changed_observations
+    ])
+    ParsetKey.objects.bulk_create([
+        ParsetKey(observation_id=observation.obsid, key=key, value=value)
+        for observation in new_observations + changed_observations
+        for key, value in ParsetKey.parse(observation.parset)
+    ])
+    Observation.stations.through.objects.bulk_create(station_links)
+    Beam.objects.bulk_create(beams)
+    new_obsids = sorted(set(beam.observation_id for beam in beams))
+    for ids in chunked(set(new_obsids).union(relaid)):
+        update_beam_counts(Observation.objects.filter(pk__in=ids))
+    for ids in chunked(field_ids):
+        update_beam_counts(Field.objects.filter(pk__in=ids))
+
+    # bulk_create() doesn't give us primary keys, so we fetch them back.
+    beam_ids = {}
+    for ids in chunked(new_obsids):
+        beam_ids.update(
+            ((obsid, beam_number), pk) for pk, obsid, beam_number in
+            Beam.objects.filter(observation__in=ids).values_list('pk', 'observation', 'beam').order_by()
+        )
+
+    subband_data = []
+    sb_ctr = {}
+    for beam in beams:
+        # SubbandData are numbered consecutively through all the beams of the
+        # observation.
+        obsid = beam.observation_id
+        beam_id = beam_ids[(obsid, beam.beam)]
+        for subband in layouts[obsid][beam.beam][1]:
+            number = sb_ctr.get(obsid, 0)
+            subband_data.append(
+                SubbandData(
+                    id=obsid + "_" + str(number), beam_id=beam_id,
+                    number=number, subband_id=subband
+                )
+            )
+            sb_ctr[obsid] = number + 1
+    SubbandData.objects.bulk_create(subband_data)
+
+    # New Beams have no data, so only Observations and Fields need updating.
+    # As with Beam.save(), an Observation's status is only calculated once it
+    # has a Beam.
+    for ids in chunked(set(new_obsids).union(relaid)):
+        update_observations(Observation.objects.filter(pk__in=ids))
+    for ids in chunked(field_ids):
+        update_fields(Field.objects.filter(pk__in=ids))
+    SurveyStats.recount([survey_name])
+    return len(new_observations), len(changed_observations), unmatched
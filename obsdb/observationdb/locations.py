@@ -0,0 +1,53 @@
+# Bulk recording of where SubbandData are stored on the CEP cluster.
+#
+# Rather than updating SubbandData one at a time, the new locations are held
+# in memory and applied with UPDATE statements which each set a whole chunk
+# of rows, using CASE to pick out the value for each; the status of only those
+# Beams which were touched is then recalculated.
+
+from django.db import connection, transaction
+
+from .models import SubbandData
+from .status import update_from_beams
+from .utils import chunked
+
+# Each row in an UPDATE uses seven parameters; keep well within SQLite's
+# limit of 999.
+UPDATE_CHUNK_SIZE = 100
+
+def _update_chunk(cursor, table, chunk):
+    # chunk is a list of (id, (hostname, size, path)) tuples.
+    sql = ["UPDATE %s SET" % table]
+    params = []
+    for index, column in enumerate(("hostname", "size", "path")):
+        sql.append("%s %s = CASE id" % ("," if index else "", column))
+        for id, location in chunk:
+            sql.append("WHEN %s THEN %s")
+            params.extend((id, location[index]))
+        sql.append("END")
+    sql.append("WHERE id IN (%s)" % ", ".join(["%s"] * len(chunk)))
+    params.extend(id for id, location in chunk)
+    cursor.execute(" ".join(sql), params)
+    return cursor.rowcount
+
+def set_locations(locations):
+    """
+    Record the locations of SubbandData. locations maps SubbandData.id to a
+    tuple of (hostname, size, path); ids which don't exist are ignored.
+
+    Returns a tuple of the number of SubbandData updated and a dict of the
+    number of Beams, Observations and Fields whose status changed.
+    """
+    table = connection.ops.quote_name(SubbandData._meta.db_table)
+    n_updated = 0
+    beam_ids = set()
+    with transaction.commit_on_success():
+        cursor = connection.cursor()
+        for chunk in chunked(locations.iteritems(), UPDATE_CHUNK_SIZE):
+            n_updated += _update_chunk(cursor, table, chunk)
+        for ids in chunked(locations):
+            beam_ids.update(
+                SubbandData.objects.filter(pk__in=ids).values_list('beam', flat=True).order_by()
+            )
+        changed = update_from_beams(beam_ids)
+    return n_updated, changed
@@ -0,0 +1,45 @@
+from collections import defaultdict
+from itertools import groupby
+from operator import itemgetter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ...models import Beam
+from ...subbands import SubbandSet
+from ...utils import chunked
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill in the compact subband list of every Beam from the table which "
+        "held Beams' subbands before it, eg after upgrading a database which "
+        "predates it."
+    )
+
+    def handle(self, *args, **options):
+        numbers = dict(
+            (beam, [subband for beam, subband in rows]) for beam, rows in groupby(
+                Beam.legacy_subbands.through.objects.values_list('beam', 'subband').order_by('beam', 'subband'),
+                itemgetter(0)
+            )
+        )
+
+        # Most Beams have one of only a few subband lists, so update all the
+        # Beams which share one together.
+        by_encoding = defaultdict(list)
+        for pk in Beam.objects.values_list('pk', flat=True).order_by():
+            by_encoding[SubbandSet(numbers.get(pk, ())).encode()].append(pk)
+
+        with transaction.commit_on_success():
+            for encoding, pks in by_encoding.iteritems():
+                n_subbands = len(SubbandSet.decode(encoding))
+                for ids in chunked(pks):
+                    Beam.objects.filter(pk__in=ids).update(
+                        subband_ranges=encoding, n_subbands=n_subbands
+                    )
+        self.stdout.write(
+            "Encoded subbands of %d beams (%d distinct lists)" % (
+                sum(len(pks) for pks in by_encoding.itervalues()), len(by_encoding)
+            )
+        )
@@ -0,0 +1,61 @@
+import os
+import time
+import multiprocessing
+from collections import OrderedDict
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...models import Survey
+from ...mom import generate_packages, N_SLICES
+
+def write_package(args):
+    filename, contents = args
+    with open(filename, 'w') as f:
+        f.write(contents)
+
+
+class Command(BaseCommand):
+    help = "Write package descriptions mapping survey slices to MoM IDs."
+    option_list = BaseCommand.option_list + (
+        make_option("--survey", dest="survey", default="MSSS LBA",
+            help="Survey to describe [default: %default]"),
+        make_option("--output-dir", dest="output_dir", default="/tmp/alwin-msss",
+            help="Directory in which to write packages [default: %default]"),
+        make_option("--slices", dest="n_slices", type="int", default=N_SLICES,
+            help="Number of slices per package [default: %default]"),
+        make_option("-j", "--processes", dest="processes", type="int", default=1,
+            help="Number of processes to use for writing [default: %default]"),
+    )
+
+    def handle(self, *args, **options):
+        if not Survey.objects.filter(name=options["survey"]).exists():
+            raise CommandError("Survey %s does not exist" % options["survey"])
+
+        start_time = time.time()
+        packages = generate_packages(
+            options["survey"], options["n_slices"], log=self.stdout.write
+        )
+        generated_time = time.time()
+
+        # Packages with the same name replace one another, so only the last
+        # of each is written.
+        packages = OrderedDict(packages)
+        to_write = [
+            (os.path.join(options["output_dir"], package_name), contents)
+            for package_name, contents in packages.iteritems()
+        ]
+        if options["processes"] > 1:
+            pool = multiprocessing.Pool(options["processes"])
+            pool.map(write_package, to_write)
+            pool.close()
+            pool.join()
+        else:
+            map(write_package, to_write)
+        written_time = time.time()
+
+        self.stdout.write(
+            "Generated %d packages in %.2f s; wrote them in %.2f s." % (
+                len(to_write), generated_time - start_time, written_time - generated_time
+            )
+        )
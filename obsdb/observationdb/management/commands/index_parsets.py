@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ...models import ParsetText, ParsetKey
+from ...utils import chunked
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the table of indexed parset keys from the stored parsets, eg "
+        "after changing ParsetKey.INDEXED_KEYS."
+    )
+
+    def handle(self, *args, **options):
+        n_observations, n_keys = 0, 0
+        obsids = ParsetText.objects.values_list('observation', flat=True).order_by('pk')
+        for ids in chunked(obsids):
+            with transaction.commit_on_success():
+                ParsetKey.objects.filter(observation__in=ids).delete()
+                keys = [
+                    ParsetKey(observation_id=parset.observation_id, key=key, value=value)
+                    for parset in ParsetText.objects.filter(pk__in=ids)
+                    for key, value in ParsetKey.parse(parset.text)
+                ]
+                ParsetKey.objects.bulk_create(keys)
+            n_observations += len(ids)
+            n_keys += len(keys)
+        self.stdout.write("Indexed %d keys from %d parsets" % (n_keys, n_observations))
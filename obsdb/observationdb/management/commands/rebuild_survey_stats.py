@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ...models import Survey, SurveyStats
+
+
+class Command(BaseCommand):
+    args = "[survey name ...]"
+    help = (
+        "Recount the per-survey statistics shown on the introduction and "
+        "survey pages, for the named surveys or for all of them."
+    )
+
+    def handle(self, *args, **options):
+        surveys = Survey.objects.all()
+        if args:
+            surveys = surveys.filter(name__in=args)
+            missing = set(args).difference(surveys.values_list('name', flat=True))
+            if missing:
+                raise CommandError("Survey %s does not exist" % ", ".join(sorted(missing)))
+
+        SurveyStats.rebuild(surveys)
+        for stats in SurveyStats.objects.filter(survey__in=surveys).order_by('survey'):
+            self.stdout.write(
+                "%s: %d targets (%d done), %d calibrators" % (
+                    stats.survey_id, stats.n_targets, stats.n_done, stats.n_calibrators
+                )
+            )
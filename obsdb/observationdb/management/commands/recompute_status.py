@@ -0,0 +1,63 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...models import Survey, Field, Observation, Beam, Constants
+from ...status import recompute_status
+
+
+class Command(BaseCommand):
+    help = "Recalculate the archived/on CEP status of Beams, Observations and Fields."
+    option_list = BaseCommand.option_list + (
+        make_option("--survey", dest="survey", default=None,
+            help="Only recalculate objects belonging to this survey"),
+        make_option("--verify", action="store_true", dest="verify", default=False,
+            help="Check the result against the per-object status logic"),
+    )
+
+    def handle(self, *args, **options):
+        survey = None
+        if options["survey"]:
+            try:
+                survey = Survey.objects.get(name=options["survey"])
+            except Survey.DoesNotExist:
+                raise CommandError("Survey %s does not exist" % options["survey"])
+
+        changed = recompute_status(survey)
+        self.stdout.write(
+            "Updated %(beams)d beams, %(observations)d observations and %(fields)d fields" % changed
+        )
+
+        if options["verify"]:
+            n_errors = self.verify(survey)
+            if n_errors:
+                raise CommandError("%d objects disagree with the per-object status" % n_errors)
+            self.stdout.write("Verified OK")
+
+    def verify(self, survey):
+        beams = Beam.objects.all()
+        observations = Observation.objects.all()
+        fields = Field.objects.select_related('survey')
+        if survey:
+            beams = beams.filter(field__survey=survey)
+            observations = observations.filter(beam__field__survey=survey).distinct()
+            fields = fields.filter(survey=survey)
+
+        n_errors = 0
+        for name, queryset, compute in (
+            ("Beam", beams, lambda beam: beam._compute_status()),
+            ("Observation", observations, lambda obs: obs._compute_status(obs.beam_set.count())),
+            ("Field", fields, lambda field: field._compute_status(field.survey.beams_per_field))
+        ):
+            for obj in queryset.iterator():
+                expected = compute(obj)
+                if expected != (obj.archived, obj.on_cep):
+                    self.stderr.write(
+                        "%s %s: archived=%s, on_cep=%s; expected archived=%s, on_cep=%s" %
+                        ((name, obj, obj.archived, obj.on_cep) + expected)
+                    )
+                    n_errors += 1
+                elif name == "Field" and Constants.TRUE in expected and not obj.done:
+                    self.stderr.write("Field %s: complete but not marked as done" % (obj,))
+                    n_errors += 1
+        return n_errors
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from ...models import Survey, SurveyStats, Field, Observation
+from ...status import update_beam_counts
+
+
+class Command(BaseCommand):
+    help = (
+        "Recount the Beams of every Observation and Field, repairing counts "
+        "left wrong by writes which bypassed the ORM, and the SurveyStats "
+        "which depend on them."
+    )
+
+    def handle(self, *args, **options):
+        n_observations = update_beam_counts(Observation.objects.all())
+        n_fields = update_beam_counts(Field.objects.all())
+        SurveyStats.recount(Survey.objects.values_list('pk', flat=True))
+        self.stdout.write(
+            "Corrected %d observations and %d fields" % (n_observations, n_fields)
+        )
@@ -1,8 +1,23 @@
-from django.db import models
+import base64
+import itertools
+import operator
+import re
+import threading
+import zlib
+from contextlib import contextmanager
+
+from django.db import models, transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
 from django.utils.datastructures import SortedDict
 
 from math import sin, cos, acos
 
+from .utils import chunked
+from .pixels import sky_pixel, cone_pixel_ranges
+from .subbands import SubbandSet
+from .parset import ParameterSet
+
 EPOCH = "J2000"
 
 # These are the states which Fields, Observations and Beams can have to
@@ -25,6 +40,89 @@ ON_CEP_CHOICES = (
 MAX_CHOICE_LENGTH=max(len(Constants.TRUE), len(Constants.PARTIAL), len(Constants.FALSE))
 
 
+class StatusBatch(object):
+    """
+    Collects the Beams, Observations, Fields and Surveys whose status needs
+    to be recalculated during a block of writes; see deferred_status().
+
+    Objects are tracked by primary key, so each is recalculated exactly once
+    when the batch is flushed, no matter how many times it was touched. The
+    SurveyStats of every Survey whose Fields were touched are then recounted.
+    """
+    def __init__(self):
+        self.beams = set()
+        self.observations = set()
+        self.fields = set()
+        self.surveys = set()
+        # Surveys whose SurveyStats need recounting.
+        self.stats = set()
+
+    def flush(self):
+        # Order matters: updating a Beam marks its Observation & Field, and
+        # updating a Field marks its Survey.
+        for ids in chunked(self.beams):
+            for beam in Beam.objects.filter(pk__in=ids):
+                beam._update_status()
+        for ids in chunked(self.observations):
+            for observation in Observation.objects.filter(pk__in=ids):
+                observation._update_status()
+        surveys = {}
+        for ids in chunked(self.fields):
+            for field in Field.objects.filter(pk__in=ids).select_related('survey'):
+                surveys[field.survey_id] = field.survey
+                field._update_status()
+        for ids in chunked(self.surveys.difference(surveys)):
+            surveys.update((survey.pk, survey) for survey in Survey.objects.filter(pk__in=ids))
+        for pk in self.surveys:
+            surveys[pk].save(force_update=True)
+        SurveyStats.recount(self.stats)
+
+
+_batch = threading.local()
+
+def pending_status():
+    """
+    Return the active StatusBatch, or None if status updates are not being
+    deferred.
+    """
+    return getattr(_batch, "pending", None)
+
+@contextmanager
+def _atomic():
+    # Run a block in a transaction, unless it is already within one, whose
+    # owner then decides whether the block's writes are kept.
+    if transaction.is_managed():
+        yield
+    else:
+        with transaction.commit_on_success():
+            yield
+
+@contextmanager
+def deferred_status():
+    """
+    Defer status propagation during a block of writes.
+
+    Within the block, saving a Beam or SubbandData only records which objects
+    need their status recalculated; on exit, each affected Beam, Observation,
+    Field and Survey is updated once. Nested blocks are folded into the
+    outermost one.
+
+    The block and the updates run in a single transaction, so if the block
+    raises, its writes are rolled back along with the unflushed batch. Within
+    an enclosing transaction, that transaction must be rolled back too.
+    """
+    if pending_status() is not None:
+        yield pending_status()
+        return
+    _batch.pending = StatusBatch()
+    try:
+        with _atomic():
+            yield _batch.pending
+            _batch.pending.flush()
+    finally:
+        _batch.pending = None
+
+
 class DataStatus(object):
     # Mixed in to the Field and Observation models.
     CALIBRATOR = "cal"
@@ -35,51 +133,146 @@ class DataStatus(object):
     PARTIAL_CEP = "par_cep"
     UNKNOWN = "unk"
 
-    def status(self):
-        status = []
-        if self.beam_set.count() == 0:
-            status.append(self.NOT_OBSERVED)
-        if self.archived == Constants.TRUE:
-            status.append(self.ARCHIVED)
-        if self.on_cep == Constants.TRUE:
-            status.append(self.ON_CEP)
-        if self.on_cep == Constants.PARTIAL:
-            status.append(self.PARTIAL_CEP)
-        if self.archived == Constants.PARTIAL:
-            status.append(self.PARTIAL_ARCHIVED)
-        if not status:
-            status.append(self.UNKNOWN)
+    # The bits of status_code for each status, in the order in which status()
+    # lists them. Objects with none of the bits other than CALIBRATOR set are
+    # UNKNOWN.
+    STATUS_BITS = (
+        (CALIBRATOR, 1), (NOT_OBSERVED, 2), (ARCHIVED, 4), (ON_CEP, 8),
+        (PARTIAL_CEP, 16), (PARTIAL_ARCHIVED, 32)
+    )
+
+    @classmethod
+    def status_code_for(cls, archived, on_cep, n_beams, calibrator=False):
+        """
+        Return the status_code of an object in the given state.
+        """
+        bits = dict(cls.STATUS_BITS)
+        code = 0
+        if calibrator:
+            code |= bits[cls.CALIBRATOR]
+        if n_beams == 0:
+            code |= bits[cls.NOT_OBSERVED]
+        if archived == Constants.TRUE:
+            code |= bits[cls.ARCHIVED]
+        if on_cep == Constants.TRUE:
+            code |= bits[cls.ON_CEP]
+        if on_cep == Constants.PARTIAL:
+            code |= bits[cls.PARTIAL_CEP]
+        if archived == Constants.PARTIAL:
+            code |= bits[cls.PARTIAL_ARCHIVED]
+        return code
+
+    @classmethod
+    def decode_state(cls, code):
+        """
+        Return the (archived, on_cep, observed, calibrator) state from which
+        status_code_for() computed code.
+        """
+        bits = dict(cls.STATUS_BITS)
+        states = []
+        for full, partial in ((cls.ARCHIVED, cls.PARTIAL_ARCHIVED), (cls.ON_CEP, cls.PARTIAL_CEP)):
+            if code & bits[full]:
+                states.append(Constants.TRUE)
+            elif code & bits[partial]:
+                states.append(Constants.PARTIAL)
+            else:
+                states.append(Constants.FALSE)
+        return (
+            states[0], states[1], not code & bits[cls.NOT_OBSERVED],
+            bool(code & bits[cls.CALIBRATOR])
+        )
+
+    @classmethod
+    def decode_status(cls, code):
+        status = [name for name, bit in cls.STATUS_BITS if code & bit]
+        if not code & ~dict(cls.STATUS_BITS)[cls.CALIBRATOR]:
+            status.append(cls.UNKNOWN)
         return status
 
-    def _update_status(self, n_beams):
+    @classmethod
+    def status_codes(cls, status):
+        """
+        Return a list of the status codes which include status, for use in
+        an indexed status_code__in lookup.
+        """
+        states = (Constants.TRUE, Constants.PARTIAL, Constants.FALSE)
+        return sorted(set(
+            code for code in (
+                cls.status_code_for(archived, on_cep, n_beams, calibrator)
+                for archived, on_cep, n_beams, calibrator
+                in itertools.product(states, states, (0, 1), (False, True))
+            ) if status in cls.decode_status(code)
+        ))
+
+    def status(self):
+        return self.decode_status(self.status_code)
+
+    def _compute_status(self, n_beams):
+        """
+        Return the (archived, on_cep) state implied by our valid Beams, given
+        that n_beams of them are required for a complete data set.
+        """
         if self.beam_set.filter(
             archived=Constants.TRUE, observation__invalid=False
         ).count() >= n_beams:
-            self.archived = Constants.TRUE
+            archived = Constants.TRUE
         elif self.beam_set.filter(
             observation__invalid=False
         ).filter(
             models.Q(archived=Constants.TRUE) | models.Q(archived=Constants.PARTIAL)
         ).count() > 0:
-            self.archived = Constants.PARTIAL
+            archived = Constants.PARTIAL
         else:
-            self.archived = Constants.FALSE
+            archived = Constants.FALSE
 
         if self.beam_set.filter(
             on_cep=Constants.TRUE, observation__invalid=False
         ).count() >= n_beams:
-            self.on_cep = Constants.TRUE
+            on_cep = Constants.TRUE
         elif self.beam_set.filter(
             observation__invalid=False
         ).filter(
             models.Q(on_cep=Constants.TRUE) | models.Q(on_cep=Constants.PARTIAL)
         ).count() > 0:
-            self.on_cep = Constants.PARTIAL
+            on_cep = Constants.PARTIAL
         else:
-            self.on_cep = Constants.FALSE
+            on_cep = Constants.FALSE
+
+        return archived, on_cep
 
+    def _update_status(self, n_beams):
+        self.archived, self.on_cep = self._compute_status(n_beams)
         self.save()
 
+    def _save_status(self, save, args, kwargs, calibrator=False):
+        """
+        Call save(*args, **kwargs), keeping status_code in step with our
+        state.
+
+        n_beams is maintained in the database (see Beam._count()), so if it
+        isn't being saved too, status_code is written afterwards from the
+        stored count.
+        """
+        args = list(args)
+        if len(args) > 3:
+            kwargs['update_fields'] = args.pop(3)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'n_beams' in update_fields:
+            self.status_code = self.status_code_for(self.archived, self.on_cep, self.n_beams, calibrator)
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | set(['status_code'])
+            save(*args, **kwargs)
+            return
+        kwargs['update_fields'] = set(update_fields) - set(['status_code'])
+        if kwargs['update_fields']:
+            save(*args, **kwargs)
+        code = self.status_code_for(self.archived, self.on_cep, 1, calibrator)
+        not_observed = dict(self.STATUS_BITS)[self.NOT_OBSERVED]
+        objects = type(self).objects.filter(pk=self.pk)
+        objects.filter(n_beams__gt=0).update(status_code=code)
+        objects.filter(n_beams=0).update(status_code=code | not_observed)
+        self.status_code = code if self.n_beams else code | not_observed
+
 
 class ArchiveSite(models.Model):
     name = models.CharField(max_length=20, primary_key=True)
@@ -137,12 +330,19 @@ class FieldManager(models.Manager):
         Return a QuerySet containing those objects within radius of ra, dec.
         All arguments should be given in radians.
 
+        Candidates are first selected using the indexed sky pixel, then the
+        exact angular separation is checked.
+
         The returned fields will have an extra attribute, distance, giving the
         angular separation in radians from the ra, dec supplied.
         """
-        return super(FieldManager, self).get_query_set().filter(
-            dec__gte=dec-radius, dec__lte=dec+radius
-        ).extra(
+        fields = super(FieldManager, self).get_query_set()
+        pixel_ranges = cone_pixel_ranges(ra, dec, radius)
+        if pixel_ranges is not None:
+            fields = fields.filter(reduce(operator.or_, (
+                models.Q(pixel__range=pixel_range) for pixel_range in pixel_ranges
+            )))
+        return fields.extra(
             select=SortedDict([('distance', 'ACOS(SIN(dec)*SIN(%s) + COS(dec)*COS(%s)*COS(ra-%s))')]),
             select_params=(dec, dec, ra),
             where=['ACOS(SIN(dec)*SIN(%s) + COS(dec)*COS(%s)*COS(ra-%s)) <= %s'],
@@ -157,6 +357,8 @@ class Field(models.Model, DataStatus):
     description = models.CharField(max_length=100, blank=True)
     ra = models.FloatField()
     dec = models.FloatField()
+    # Set from ra & dec on save; see pixels.py.
+    pixel = models.IntegerField(db_index=True, editable=False)
     survey = models.ForeignKey(Survey)
     calibrator = models.BooleanField(default=False)
     archived = models.CharField(
@@ -168,23 +370,47 @@ class Field(models.Model, DataStatus):
         default=Constants.FALSE, editable=False
     )
     done = models.BooleanField(default=False)
+    # The number of Beams which observed us; see Beam._count().
+    n_beams = models.IntegerField(default=0, db_index=True, editable=False)
+    # Our status() as a bit mask; see DataStatus.STATUS_BITS.
+    status_code = models.IntegerField(
+        default=DataStatus.status_code_for(Constants.FALSE, Constants.FALSE, 0),
+        db_index=True, editable=False
+    )
 
     def __unicode__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.pixel = sky_pixel(self.ra, self.dec)
+        self._save_status(super(Field, self).save, args, kwargs, self.calibrator)
+        # Our Survey's SurveyStats are recounted with the pending StatusBatch
+        # if there is one.
+        batch = pending_status()
+        if batch is not None:
+            batch.stats.add(self.survey_id)
+        else:
+            SurveyStats.recount([self.survey_id])
+
+    def delete(self, *args, **kwargs):
+        # Our Beams are deleted first so that the counts of their
+        # Observations are kept up to date. Bulk deletions should call
+        # status.delete_beams(), and SurveyStats.recount(), themselves.
+        from .status import delete_beams
+        delete_beams(self.beam_set.all())
+        super(Field, self).delete(*args, **kwargs)
+        SurveyStats.recount([self.survey_id])
+
     def _update_status(self):
-        super(Field, self)._update_status(self.survey.beams_per_field)
+        self.archived, self.on_cep = self._compute_status(self.survey.beams_per_field)
         if self.on_cep == Constants.TRUE or self.archived == Constants.TRUE:
             self.done = True
-        self.survey.save()
+        if pending_status() is not None:
+            pending_status().surveys.add(self.survey_id)
+        else:
+            self.survey.save()
         self.save()
 
-    def status(self):
-        status = super(Field, self).status()
-        if self.calibrator:
-            status.insert(0, self.CALIBRATOR)
-        return status
-
     @models.permalink
     def get_absolute_url(self):
         return ('field_detail', [str(self.pk)])
@@ -200,6 +426,147 @@ class Field(models.Model, DataStatus):
         ordering = ['name']
 
 
+class SurveyStats(models.Model):
+    """
+    The number of a Survey's Fields in each state, and the range of start
+    times of its Observations, kept up to date as Fields and Beams change so
+    that they needn't be recounted for every page.
+
+    Each Field counts towards the counters returned by counters(). Writes
+    which bypass the ORM should call recount() or rebuild() themselves.
+    """
+    COUNTERS = (
+        "n_targets", "n_calibrators", "n_done", "n_not_observed", "n_on_cep",
+        "n_archived", "n_partial", "n_missing"
+    )
+
+    survey = models.OneToOneField(Survey, primary_key=True, related_name="stats")
+    n_targets = models.IntegerField(default=0)
+    n_calibrators = models.IntegerField(default=0)
+    n_done = models.IntegerField(default=0)
+    # Target Fields in each category shown on the survey map. As on the map,
+    # "archived" excludes Fields which are also on CEP, and "missing" means
+    # observed but neither archived nor on CEP.
+    n_not_observed = models.IntegerField(default=0)
+    n_on_cep = models.IntegerField(default=0)
+    n_archived = models.IntegerField(default=0)
+    n_partial = models.IntegerField(default=0)
+    n_missing = models.IntegerField(default=0)
+    start_time = models.DateTimeField(null=True, blank=True)
+    stop_time = models.DateTimeField(null=True, blank=True)
+
+    @staticmethod
+    def counters(calibrator, done, archived, on_cep, observed):
+        """
+        Return the counters to which a Field in the given state contributes;
+        observed is true if it has any Beams.
+        """
+        if calibrator:
+            return ["n_calibrators"]
+        counters = ["n_targets"]
+        if done:
+            counters.append("n_done")
+        if not observed:
+            counters.append("n_not_observed")
+        if on_cep == Constants.TRUE:
+            counters.append("n_on_cep")
+        elif archived == Constants.TRUE:
+            counters.append("n_archived")
+        elif Constants.PARTIAL in (archived, on_cep):
+            counters.append("n_partial")
+        if observed and archived == Constants.FALSE and on_cep == Constants.FALSE:
+            counters.append("n_missing")
+        return counters
+
+    @classmethod
+    def recount(cls, survey_ids):
+        """
+        Recount the stats of the Surveys survey_ids (primary keys) from the
+        stored status of their Fields.
+        """
+        survey_ids = set(survey_ids)
+        for ids in chunked(survey_ids):
+            values = dict((pk, dict.fromkeys(cls.COUNTERS, 0)) for pk in ids)
+            for survey, done, status_code, n in Field.objects.filter(
+                survey__in=ids
+            ).values_list('survey', 'done', 'status_code').annotate(
+                n=models.Count('pk')
+            ).order_by():
+                archived, on_cep, observed, calibrator = DataStatus.decode_state(status_code)
+                for name in cls.counters(calibrator, done, archived, on_cep, observed):
+                    values[survey][name] += n
+            times = cls._times(ids)
+            for survey, counts in values.iteritems():
+                counts['start_time'], counts['stop_time'] = times.get(survey, (None, None))
+                cls.objects.filter(survey=survey).update(**counts)
+
+    @classmethod
+    def rebuild(cls, surveys=None):
+        """
+        Recount the stats of the Surveys in the QuerySet surveys, or of every
+        Survey, from scratch.
+        """
+        if surveys is None:
+            surveys = Survey.objects.all()
+        stats = dict((pk, cls(survey_id=pk)) for pk in surveys.values_list('pk', flat=True))
+        for survey, calibrator, done, archived, on_cep, n_beams in Field.objects.filter(
+            survey__in=list(stats)
+        ).annotate(num_beams=models.Count('beam')).values_list(
+            'survey', 'calibrator', 'done', 'archived', 'on_cep', 'num_beams'
+        ).order_by():
+            for name in cls.counters(calibrator, done, archived, on_cep, n_beams > 0):
+                setattr(stats[survey], name, getattr(stats[survey], name) + 1)
+        for survey, (first, last) in cls._times(list(stats)).iteritems():
+            stats[survey].start_time, stats[survey].stop_time = first, last
+        for survey_stats in stats.itervalues():
+            survey_stats.save()
+
+    @staticmethod
+    def _times(survey_ids):
+        # Map each of survey_ids with any Beams to the range of start times
+        # of its Observations.
+        return dict(
+            (survey, (first, last)) for survey, first, last in Beam.objects.filter(
+                field__survey__in=survey_ids
+            ).values_list('field__survey').annotate(
+                models.Min('observation__start_time'), models.Max('observation__start_time')
+            ).order_by()
+        )
+
+    @classmethod
+    def for_survey(cls, survey):
+        # Databases which predate SurveyStats are counted when first needed.
+        try:
+            return survey.stats
+        except cls.DoesNotExist:
+            cls.rebuild(Survey.objects.filter(pk=survey.pk))
+            return cls.objects.get(survey=survey)
+
+@receiver(post_save, sender=Survey)
+def _create_survey_stats(sender, instance, created, raw, **kwargs):
+    if created and not raw:
+        SurveyStats.objects.get_or_create(survey=instance)
+
+
+class ObservationManager(models.Manager):
+    def with_parset_key(self, key, value=None):
+        """
+        Return a QuerySet containing those Observations whose parset contains
+        key, or, if value is given, where key has that value. value may also
+        be a list of values, any of which will match.
+
+        Only keys listed in ParsetKey.INDEXED_KEYS can be looked up.
+        """
+        observations = super(ObservationManager, self).get_query_set()
+        if value is None:
+            return observations.filter(parset_keys__key=key)
+        elif isinstance(value, (list, tuple, set)):
+            values = [unicode(item) for item in value]
+            return observations.filter(parset_keys__key=key, parset_keys__value__in=values)
+        else:
+            return observations.filter(parset_keys__key=key, parset_keys__value=unicode(value))
+
+
 class Observation(models.Model, DataStatus):
     ANTENNASET_CHOICES = (
         ("HBA_DUAL", "HBA_DUAL"),
@@ -234,7 +601,9 @@ class Observation(models.Model, DataStatus):
     duration = models.IntegerField()
     clock = models.IntegerField(choices=CLOCK_CHOICES)
     filter = models.CharField(max_length=15, choices=FILTER_CHOICES)
-    parset = models.TextField()
+    # The text of the parset is kept in a ParsetText and is available as the
+    # parset property; this is its SHA-1, used to detect changes on re-ingest.
+    parset_hash = models.CharField(max_length=40, blank=True, editable=False)
     archived = models.CharField(
         choices=ARCHIVE_CHOICES, max_length=MAX_CHOICE_LENGTH,
         default=Constants.FALSE, editable=False
@@ -244,12 +613,71 @@ class Observation(models.Model, DataStatus):
         default=Constants.FALSE, editable=False
     )
     invalid = models.BooleanField(default=False) # For use by humans
+    # The calibrator scan which immediately precedes a target observation;
+    # see pairing.py.
+    calibrator = models.ForeignKey(
+        'self', null=True, blank=True, editable=False,
+        related_name='targets', on_delete=models.SET_NULL
+    )
+    # The number of Beams we contain; see Beam._count().
+    n_beams = models.IntegerField(default=0, db_index=True, editable=False)
+    # Our status() as a bit mask; see DataStatus.STATUS_BITS.
+    status_code = models.IntegerField(
+        default=DataStatus.status_code_for(Constants.FALSE, Constants.FALSE, 0),
+        db_index=True, editable=False
+    )
+
+    objects = ObservationManager()
+
+    def __init__(self, *args, **kwargs):
+        self._parset = None
+        self._parset_changed = False
+        super(Observation, self).__init__(*args, **kwargs)
 
     def __unicode__(self):
         return self.obsid
 
+    def _get_parset(self):
+        # Only fetched from the database when first asked for.
+        if self._parset is None:
+            try:
+                self._parset = self.parset_text.text
+            except ParsetText.DoesNotExist:
+                self._parset = u""
+        return self._parset
+
+    def _set_parset(self, text):
+        self._parset = text
+        self._parset_changed = True
+
+    parset = property(_get_parset, _set_parset)
+
+    def save(self, *args, **kwargs):
+        self._save_status(super(Observation, self).save, args, kwargs)
+        if self._parset_changed:
+            ParsetText(observation=self, data=ParsetText.compress(self._parset)).save()
+            self.parset_keys.all().delete()
+            ParsetKey.objects.bulk_create(
+                ParsetKey(observation=self, key=key, value=value)
+                for key, value in ParsetKey.parse(self._parset)
+            )
+            self._parset_changed = False
+
+    def delete(self, *args, **kwargs):
+        # As with Field.delete().
+        from .status import delete_beams
+        delete_beams(self.beam_set.all())
+        super(Observation, self).delete(*args, **kwargs)
+
+    def parset_value(self, key):
+        """
+        Return the value of an indexed parset key, or None if it isn't set.
+        """
+        values = self.parset_keys.filter(key=key).values_list('value', flat=True)
+        return values[0] if values else None
+
     def _update_status(self):
-        super(Observation, self)._update_status(self.beam_set.count())
+        super(Observation, self)._update_status(self.n_beams)
 
     @models.permalink
     def get_absolute_url(self):
@@ -259,43 +687,182 @@ class Observation(models.Model, DataStatus):
         ordering = ['start_time']
 
 
+class ParsetText(models.Model):
+    """
+    The text of an Observation's parset, stored separately so that it's only
+    loaded when needed. It is zlib-compressed and base64-encoded.
+    """
+    observation = models.OneToOneField(
+        Observation, primary_key=True, related_name="parset_text"
+    )
+    data = models.TextField()
+
+    @staticmethod
+    def compress(text):
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        return base64.b64encode(zlib.compress(text, 9))
+
+    @property
+    def text(self):
+        return zlib.decompress(base64.b64decode(self.data)).decode('utf-8')
+
+
+class ParsetKey(models.Model):
+    """
+    A single key and its (unquoted) value from an Observation's parset,
+    copied out so that Observations can be looked up by parset contents; see
+    ObservationManager.with_parset_key().
+    """
+    # Only the observation metadata which is looked up is indexed, not the
+    # hardware and processing configuration or the lists of data products
+    # which make up most of a parset. Run index_parsets after widening this.
+    INDEXED_KEYS = re.compile(
+        r"Observation\.("
+        r"momID|Campaign\.\w+|startTime|stopTime|antennaSet|bandFilter|clockMode|nrBeams|"
+        r"Beam\[\d+\]\.(momID|angle1|angle2|directionType|target)"
+        r")$"
+    )
+
+    observation = models.ForeignKey(Observation, related_name="parset_keys")
+    key = models.CharField(max_length=100)
+    value = models.TextField()
+
+    @classmethod
+    def parse(cls, text):
+        """
+        Return a list of the (key, value) pairs in text which are indexed.
+        """
+        parset = ParameterSet.from_string(text, cls.INDEXED_KEYS)
+        return sorted((key, parset.getString(key)) for key in parset.keys())
+
+    def __unicode__(self):
+        return u"%s: %s = %s" % (self.observation_id, self.key, self.value)
+
+    class Meta:
+        unique_together = (("observation", "key"),)
+        index_together = [["key", "value"]]
+
+
 class Beam(models.Model):
     observation = models.ForeignKey(Observation)
     beam = models.IntegerField()
     field = models.ForeignKey(Field)
-    subbands = models.ManyToManyField(Subband)
+    # Our subbands (see subbands.py), and their number.
+    subband_ranges = models.TextField(blank=True, editable=False)
+    n_subbands = models.IntegerField(default=0, editable=False)
     archived = models.CharField(choices=ARCHIVE_CHOICES, max_length=MAX_CHOICE_LENGTH, default=Constants.FALSE, editable=False)
     on_cep = models.CharField(choices=ON_CEP_CHOICES, max_length=MAX_CHOICE_LENGTH, default=Constants.FALSE, editable=False)
     invalid = models.BooleanField(default=False) # For use by humans
+    # Where our subbands were kept before subband_ranges. Nothing writes it
+    # now; it is only read by encode_subbands, and by ingest for Beams which
+    # haven't been through that yet.
+    legacy_subbands = models.ManyToManyField(
+        Subband, db_table="observationdb_beam_subbands", related_name="+"
+    )
 
     def save(self, *args, **kwargs):
         # Augment save to mark our Observation & Field as archived if all of its subbands are
-        # now archived.
-        super(Beam, self).save(*args, **kwargs)
-        self.observation._update_status()
-        self.field._update_status()
+        # now archived. Outside a deferred_status() block, that and the
+        # SurveyStats are still updated in a single batch.
+        adding = self._state.adding
+        with deferred_status() as batch:
+            super(Beam, self).save(*args, **kwargs)
+            if adding:
+                self._count()
+            batch.observations.add(self.observation_id)
+            batch.fields.add(self.field_id)
+
+    def _count(self):
+        # Count us among the Beams of our Observation and Field, which become
+        # observed if they had none. Bulk loaders should use
+        # status.update_beam_counts() instead, and deletions go through
+        # status.delete_beams().
+        not_observed = dict(DataStatus.STATUS_BITS)[DataStatus.NOT_OBSERVED]
+        for name, objects in (
+            ('observation', Observation.objects.filter(pk=self.observation_id)),
+            ('field', Field.objects.filter(pk=self.field_id))
+        ):
+            first = not objects.filter(n_beams__gt=0).update(n_beams=models.F('n_beams') + 1)
+            if first:
+                objects.update(
+                    n_beams=models.F('n_beams') + 1,
+                    status_code=models.F('status_code').bitor(not_observed) - not_observed
+                )
+            # Keep any copy we were given in step.
+            related = self._cached(name)
+            if related is not None:
+                related.n_beams += 1
+
+    def _cached(self, name):
+        # Our related object name if it has already been fetched or given.
+        return getattr(self, self._meta.get_field(name).get_cache_name(), None)
+
+    def delete(self, *args, **kwargs):
+        # As with Field.delete().
+        from .status import delete_beams
+        delete_beams(Beam.objects.filter(pk=self.pk))
+
+    @property
+    def subband_numbers(self):
+        """
+        The numbers of our subbands, as a SubbandSet.
+        """
+        return SubbandSet.decode(self.subband_ranges)
+
+    def _get_subbands(self):
+        query = models.Q()
+        for first, last in self.subband_numbers.ranges:
+            query |= models.Q(number__range=(first, last))
+        return Subband.objects.filter(query) if query else Subband.objects.none()
+
+    def _set_subbands(self, subbands):
+        self.set_subband_numbers(getattr(subband, 'number', subband) for subband in subbands)
+        if self.pk is not None:
+            Beam.objects.filter(pk=self.pk).update(
+                subband_ranges=self.subband_ranges, n_subbands=self.n_subbands
+            )
+
+    # Our Subbands as a QuerySet; may be assigned Subbands or their numbers,
+    # as the ManyToManyField it replaces could be.
+    subbands = property(_get_subbands, _set_subbands)
+
+    def set_subband_numbers(self, numbers):
+        """
+        Set our subbands from their numbers, without saving.
+        """
+        subband_set = SubbandSet(numbers)
+        self.subband_ranges = subband_set.encode()
+        self.n_subbands = len(subband_set)
 
-    def _update_status(self):
-        n_sbs = self.subbands.count()
+    def _compute_status(self):
+        """
+        Return the (archived, on_cep) state implied by our SubbandData.
+        """
+        n_sbs = self.n_subbands
 
         # If all our subbands are archived, we are archived.
         n_archived = self.subbanddata_set.exclude(archive=None).count()
         if n_archived == n_sbs:
-            self.archived = Constants.TRUE
+            archived = Constants.TRUE
         elif n_archived > 0:
-            self.archived = Constants.PARTIAL
+            archived = Constants.PARTIAL
         else:
-            self.archived = Constants.FALSE
+            archived = Constants.FALSE
 
         # If all our subbands are on CEP, we are on CEP.
         n_on_cep = self.subbanddata_set.exclude(hostname="", path="").count()
         if n_on_cep == n_sbs:
-            self.on_cep = Constants.TRUE
+            on_cep = Constants.TRUE
         elif n_on_cep > 0:
-            self.on_cep = Constants.PARTIAL
+            on_cep = Constants.PARTIAL
         else:
-            self.on_cep = Constants.FALSE
+            on_cep = Constants.FALSE
+
+        return archived, on_cep
 
+    def _update_status(self):
+        self.archived, self.on_cep = self._compute_status()
         self.save()
 
     def __unicode__(self):
@@ -318,7 +885,10 @@ class SubbandData(models.Model):
 
     def save(self, *args, **kwargs):
         super(SubbandData, self).save(*args, **kwargs)
-        self.beam._update_status()
+        if pending_status() is not None:
+            pending_status().beams.add(self.beam_id)
+        else:
+            self.beam._update_status()
 
     def __unicode__(self):
         return self.beam.observation.obsid + " SAP" + str(self.beam.beam) + " SB" + str(self.number)
@@ -0,0 +1,159 @@
+# Generation of the package descriptions which map MSSS slices to MoM IDs.
+# Originally requested by Alwin de Jong, 2012-09-06.
+#
+# Every target Field which has data on CEP is split into groups of n_slices
+# Beams, in time order, and each group is described in a package which lists
+# the MoM IDs of the target observations and of the calibrator scans which
+# precede them.
+#
+# Everything needed is fetched up front with a fixed number of queries
+# (chunked where the lists of ids are long), rather than walking the
+# relations of each Field, Beam and Observation in turn.
+
+from collections import defaultdict
+from itertools import izip
+
+from .models import Field, Observation, Beam, ParsetKey, Constants
+from .utils import chunked
+
+N_SLICES = 9
+# Only the first three beams of each target observation are described.
+N_TARGET_BEAMS = 3
+
+def mom_id_key(beam):
+    return "Observation.Beam[%d].momID" % (beam,)
+
+class MomIds(object):
+    # MoM IDs of a set of Observations, as read from their indexed parsets.
+    def __init__(self, obsids):
+        self.mom_ids = {}
+        keys = [mom_id_key(beam) for beam in range(N_TARGET_BEAMS)]
+        for ids in chunked(obsids):
+            for obsid, key, value in ParsetKey.objects.filter(
+                observation__in=ids, key__in=keys
+            ).values_list('observation', 'key', 'value'):
+                self.mom_ids[(obsid, key)] = value
+
+    def get(self, obsid, beam):
+        # A value which isn't a number is as good as missing.
+        try:
+            return int(self.mom_ids[(obsid, mom_id_key(beam))])
+        except (KeyError, ValueError):
+            raise RuntimeError("No MoM ID for %s beam %d" % (obsid, beam))
+
+def previous_observations(obsids):
+    """
+    Return a dict mapping each of obsids to the obsid of the Observation
+    which precedes it, as returned by get_previous_by_start_time().
+
+    The calibrator recorded by pair_calibrators() is used where there is one;
+    otherwise the observations are scanned in time order.
+    """
+    previous = {}
+    for ids in chunked(obsids):
+        previous.update(
+            Observation.objects.filter(pk__in=ids, calibrator__isnull=False).values_list('pk', 'calibrator')
+        )
+    wanted = set(obsids).difference(previous)
+    if not wanted:
+        return previous
+    last = None
+    # Ties in start time are broken by primary key, as Django does.
+    for obsid in Observation.objects.order_by('start_time', 'pk').values_list('pk', flat=True):
+        if obsid in wanted:
+            if last is None:
+                raise Observation.DoesNotExist(
+                    "No Observation precedes %s" % (obsid,)
+                )
+            previous[obsid] = last
+        last = obsid
+    return previous
+
+def generate_packages(project_name, n_slices=N_SLICES, log=None):
+    """
+    Return a list of (package name, contents) tuples for each group of
+    n_slices Beams with data on CEP in the survey named project_name. Progress
+    is reported by calling log, if given, with a line of text.
+    """
+    log = log or (lambda message: None)
+
+    fields = list(Field.objects.filter(survey__name=project_name))
+    beams = defaultdict(list)
+    for beam in Beam.objects.filter(
+        field__survey__name=project_name
+    ).select_related('observation'):
+        beams[beam.field_id].append(beam)
+
+    # Work out which Fields we'll describe before looking up anything else.
+    # Each entry is a Field and either the reason it is skipped or its groups
+    # of Beams.
+    groups = []
+    for field in fields:
+        if field.name == "NCP":
+            groups.append((field, "Skipping NCP"))
+        elif field.calibrator:
+            groups.append((field, "Skipping %s: Calibrator" % (field.name)))
+        elif not field.on_cep in (Constants.TRUE, Constants.PARTIAL):
+            groups.append((field, "Skipping %s: not on CEP" % (field.name)))
+        elif len(beams[field.pk]) % n_slices:
+            groups.append((field, "%s is a problem: %d beams" % (field.name, len(beams[field.pk]))))
+        else:
+            groups.append((field, list(izip(*[iter(beams[field.pk])]*n_slices))))
+
+    targets = set(
+        beam.observation_id for field, beam_groups in groups
+        if not isinstance(beam_groups, basestring)
+        for beam_group in beam_groups for beam in beam_group
+    )
+    previous = previous_observations(targets)
+    calibrators = set(previous.itervalues())
+    calibrator_beams = defaultdict(list)
+    for ids in chunked(calibrators):
+        for obsid, field_name in Beam.objects.filter(
+            observation__in=ids
+        ).values_list('observation', 'field__name'):
+            calibrator_beams[obsid].append(field_name)
+    mom_ids = MomIds(targets | calibrators)
+
+    packages = []
+    for field, beam_groups in groups:
+        if isinstance(beam_groups, basestring):
+            log(beam_groups)
+            continue
+        log("Processing %s" % (field.name))
+
+        for beam_group in beam_groups:
+            lines = []
+            start_time = beam_group[0].observation.start_time
+            package_name = "%d_Slices_%s" % (n_slices, start_time.strftime("%b%d_%H:%M"))
+            package_description = "%s %s %d-slices" % (start_time.strftime("%b%d %H:%M"), project_name, n_slices)
+            lines.append("projectName=%s;" % (project_name,))
+            lines.append("packageName=%s;" % (package_name,))
+            lines.append("packageDescription=%s;" % (package_description,))
+
+            have_data = False
+            for ctr, beam in enumerate(beam_group):
+                if beam.on_cep in (Constants.TRUE, Constants.PARTIAL):
+                    have_data = True
+                n_slice = ctr+1
+                obsid = beam.observation_id
+                cal_obsid = previous[obsid]
+                assert(len(calibrator_beams[cal_obsid]) == 1)
+                lines.append("")
+                lines.append("slice%d.calibrator.mom2Id:mom2Id=%d;" % (n_slice, mom_ids.get(cal_obsid, 0)-1))
+                lines.append("slice%d.calibrator.calibratorSource=%s;" % (n_slice, calibrator_beams[cal_obsid][0]))
+                lines.append("slice%d.beam0.mom2Id:mom2Id=%d;" % (n_slice, mom_ids.get(cal_obsid, 0),))
+                lines.append("slice%d.target.mom2Id:mom2Id=%d;" % (n_slice, mom_ids.get(obsid, 0)-1))
+
+                for n_beam in range(N_TARGET_BEAMS):
+                    try:
+                        lines.append("slice%d.beam%d.mom2Id:mom2Id=%d;" % (n_slice, n_beam+1, mom_ids.get(obsid, n_beam)))
+                    except RuntimeError:
+                        log("Observation %s missing beam %d" % (obsid, n_beam))
+
+            if have_data:
+                log("Data on CEP; writing out description")
+                packages.append((package_name, "".join(line + "\n" for line in lines)))
+            else:
+                log("No data on CEP")
+    return packages
@@ -0,0 +1,77 @@
+# Identification of MSSS LBA observing runs in a time-ordered list of
+# observations.
+#
+# A run alternates calibrator scans, all of the same calibrator, with
+# multi-beam target observations. A high declination run consists of 72
+# observations, cycling through four sets of target fields; a low
+# declination run of 54, cycling through three.
+
+# (number of observations, number of observations per cycle)
+HIGH_DEC = (72, 8)
+LOW_DEC = (54, 6)
+
+# Number of beams which each target observation may have.
+TARGET_BEAMS = (3, 4)
+# Only the first three beams of each target observation need to repeat.
+N_TARGET_BEAMS = 3
+
+def _runs(values, valid, offset):
+    # For each index i, the number of consecutive entries i, i+offset,
+    # i+2*offset... which are valid and equal to values[i].
+    runs = [0] * len(values)
+    for i in xrange(len(values) - 1, -1, -1):
+        if valid(i):
+            runs[i] = 1
+            if i + offset < len(values) and runs[i+offset] and values[i+offset] == values[i]:
+                runs[i] += runs[i+offset]
+    return runs
+
+def find_runs(features):
+    """
+    Identify MSSS LBA runs.
+
+    features is a list, in order of start time, of (calibrator, n_beams,
+    positions) tuples describing each observation: the name of the
+    calibrator it observes (or False if it isn't a calibrator scan), the
+    number of beams, and a sequence of their positions.
+
+    Returns a list of (start index, length) tuples. Runs are allocated by
+    scanning forward through the observations, trying a high declination run
+    before a low declination one at each position; no observation is
+    allocated to more than one run.
+    """
+    n_obs = len(features)
+    calibrators = [feature[0] for feature in features]
+    n_beams = [feature[1] for feature in features]
+    targets = [tuple(feature[2][:N_TARGET_BEAMS]) for feature in features]
+
+    # Every second observation is of the same calibrator...
+    calibrator_runs = _runs(calibrators, lambda i: calibrators[i] is not False, 2)
+    # ...and those in between have the same number of beams...
+    n_beams_runs = _runs(n_beams, lambda i: n_beams[i] in TARGET_BEAMS, 2)
+    # ...and each target observation is of the same fields as the one a
+    # cycle later.
+    repeat_runs = {}
+    for length, cycle in (HIGH_DEC, LOW_DEC):
+        repeats = [
+            i + cycle < n_obs and targets[i] == targets[i+cycle]
+            for i in xrange(n_obs)
+        ]
+        repeat_runs[cycle] = _runs(repeats, lambda i: repeats[i], 2)
+
+    def is_run(start, length, cycle):
+        return (
+            start + length <= n_obs and
+            calibrator_runs[start] >= length / 2 and
+            n_beams_runs[start+1] >= length / 2 and
+            (length == cycle or repeat_runs[cycle][start+1] >= (length - cycle) / 2)
+        )
+
+    runs = []
+    allocated_until = 0
+    for start in xrange(n_obs):
+        for length, cycle in (HIGH_DEC, LOW_DEC):
+            if start >= allocated_until and is_run(start, length, cycle):
+                runs.append((start, length))
+                allocated_until = start + length
+    return runs
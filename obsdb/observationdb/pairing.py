@@ -0,0 +1,46 @@
+# Pairing of target observations with their calibrator scans.
+#
+# Each target observation is preceded by a scan of a calibrator: an
+# Observation with a single Beam, on a calibrator Field. Rather than every
+# consumer searching back through the observations in time order, the pairing
+# is recorded as Observation.calibrator.
+
+from collections import defaultdict
+
+from .models import Observation, Beam
+from .utils import chunked
+
+def pair_calibrators():
+    """
+    Set the calibrator of every Observation to the calibrator scan which
+    immediately precedes it (in the order of get_previous_by_start_time()),
+    or to None if it is itself a calibrator scan or isn't preceded by one.
+
+    Returns the number of Observations which changed.
+    """
+    calibrator_fields = defaultdict(list)
+    for obsid, calibrator in Beam.objects.values_list(
+        'observation', 'field__calibrator'
+    ).order_by():
+        calibrator_fields[obsid].append(calibrator)
+
+    def is_calibrator_scan(obsid):
+        return calibrator_fields[obsid] == [True]
+
+    changes = defaultdict(list)
+    previous = None
+    for obsid, calibrator in Observation.objects.order_by(
+        'start_time', 'pk'
+    ).values_list('pk', 'calibrator'):
+        new_calibrator = None
+        if (previous is not None and is_calibrator_scan(previous) and
+            calibrator_fields[obsid] and not is_calibrator_scan(obsid)):
+            new_calibrator = previous
+        if new_calibrator != calibrator:
+            changes[new_calibrator].append(obsid)
+        previous = obsid
+
+    for calibrator, obsids in changes.iteritems():
+        for ids in chunked(obsids):
+            Observation.objects.filter(pk__in=ids).update(calibrator=calibrator)
+    return sum(len(obsids) for obsids in changes.itervalues())
@@ -0,0 +1,158 @@
+# A lightweight, pure-Python reader for LOFAR parameter sets ("parsets").
+#
+# This supports the subset of the lofar.parameterset interface needed to
+# ingest observations, without requiring the LOFAR software stack. Files are
+# read line by line, and only the keys which are asked for are kept.
+
+import re
+
+# A range of integers, optionally with a common prefix and zero padding, such
+# as 0..243 or CS001..CS007.
+RANGE = re.compile(r"^(?P<prefix>\D*?)(?P<first>\d+)\.\.(?P=prefix)?(?P<last>\d+)$")
+# A repeated value, such as 10*LBA.
+REPEAT = re.compile(r"^(?P<count>\d+)\s*\*\s*(?P<value>.+)$")
+
+def unquote(value):
+    """
+    Remove matching single or double quotes surrounding value.
+    """
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in "\"'":
+        return value[1:-1]
+    return value
+
+def _split(value):
+    # Split a comma-separated list at the top level, ignoring commas within
+    # brackets or quotes.
+    items, depth, quote, current = [], 0, None, []
+    for char in value:
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in "\"'":
+            quote = char
+        elif char in "[(":
+            depth += 1
+        elif char in "])":
+            depth -= 1
+        elif char == "," and depth == 0:
+            items.append("".join(current).strip())
+            current = []
+            continue
+        current.append(char)
+    items.append("".join(current).strip())
+    return [item for item in items if item]
+
+def expand(value):
+    """
+    Expand a parset vector, such as "[0..3,10*7]" or "[2*CS001..CS002]", to
+    a list of strings, following the lofar.parameterset range and repetition
+    syntax.
+    """
+    value = value.strip()
+    if value.startswith("[") and value.endswith("]"):
+        value = value[1:-1]
+    result = []
+    for item in _split(value):
+        repeat = REPEAT.match(item)
+        if repeat:
+            result.extend(expand(repeat.group("value")) * int(repeat.group("count")))
+            continue
+        if item.startswith("[") or item.startswith("("):
+            result.extend(expand(item[1:-1]))
+            continue
+        item = unquote(item)
+        match = RANGE.match(item)
+        if match:
+            first, last = int(match.group("first")), int(match.group("last"))
+            width = len(match.group("first"))
+            step = 1 if last >= first else -1
+            result.extend(
+                "%s%0*d" % (match.group("prefix"), width, n)
+                for n in xrange(first, last + step, step)
+            )
+        else:
+            result.append(item)
+    return result
+
+
+class ParameterSet(object):
+    """
+    The contents of a parset, read from a file or any iterable of lines.
+
+    If keys is given, only keys for which it returns true are kept: it may be
+    any callable, or a compiled regular expression which is matched against
+    the start of each key.
+
+    As with lofar.parameterset, asking for a missing key raises RuntimeError.
+    """
+    def __init__(self, source, keys=None):
+        if isinstance(keys, type(RANGE)):
+            keys = keys.match
+        self._values = {}
+        if isinstance(source, basestring):
+            with open(source, 'r') as f:
+                self._read(f, keys)
+        else:
+            self._read(source, keys)
+
+    @classmethod
+    def from_string(cls, text, keys=None):
+        return cls(text.splitlines(), keys)
+
+    def _read(self, lines, keys):
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith("#") or not "=" in line:
+                continue
+            key, value = line.split("=", 1)
+            key = key.strip()
+            if keys and not keys(key):
+                continue
+            self._values[key] = self._strip_comment(value.strip())
+
+    @staticmethod
+    def _strip_comment(value):
+        if "#" in value:
+            quote = None
+            for position, char in enumerate(value):
+                if quote:
+                    if char == quote:
+                        quote = None
+                elif char in "\"'":
+                    quote = char
+                elif char == "#":
+                    return value[:position].rstrip()
+        return value
+
+    def keys(self):
+        return self._values.keys()
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def _get(self, key):
+        try:
+            return self._values[key]
+        except KeyError:
+            raise RuntimeError("Key %s unknown" % (key,))
+
+    def getString(self, key):
+        return unquote(self._get(key))
+
+    def getInt(self, key):
+        return int(self.getString(key))
+
+    def getFloat(self, key):
+        return float(self.getString(key))
+
+    def getStringVector(self, key, expandable=False):
+        value = self._get(key)
+        if expandable:
+            return expand(value)
+        value = value.strip()
+        if value.startswith("[") and value.endswith("]"):
+            value = value[1:-1]
+        return [unquote(item) for item in _split(value)]
+
+    def getIntVector(self, key, expandable=False):
+        return [int(item) for item in self.getStringVector(key, expandable)]
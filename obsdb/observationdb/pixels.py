@@ -0,0 +1,91 @@
+# A simple equal-area-ish pixelisation of the sky, used to index Field
+# positions for cone searches.
+#
+# The sky is divided into zones of constant declination, each ZONE_HEIGHT
+# high. Each zone is divided into cells of equal right ascension, the number
+# of which shrinks towards the poles so that cells are never wider than they
+# are high. Pixels are numbered contiguously, first by zone and then by cell,
+# so that a run of cells within a zone -- or a run of whole zones -- is a
+# single range of pixel numbers.
+
+import math
+
+ZONE_HEIGHT = math.radians(1.0)
+N_ZONES = int(round(math.pi / ZONE_HEIGHT))
+
+# Slop to avoid losing objects to rounding errors at pixel edges.
+EPSILON = 1e-9
+
+def _cells_in_zone(zone):
+    # Use the edge of the zone closest to the equator, where it is widest.
+    lower = -math.pi/2 + zone * ZONE_HEIGHT
+    upper = lower + ZONE_HEIGHT
+    if lower <= 0 <= upper:
+        width = 1.0
+    else:
+        width = max(math.cos(lower), math.cos(upper))
+    return max(1, int(2 * math.pi * width / ZONE_HEIGHT))
+
+CELLS_IN_ZONE = [_cells_in_zone(zone) for zone in range(N_ZONES)]
+ZONE_OFFSET = [sum(CELLS_IN_ZONE[:zone]) for zone in range(N_ZONES)]
+N_PIXELS = sum(CELLS_IN_ZONE)
+
+def _zone(dec):
+    return min(N_ZONES - 1, max(0, int((dec + math.pi/2) / ZONE_HEIGHT)))
+
+def _cell(ra, zone):
+    n_cells = CELLS_IN_ZONE[zone]
+    return min(n_cells - 1, int((ra % (2 * math.pi)) / (2 * math.pi) * n_cells))
+
+def sky_pixel(ra, dec):
+    """
+    Return the number of the pixel containing ra, dec (given in radians).
+    """
+    zone = _zone(dec)
+    return ZONE_OFFSET[zone] + _cell(ra, zone)
+
+def cone_pixel_ranges(ra, dec, radius):
+    """
+    Return a list of (first, last) inclusive ranges of pixel numbers which,
+    between them, cover all of the sky within radius of ra, dec. All arguments
+    are in radians.
+
+    Returns None if the cone covers the whole sky.
+    """
+    if radius >= math.pi:
+        return None
+
+    dec_min = dec - radius - EPSILON
+    dec_max = dec + radius + EPSILON
+    if dec_min <= -math.pi/2 or dec_max >= math.pi/2:
+        # The cone contains a pole, so covers all right ascensions.
+        half_width = math.pi
+    else:
+        # The greatest extent in right ascension of a small circle which
+        # doesn't contain a pole.
+        half_width = math.asin(
+            min(1.0, math.sin(radius) / math.cos(dec))
+        ) + EPSILON
+
+    ranges = []
+    for zone in range(_zone(dec_min), _zone(dec_max) + 1):
+        offset, n_cells = ZONE_OFFSET[zone], CELLS_IN_ZONE[zone]
+        if 2 * half_width >= 2 * math.pi * (n_cells - 1) / n_cells:
+            zone_ranges = [(offset, offset + n_cells - 1)]
+        else:
+            first = _cell(ra - half_width, zone)
+            last = _cell(ra + half_width, zone)
+            if first <= last:
+                zone_ranges = [(offset + first, offset + last)]
+            else:
+                # Wraps around RA = 0.
+                zone_ranges = [
+                    (offset, offset + last),
+                    (offset + first, offset + n_cells - 1)
+                ]
+        for first, last in zone_ranges:
+            if ranges and ranges[-1][1] + 1 >= first:
+                ranges[-1] = (ranges[-1][0], max(last, ranges[-1][1]))
+            else:
+                ranges.append((first, last))
+    return ranges
@@ -0,0 +1,161 @@
+# Optional per-request instrumentation.
+#
+# When settings.PROFILE_REQUESTS is true, RequestProfileMiddleware records the
+# number of SQL queries run, the time spent in them, the time spent rendering
+# templates and the total time taken to handle each request. The figures are
+# added to the response as headers, written to the "obsdb.profiling" log and
+# accumulated per URL pattern for ProfileView. When the setting is false, the
+# middleware removes itself at startup, so costs nothing.
+
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.http import Http404
+from django.template.base import Template
+from django.views.generic import TemplateView
+
+logger = logging.getLogger("obsdb.profiling")
+
+def profiling_enabled():
+    return getattr(settings, "PROFILE_REQUESTS", False)
+
+# The profile of the request being handled by this thread, if any.
+_current = threading.local()
+
+def _timed(render):
+    # Wrap Template._render to add the time taken by each outermost template
+    # render, whether by a TemplateResponse or within the view, to the
+    # current request's profile. Included and extended templates are counted
+    # as part of the template which rendered them.
+    def timed_render(self, context):
+        profile = getattr(_current, "profile", None)
+        if profile is None or profile["rendering"]:
+            return render(self, context)
+        profile["rendering"] = True
+        start = time.time()
+        try:
+            return render(self, context)
+        finally:
+            profile["render_time"] += time.time() - start
+            profile["rendering"] = False
+    timed_render.timed = True
+    return timed_render
+
+
+class EndpointStats(object):
+    """
+    Running totals of the figures recorded for each endpoint.
+    """
+    FIGURES = ("queries", "query_time", "render_time", "total_time")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.endpoints = {}
+
+    def add(self, endpoint, figures):
+        with self.lock:
+            stats = self.endpoints.setdefault(
+                endpoint, dict([("requests", 0)] + [(name, 0) for name in self.FIGURES] + [("max_time", 0)])
+            )
+            stats["requests"] += 1
+            for name in self.FIGURES:
+                stats[name] += figures[name]
+            stats["max_time"] = max(stats["max_time"], figures["total_time"])
+
+    def slowest(self, limit=None):
+        """
+        Return a list of dicts describing each endpoint, giving the mean of
+        each figure per request, in descending order of mean total time.
+        """
+        with self.lock:
+            summary = []
+            for endpoint, stats in self.endpoints.iteritems():
+                entry = {"endpoint": endpoint, "requests": stats["requests"], "max_time": stats["max_time"]}
+                for name in self.FIGURES:
+                    entry[name] = stats[name] / float(stats["requests"])
+                summary.append(entry)
+        summary.sort(key=lambda entry: entry["total_time"], reverse=True)
+        return summary[:limit]
+
+endpoint_stats = EndpointStats()
+
+
+class RequestProfileMiddleware(object):
+    def __init__(self):
+        if not profiling_enabled():
+            raise MiddlewareNotUsed
+        if not getattr(Template._render, "timed", False):
+            Template._render = _timed(Template._render)
+
+    def process_request(self, request):
+        # Query logging is normally only enabled when DEBUG is set.
+        request._profile = {
+            "start": time.time(),
+            "first_query": len(connection.queries),
+            "debug_cursor": connection.use_debug_cursor,
+            "rendering": False,
+            "render_time": 0.0,
+        }
+        _current.profile = request._profile
+        connection.use_debug_cursor = True
+
+    def process_response(self, request, response):
+        profile = getattr(request, "_profile", None)
+        if profile is None:
+            return response
+        queries = connection.queries[profile["first_query"]:]
+        connection.use_debug_cursor = profile["debug_cursor"]
+        _current.profile = None
+        figures = {
+            "queries": len(queries),
+            "query_time": sum(float(query["time"]) for query in queries),
+            "render_time": profile["render_time"],
+            "total_time": time.time() - profile["start"],
+        }
+
+        response["X-Query-Count"] = str(figures["queries"])
+        for name in ("query_time", "render_time", "total_time"):
+            response["X-%s" % name.title().replace("_", "-")] = "%.1f ms" % (1000 * figures[name])
+
+        resolver_match = getattr(request, "resolver_match", None)
+        endpoint = resolver_match.url_name if resolver_match else None
+        endpoint = endpoint or request.path_info
+        endpoint_stats.add(endpoint, figures)
+        logger.info(
+            "%s %s: %d queries in %.1f ms; rendered in %.1f ms; total %.1f ms",
+            request.method, request.path_info, figures["queries"],
+            1000 * figures["query_time"], 1000 * figures["render_time"],
+            1000 * figures["total_time"]
+        )
+        return response
+
+
+class ProfileView(TemplateView):
+    """
+    Summarise the slowest endpoints since the server started.
+    """
+    template_name = "profile.html"
+
+    def get(self, request, *args, **kwargs):
+        if not profiling_enabled():
+            raise Http404
+        if "reset" in request.GET:
+            endpoint_stats.reset()
+        return super(ProfileView, self).get(request, *args, **kwargs)
+
+    def get_context_data(self, **kwargs):
+        context = super(ProfileView, self).get_context_data(**kwargs)
+        endpoints = endpoint_stats.slowest()
+        for entry in endpoints:
+            for name in ("query_time", "render_time", "total_time", "max_time"):
+                entry[name] *= 1000
+        context["endpoints"] = endpoints
+        return context
@@ -0,0 +1,238 @@
+# Set-based recalculation of the archived/on_cep status of Beams, Observations
+# and Fields, and of the number of Beams and status_code of Observations and
+# Fields.
+#
+# This follows exactly the same rules as Beam._compute_status() and
+# DataStatus._compute_status(), but rather than issuing several COUNT queries
+# per object it gathers the counts for every object in scope with a handful of
+# GROUP BY queries and then writes the changed rows back with bulk UPDATEs.
+
+from collections import defaultdict
+
+from django.db.models import Count, Q
+
+from .models import Constants, Survey, Field, Observation, Beam, SubbandData
+from .models import SurveyStats
+from .utils import chunked
+
+
+def _grouped_count(queryset, group):
+    # Returns a dict mapping each value of group to the number of rows in
+    # queryset which have it. Clearing the ordering is required, since the
+    # default ordering would otherwise be added to the GROUP BY.
+    return dict(
+        queryset.values_list(group).annotate(n=Count('pk')).order_by()
+    )
+
+def _classify(n_true, n_any, n_required):
+    if n_true >= n_required:
+        return Constants.TRUE
+    elif n_any > 0:
+        return Constants.PARTIAL
+    else:
+        return Constants.FALSE
+
+def _apply(model, changes):
+    # changes maps primary key to a tuple of (fieldname, value) pairs; rows
+    # which need identical changes are updated together.
+    by_value = defaultdict(list)
+    for pk, values in changes.iteritems():
+        by_value[values].append(pk)
+    for values, pks in by_value.iteritems():
+        for ids in chunked(pks):
+            model.objects.filter(pk__in=ids).update(**dict(values))
+    return len(changes)
+
+
+def update_beams(beams):
+    """
+    Recalculate the status of all Beams in the QuerySet beams from their
+    SubbandData. Returns the number of Beams which changed.
+    """
+    subband_data = SubbandData.objects.filter(beam__in=beams)
+    n_archived = _grouped_count(subband_data.exclude(archive=None), 'beam')
+    n_on_cep = _grouped_count(subband_data.exclude(hostname="", path=""), 'beam')
+
+    changes = {}
+    for pk, archived, on_cep, n_sbs in beams.values_list(
+        'pk', 'archived', 'on_cep', 'n_subbands'
+    ).order_by():
+        new_status = []
+        for count in (n_archived.get(pk, 0), n_on_cep.get(pk, 0)):
+            # A Beam is only complete if it has exactly as much data as it
+            # has subbands.
+            if count == n_sbs:
+                new_status.append(Constants.TRUE)
+            elif count > 0:
+                new_status.append(Constants.PARTIAL)
+            else:
+                new_status.append(Constants.FALSE)
+        if (archived, on_cep) != tuple(new_status):
+            changes[pk] = (('archived', new_status[0]), ('on_cep', new_status[1]))
+    return _apply(Beam, changes)
+
+def update_beam_counts(objects):
+    """
+    Recount the Beams of each Observation or Field in the QuerySet objects,
+    and update their status codes to match. Returns the number of objects
+    which changed.
+    """
+    model = objects.model
+    group = model.__name__.lower()
+    n_beams = _grouped_count(Beam.objects.filter(**{group + "__in": objects}), group)
+    # Only Fields can be calibrators.
+    extra = ('calibrator',) if model is Field else ()
+    changes = {}
+    for row in objects.values_list(
+        'pk', 'n_beams', 'archived', 'on_cep', 'status_code', *extra
+    ).order_by():
+        pk, old_n_beams, archived, on_cep, old_code = row[:5]
+        new_n_beams = n_beams.get(pk, 0)
+        new_code = model.status_code_for(archived, on_cep, new_n_beams, *row[5:])
+        if (old_n_beams, old_code) != (new_n_beams, new_code):
+            changes[pk] = (('n_beams', new_n_beams), ('status_code', new_code))
+    return _apply(model, changes)
+
+def delete_beams(beams):
+    """
+    Delete the Beams in the QuerySet beams, and their SubbandData, then
+    recount the Beams of the Observations and Fields which contained them and
+    update the SurveyStats of their Surveys. Returns the number of Beams
+    deleted.
+    """
+    observations, fields, surveys = set(), set(), set()
+    n_beams = 0
+    for observation, field, survey in beams.values_list(
+        'observation', 'field', 'field__survey'
+    ).order_by():
+        observations.add(observation)
+        fields.add(field)
+        surveys.add(survey)
+        n_beams += 1
+    beams.delete()
+    for ids in chunked(observations):
+        update_beam_counts(Observation.objects.filter(pk__in=ids))
+    for ids in chunked(fields):
+        update_beam_counts(Field.objects.filter(pk__in=ids))
+    SurveyStats.recount(surveys)
+    return n_beams
+
+def _beam_counts(beams, group):
+    # Counts of valid beams, grouped by Observation or Field, which are
+    # archived/on CEP either entirely or at all.
+    valid = beams.filter(observation__invalid=False)
+    return (
+        _grouped_count(valid.filter(archived=Constants.TRUE), group),
+        _grouped_count(
+            valid.filter(Q(archived=Constants.TRUE) | Q(archived=Constants.PARTIAL)),
+            group
+        ),
+        _grouped_count(valid.filter(on_cep=Constants.TRUE), group),
+        _grouped_count(
+            valid.filter(Q(on_cep=Constants.TRUE) | Q(on_cep=Constants.PARTIAL)),
+            group
+        ),
+    )
+
+def update_observations(observations):
+    """
+    Recalculate the status of all Observations in the QuerySet observations
+    from their Beams. Returns the number of Observations which changed.
+    """
+    beams = Beam.objects.filter(observation__in=observations)
+    arc_true, arc_any, cep_true, cep_any = _beam_counts(beams, 'observation')
+
+    changes = {}
+    for pk, archived, on_cep, n_beams, code in observations.values_list(
+        'pk', 'archived', 'on_cep', 'n_beams', 'status_code'
+    ).order_by():
+        new_archived = _classify(arc_true.get(pk, 0), arc_any.get(pk, 0), n_beams)
+        new_on_cep = _classify(cep_true.get(pk, 0), cep_any.get(pk, 0), n_beams)
+        new_code = Observation.status_code_for(new_archived, new_on_cep, n_beams)
+        if (archived, on_cep, code) != (new_archived, new_on_cep, new_code):
+            changes[pk] = (
+                ('archived', new_archived), ('on_cep', new_on_cep), ('status_code', new_code)
+            )
+    return _apply(Observation, changes)
+
+def update_fields(fields):
+    """
+    Recalculate the status of all Fields in the QuerySet fields from their
+    Beams, requiring beams_per_field complete Beams as defined by the Survey.
+    Fields which become complete are marked as done, and the Surveys
+    containing changed Fields are saved and their SurveyStats recounted.
+    Returns the number of Fields which changed.
+    """
+    beams = Beam.objects.filter(field__in=fields)
+    arc_true, arc_any, cep_true, cep_any = _beam_counts(beams, 'field')
+
+    changes = {}
+    surveys = set()
+    for pk, archived, on_cep, done, calibrator, survey, required, n_beams, code in fields.values_list(
+        'pk', 'archived', 'on_cep', 'done', 'calibrator', 'survey',
+        'survey__beams_per_field', 'n_beams', 'status_code'
+    ).order_by():
+        new_archived = _classify(arc_true.get(pk, 0), arc_any.get(pk, 0), required)
+        new_on_cep = _classify(cep_true.get(pk, 0), cep_any.get(pk, 0), required)
+        new_done = done or Constants.TRUE in (new_archived, new_on_cep)
+        new_code = Field.status_code_for(new_archived, new_on_cep, n_beams, calibrator)
+        if (archived, on_cep, done, code) != (new_archived, new_on_cep, new_done, new_code):
+            changes[pk] = (
+                ('archived', new_archived), ('on_cep', new_on_cep), ('done', new_done),
+                ('status_code', new_code)
+            )
+            surveys.add(survey)
+    for survey in Survey.objects.filter(pk__in=surveys):
+        survey.save()
+    n_changed = _apply(Field, changes)
+    SurveyStats.recount(surveys)
+    return n_changed
+
+def update_from_beams(beam_ids):
+    """
+    Recalculate the status of the Beams with primary keys beam_ids, then of
+    the Observations and Fields which contain them. Returns a dict of the
+    number of objects of each type which changed.
+    """
+    changed = {"beams": 0, "observations": 0, "fields": 0}
+    observations, fields = set(), set()
+    for ids in chunked(beam_ids):
+        beams = Beam.objects.filter(pk__in=ids)
+        changed["beams"] += update_beams(beams)
+        for observation, field in beams.values_list('observation', 'field').order_by():
+            observations.add(observation)
+            fields.add(field)
+    for ids in chunked(observations):
+        changed["observations"] += update_observations(Observation.objects.filter(pk__in=ids))
+    for ids in chunked(fields):
+        changed["fields"] += update_fields(Field.objects.filter(pk__in=ids))
+    return changed
+
+def recompute_status(survey=None):
+    """
+    Recalculate the status of every Beam, Observation and Field, or only of
+    those belonging to survey if it is given. Returns a dict of the number of
+    objects of each type which changed.
+    """
+    beams = Beam.objects.all()
+    observations = Observation.objects.all()
+    fields = Field.objects.all()
+    if survey:
+        beams = beams.filter(field__survey=survey)
+        observations = observations.filter(
+            pk__in=beams.values('observation')
+        )
+        fields = fields.filter(survey=survey)
+
+    # Observations and Fields are derived from Beams, so must come last.
+    update_beam_counts(observations)
+    update_beam_counts(fields)
+    changed = {
+        "beams": update_beams(beams),
+        "observations": update_observations(observations),
+        "fields": update_fields(fields),
+    }
+    # update_fields() only recounts the SurveyStats of Surveys whose Fields
+    # changed status, not of those whose Fields' Beam counts changed.
+    SurveyStats.recount([survey.pk] if survey else Survey.objects.values_list('pk', flat=True))
+    return changed
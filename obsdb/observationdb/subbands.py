@@ -0,0 +1,98 @@
+# A compact representation of a set of subband numbers.
+#
+# Beams almost always observe one or a few contiguous blocks of subbands, so
+# a set is held as a sorted list of inclusive (first, last) ranges. It is
+# stored in the database as text using the parset range syntax, for example
+# "0..243" or "12..15,100,200..210".
+
+import posixpath
+from bisect import bisect_right
+from itertools import chain
+
+class SubbandSet(object):
+    def __init__(self, numbers=()):
+        self.ranges = []
+        for number in sorted(set(numbers)):
+            if self.ranges and self.ranges[-1][1] + 1 == number:
+                self.ranges[-1] = (self.ranges[-1][0], number)
+            else:
+                self.ranges.append((number, number))
+        self._starts = [first for first, last in self.ranges]
+        self._len = sum(last - first + 1 for first, last in self.ranges)
+
+    @classmethod
+    def decode(cls, text):
+        """
+        Create a SubbandSet from the output of encode().
+        """
+        subband_set = cls()
+        for item in text.split(","):
+            if not item:
+                continue
+            first, sep, last = item.partition("..")
+            subband_set.ranges.append((int(first), int(last or first)))
+        subband_set._starts = [first for first, last in subband_set.ranges]
+        subband_set._len = sum(last - first + 1 for first, last in subband_set.ranges)
+        return subband_set
+
+    def encode(self):
+        return ",".join(
+            str(first) if first == last else "%d..%d" % (first, last)
+            for first, last in self.ranges
+        )
+
+    def __len__(self):
+        return self._len
+
+    def __contains__(self, number):
+        index = bisect_right(self._starts, number) - 1
+        return index >= 0 and number <= self.ranges[index][1]
+
+    def __iter__(self):
+        return chain.from_iterable(
+            xrange(first, last + 1) for first, last in self.ranges
+        )
+
+    def __eq__(self, other):
+        return isinstance(other, SubbandSet) and self.ranges == other.ranges
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __str__(self):
+        return self.encode()
+
+    def __repr__(self):
+        return "SubbandSet(%r)" % (self.encode(),)
+
+
+def collapse_subband_data(rows):
+    """
+    Collapse rows of (number, subband, size, hostname, path, archive)
+    describing the SubbandData of a Beam, in order of number, into a list of
+    dicts. Each describes a run of consecutively numbered SubbandData with
+    the same host, directory and archive, giving their number of subbands
+    (as encoded by SubbandSet) and total size.
+    """
+    runs = []
+    current = None
+    for number, subband, size, hostname, path, archive in rows:
+        directory = posixpath.dirname(path)
+        if (
+            current and current["last"] + 1 == number and
+            (current["hostname"], current["path"], current["archive"]) == (hostname, directory, archive)
+        ):
+            current["last"] = number
+        else:
+            current = {
+                "first": number, "last": number, "hostname": hostname,
+                "path": directory, "archive": archive, "subbands": [], "size": None,
+            }
+            runs.append(current)
+        current["subbands"].append(subband)
+        if size is not None:
+            current["size"] = (current["size"] or 0) + size
+    for run in runs:
+        run["count"] = len(run["subbands"])
+        run["subbands"] = SubbandSet(run["subbands"]).encode()
+    return runs
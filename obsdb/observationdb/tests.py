@@ -5,7 +5,41 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
-from django.test import TestCase
+import datetime
+import fnmatch
+import json
+import math
+import os
+import random
+import re
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+from collections import Counter
+
+from django.core.management import call_command
+from django.db.models import Min, Max, Count, Q
+from django.core.urlresolvers import reverse
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+from django.utils.datastructures import SortedDict
+
+from .models import Survey, Field, Observation, Beam, Subband, SubbandData, Station
+from .models import ArchiveSite, Constants, DataStatus, ParsetText, ParsetKey, SurveyStats, deferred_status
+from .status import recompute_status, update_beam_counts, delete_beams
+from .crossmatch import FieldMatcher
+from .parset import ParameterSet, expand
+from .msss import find_runs
+from .ingest import bulk_upload
+from .locations import set_locations
+from .archive import mark_archived, mark_range_archived, obsid_range
+from .subbands import SubbandSet, collapse_subband_data
+from .pairing import pair_calibrators
+from .profiling import endpoint_stats
+from .grid import parse_angle, insert_grid
+from .pixels import sky_pixel
 
 
 class SimpleTest(TestCase):
@@ -14,3 +48,1366 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+def create_survey(name="Test Survey", beams_per_field=2, n_fields=3):
+    survey = Survey.objects.create(
+        name=name, field_size=1.0, beams_per_field=beams_per_field
+    )
+    for i in range(n_fields):
+        Field.objects.create(
+            name="%s field %d" % (name, i), survey=survey,
+            ra=0.1 * i, dec=0.05 * i, calibrator=(i == 0)
+        )
+    return survey
+
+def create_observation(obsid, fields, n_subbands=4, start_time=None):
+    # Creates an Observation with one Beam per field, each with n_subbands
+    # subbands, bypassing the status cascade but keeping the Beam counts.
+    if Subband.objects.count() < n_subbands:
+        Subband.objects.bulk_create(
+            [Subband(number=n) for n in range(Subband.objects.count(), n_subbands)]
+        )
+    observation = Observation.objects.create(
+        obsid=obsid, antennaset="LBA_INNER", duration=60, clock=200,
+        filter="LBA_30_90", parset="",
+        start_time=start_time or timezone.now()
+    )
+    sb_ctr = 0
+    for beam_number, field in enumerate(fields):
+        beam = Beam(observation=observation, field=field, beam=beam_number)
+        super(Beam, beam).save()
+        beam._count()
+        beam.subbands = Subband.objects.filter(number__lt=n_subbands)
+        SubbandData.objects.bulk_create([
+            SubbandData(
+                id="%s_%d" % (obsid, sb_ctr + n), beam=beam,
+                number=sb_ctr + n, subband_id=n
+            ) for n in range(n_subbands)
+        ])
+        sb_ctr += n_subbands
+    return observation
+
+def unencode_subbands():
+    # Moves every Beam's subbands to the table which held them before
+    # subband_ranges, as in a database which predates it.
+    Beam.legacy_subbands.through.objects.bulk_create([
+        Beam.legacy_subbands.through(beam_id=beam.pk, subband_id=subband)
+        for beam in Beam.objects.all() for subband in beam.subband_numbers
+    ])
+    Beam.objects.update(subband_ranges="", n_subbands=0)
+
+METADATA_DIR = os.path.join(
+    os.path.dirname(__file__), os.path.pardir, os.path.pardir, "metadata"
+)
+# As used by prime_db.sh.
+PARSET_DIR = os.path.join(
+    os.path.dirname(__file__), os.path.pardir, os.path.pardir, "data", "parsets"
+)
+
+try:
+    from lofar.parameterset import parameterset
+except ImportError:
+    parameterset = None
+
+def status_snapshot():
+    return (
+        list(Beam.objects.order_by('pk').values_list('archived', 'on_cep')),
+        list(Observation.objects.order_by('pk').values_list('archived', 'on_cep')),
+        list(Field.objects.order_by('pk').values_list('archived', 'on_cep', 'done')),
+    )
+
+
+class DeferredStatusTest(TestCase):
+    def setUp(self):
+        self.survey = create_survey(beams_per_field=1)
+        self.fields = list(self.survey.field_set.order_by('pk'))
+        self.site = ArchiveSite.objects.create(name="LTA")
+        for n in range(3):
+            create_observation("L%d" % n, self.fields[1:])
+
+    def _write(self):
+        # Archive everything in L0 & half of L1; mark L2 invalid.
+        for sb in SubbandData.objects.filter(beam__observation__obsid="L0"):
+            sb.archive = self.site
+            sb.save()
+        for sb in SubbandData.objects.filter(beam__observation__obsid="L1", number__lt=2):
+            sb.hostname, sb.path = "locus001", "/data/L1/%s" % sb.number
+            sb.save()
+        observation = Observation.objects.get(obsid="L2")
+        observation.invalid = True
+        observation.save()
+        for beam in observation.beam_set.all():
+            beam.save()
+
+    def test_matches_immediate_propagation(self):
+        self._write()
+        expected = status_snapshot()
+        SubbandData.objects.update(archive=None, hostname="", path="")
+        Observation.objects.update(invalid=False)
+        Beam.objects.update(archived=Constants.FALSE, on_cep=Constants.FALSE)
+        Observation.objects.update(archived=Constants.FALSE, on_cep=Constants.FALSE)
+        Field.objects.update(archived=Constants.FALSE, on_cep=Constants.FALSE, done=False)
+
+        with deferred_status():
+            self._write()
+            # Nothing has been propagated yet.
+            self.assertFalse(Beam.objects.exclude(archived=Constants.FALSE).exists())
+        self.assertEqual(status_snapshot(), expected)
+        self.assertTrue(Field.objects.get(pk=self.fields[1].pk).done)
+
+    def test_each_object_updated_once(self):
+        calls = Counter()
+        originals = {}
+        def counting(model):
+            def _update_status(obj, *args):
+                calls[(model.__name__, obj.pk)] += 1
+                return originals[model](obj, *args)
+            return _update_status
+        for model in (Beam, Observation, Field):
+            originals[model] = model._update_status.im_func
+            model._update_status = counting(model)
+        try:
+            with deferred_status() as batch:
+                with deferred_status() as inner:
+                    self.assertTrue(inner is batch)
+                    self._write()
+                self.assertFalse(calls)
+        finally:
+            for model, method in originals.iteritems():
+                model._update_status = method
+        # The Beams with changed SubbandData, and every Observation and
+        # Field, are each recalculated exactly once.
+        self.assertEqual(set(calls.values()), set([1]))
+        self.assertEqual(
+            Counter(model for model, pk in calls),
+            Counter({"Beam": 3, "Observation": 3, "Field": 2})
+        )
+
+
+class DeferredStatusRollbackTest(TransactionTestCase):
+    def test_exception_rolls_back_block(self):
+        survey = create_survey(beams_per_field=1)
+        create_observation("L0", survey.field_set.order_by('pk')[1:])
+        site = ArchiveSite.objects.create(name="LTA")
+        try:
+            with deferred_status():
+                for sb in SubbandData.objects.filter(beam__observation__obsid="L0"):
+                    sb.archive = site
+                    sb.save()
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        # Neither the writes nor their status changes were kept.
+        self.assertFalse(SubbandData.objects.exclude(archive=None).exists())
+        self.assertFalse(Beam.objects.exclude(archived=Constants.FALSE).exists())
+        # Subsequent writes are propagated immediately again.
+        sb = SubbandData.objects.get(id="L0_0")
+        sb.archive = site
+        sb.save()
+        self.assertEqual(Beam.objects.get(pk=sb.beam_id).archived, Constants.PARTIAL)
+
+
+class RecomputeStatusTest(TestCase):
+    def setUp(self):
+        self.site = ArchiveSite.objects.create(name="LTA")
+        for survey_name, beams_per_field in (("A", 2), ("B", 1)):
+            survey = create_survey(survey_name, beams_per_field)
+            fields = list(survey.field_set.order_by('pk'))
+            for n in range(4):
+                create_observation("L%s%d" % (survey_name, n), fields[n % 2:])
+        create_observation("LEMPTY", fields[:1], n_subbands=0)
+
+        # Build a variety of states through the per-object code path.
+        for sb in SubbandData.objects.filter(beam__observation__obsid__in=["LA0", "LA1", "LB0"]):
+            sb.archive = self.site
+            sb.save()
+        for sb in SubbandData.objects.filter(beam__observation__obsid="LA2", number=1):
+            sb.hostname, sb.path = "locus002", "/data/LA2/1"
+            sb.save()
+        observation = Observation.objects.get(obsid="LA1")
+        observation.invalid = True
+        observation.save()
+        for beam in observation.beam_set.all():
+            beam.save()
+        # Ensure everything, including LEMPTY, has been through the
+        # per-object logic.
+        with deferred_status() as batch:
+            batch.beams.update(Beam.objects.values_list('pk', flat=True))
+        self.expected = status_snapshot()
+
+    def _scramble(self):
+        Beam.objects.update(archived=Constants.PARTIAL, on_cep=Constants.TRUE)
+        Observation.objects.update(archived=Constants.PARTIAL, on_cep=Constants.TRUE)
+        # done is never cleared once set, so it can't be rebuilt from scratch.
+        Field.objects.update(archived=Constants.PARTIAL, on_cep=Constants.FALSE)
+
+    def test_matches_per_object_logic(self):
+        self._scramble()
+        changed = recompute_status()
+        self.assertEqual(status_snapshot(), self.expected)
+        self.assertEqual(changed["beams"], Beam.objects.count())
+        self.assertEqual(recompute_status(), {"beams": 0, "observations": 0, "fields": 0})
+
+    def test_single_survey(self):
+        self._scramble()
+        recompute_status(Survey.objects.get(name="B"))
+        self.assertFalse(
+            Field.objects.filter(survey__name="A").exclude(archived=Constants.PARTIAL).exists()
+        )
+        self.assertEqual(
+            list(Field.objects.filter(survey__name="B").order_by('pk').values_list('archived', 'on_cep', 'done')),
+            [f for f, field in zip(self.expected[2], Field.objects.order_by('pk')) if field.survey_id == "B"]
+        )
+
+    def test_verify(self):
+        self._scramble()
+        output = StringIO()
+        call_command("recompute_status", verify=True, stdout=output)
+        self.assertTrue("Verified OK" in output.getvalue())
+
+
+class NearPositionTest(TestCase):
+    def setUp(self):
+        survey = Survey.objects.create(name="MSSS HBA", field_size=1.21, beams_per_field=2)
+        insert_grid(survey, os.path.join(METADATA_DIR, "grid.hba.txt"))
+        # Add some awkward positions: the poles and either side of RA = 0.
+        for n, (ra, dec) in enumerate([
+            (0, math.pi/2), (1, -math.pi/2), (2 * math.pi - 1e-6, 0.1),
+            (1e-6, 0.1), (math.pi, -1.2)
+        ]):
+            Field.objects.create(name="Extra %d" % n, ra=ra, dec=dec, survey=survey)
+
+    def _brute_force(self, ra, dec, radius):
+        # The query used before the pixel index was introduced.
+        return Field.objects.filter(
+            dec__gte=dec-radius, dec__lte=dec+radius
+        ).extra(
+            select=SortedDict([('distance', 'ACOS(SIN(dec)*SIN(%s) + COS(dec)*COS(%s)*COS(ra-%s))')]),
+            select_params=(dec, dec, ra),
+            where=['ACOS(SIN(dec)*SIN(%s) + COS(dec)*COS(%s)*COS(ra-%s)) <= %s'],
+            params=[dec, dec, ra, radius]
+        )
+
+    def _check(self, ra, dec, radius):
+        expected = sorted((f.pk, f.distance) for f in self._brute_force(ra, dec, radius))
+        result = Field.objects.near_position(ra, dec, radius)
+        self.assertEqual(
+            sorted((f.pk, f.distance) for f in result), expected,
+            "Mismatch at %f, %f, %f" % (ra, dec, radius)
+        )
+        return len(expected)
+
+    def test_random_cones(self):
+        rng = random.Random(42)
+        n_found = 0
+        for i in range(200):
+            ra = rng.uniform(0, 2 * math.pi)
+            dec = math.asin(rng.uniform(-1, 1))
+            radius = rng.choice([0.01, 0.05, 0.2, 1.0]) * rng.random()
+            n_found += self._check(ra, dec, radius)
+        self.assertTrue(n_found > 1000)
+
+    def test_awkward_cones(self):
+        for ra, dec, radius in [
+            (0, 0, 0.1), (2 * math.pi - 0.01, 0.1, 0.05), (0.01, 0.1, 0.05),
+            (0, math.pi/2, 0.05), (3, math.pi/2 - 0.01, 0.05), (1, -1.5, 0.2),
+            (4, 1.2, 0.5), (0, 0, math.pi), (2, 0.3, 2 * math.pi)
+        ]:
+            self._check(ra, dec, radius)
+
+    def test_grid_positions(self):
+        # Searches centred on pixel boundaries.
+        for field in Field.objects.filter(survey__name="MSSS HBA")[::37]:
+            self._check(field.ra, field.dec, 0.03)
+
+
+class FieldMatcherTest(TestCase):
+    def setUp(self):
+        self.survey = Survey.objects.create(name="MSSS LBA", field_size=2.885, beams_per_field=9)
+        insert_grid(self.survey, os.path.join(METADATA_DIR, "grid.lba.txt"))
+
+    def test_matches_near_position(self):
+        rng = random.Random(1)
+        positions = [
+            (rng.uniform(0, 2 * math.pi), math.asin(rng.uniform(-0.2, 1)))
+            for i in range(300)
+        ]
+        threshold = 0.05
+        results = FieldMatcher.for_survey("MSSS LBA").match(positions, threshold)
+        self.assertEqual(len(results), len(positions))
+        n_matched = 0
+        for (ra, dec), (field, separation) in zip(positions, results):
+            nearby = Field.objects.near_position(ra, dec, threshold).order_by("distance")
+            if nearby:
+                self.assertEqual(field, nearby[0])
+                self.assertAlmostEqual(separation, nearby[0].distance)
+                n_matched += 1
+            else:
+                self.assertEqual(field, None)
+                self.assertTrue(separation > threshold)
+        self.assertTrue(n_matched > 0)
+
+    def test_exact_and_empty(self):
+        field = Field.objects.filter(survey=self.survey)[10]
+        matcher = FieldMatcher.for_survey("MSSS LBA")
+        self.assertEqual(matcher.match([(field.ra, field.dec)], 1e-6), [(field, 0.0)])
+        self.assertEqual(matcher.match([]), [])
+        self.assertEqual(
+            FieldMatcher.for_survey("MSSS LBA", calibrator=True).match([(0, 0)]),
+            [(None, None)]
+        )
+
+
+EXAMPLE_PARSET = """
+# A comment
+Observation.nrBeams = 2
+Observation.Beam[0].angle1 = 1.2345  # trailing comment
+Observation.Beam[0].subbandList = [0..3,10*7, 100..98]
+Observation.Beam[1].subbandList=[]
+Observation.VirtualInstrument.stationList = [CS001..CS003,RS106,2*DE601]
+Observation.Campaign.name = "MSSS"
+Observation.Campaign.title = 'MSSS # LBA'
+Observation.clockMode = <<Clock200
+Observation.nrBeams = 3
+"""
+
+class ParameterSetTest(TestCase):
+    def test_expand(self):
+        self.assertEqual(expand("[0..3]"), ["0", "1", "2", "3"])
+        self.assertEqual(expand("[3*0,1..2]"), ["0", "0", "0", "1", "2"])
+        self.assertEqual(expand("[2*[1,2],5]"), ["1", "2", "1", "2", "5"])
+        self.assertEqual(expand("[CS001..CS003]"), ["CS001", "CS002", "CS003"])
+        self.assertEqual(expand("[10*LBA]"), ["LBA"] * 10)
+        self.assertEqual(expand("['a,b',c]"), ["a,b", "c"])
+        self.assertEqual(expand("[]"), [])
+
+    def test_values(self):
+        parset = ParameterSet.from_string(EXAMPLE_PARSET)
+        self.assertEqual(parset.getInt("Observation.nrBeams"), 3)
+        self.assertEqual(parset.getFloat("Observation.Beam[0].angle1"), 1.2345)
+        self.assertEqual(
+            parset.getIntVector("Observation.Beam[0].subbandList", True),
+            [0, 1, 2, 3] + [7] * 10 + [100, 99, 98]
+        )
+        self.assertEqual(parset.getIntVector("Observation.Beam[1].subbandList", True), [])
+        self.assertEqual(
+            parset.getStringVector("Observation.VirtualInstrument.stationList", True),
+            ["CS001", "CS002", "CS003", "RS106", "DE601", "DE601"]
+        )
+        self.assertEqual(parset.getString("Observation.Campaign.name"), "MSSS")
+        self.assertEqual(parset.getString("Observation.Campaign.title"), "MSSS # LBA")
+        self.assertEqual(parset.getString("Observation.clockMode")[-3:], "200")
+        self.assertRaises(RuntimeError, parset.getString, "Observation.missing")
+
+    def test_selected_keys(self):
+        parset = ParameterSet.from_string(
+            EXAMPLE_PARSET, re.compile(r"Observation\.Campaign\.")
+        )
+        self.assertEqual(
+            sorted(parset.keys()),
+            ["Observation.Campaign.name", "Observation.Campaign.title"]
+        )
+
+    @unittest.skipIf(parameterset is None, "lofar.parameterset not available")
+    @unittest.skipIf(not os.path.isdir(PARSET_DIR), "no parsets available")
+    def test_conformance(self):
+        for root, dirnames, filenames in os.walk(PARSET_DIR):
+            for filename in fnmatch.filter(filenames, "*.parset"):
+                filename = os.path.join(root, filename)
+                reference = parameterset(filename)
+                parset = ParameterSet(filename)
+                self.assertEqual(sorted(parset.keys()), sorted(reference.keys()))
+                for key in reference.keys():
+                    value = reference.get(key)
+                    self.assertEqual(parset.getString(key), value.getString(), key)
+                    if value.isVector():
+                        self.assertEqual(
+                            parset.getStringVector(key, True),
+                            value.expand().getStringVector(), key
+                        )
+
+
+def legacy_find_runs(features):
+    # The window-by-window search formerly used by load_data.py, for
+    # comparison.
+    allocated = [False] * len(features)
+
+    def check(start, length, start_positions, step):
+        window = features[start:start+length]
+        if True in allocated[start:start+length]:
+            return False
+        calibrators = set(calibrator for calibrator, n_beams, positions in window[::2])
+        if False in calibrators or len(calibrators) != 1:
+            return False
+        nr_beams = set(n_beams for calibrator, n_beams, positions in window[1::2])
+        if (not 3 in nr_beams and not 4 in nr_beams) or len(nr_beams) != 1:
+            return False
+        for start_position in start_positions:
+            for beam in [0, 1, 2]:
+                if len(set(positions[beam] for c, n, positions in window[start_position::step])) != 1:
+                    return False
+        return True
+
+    runs = []
+    for idx in range(len(features)):
+        for length, start_positions, step in ((72, [1, 3, 5, 7], 8), (54, [1, 3, 5], 6)):
+            if not allocated[idx] and len(features[idx:idx+length]) == length:
+                if check(idx, length, start_positions, step):
+                    runs.append((idx, length))
+                    for i in range(idx, idx+length):
+                        allocated[i] = True
+    return runs
+
+
+class FindRunsTest(TestCase):
+    def _run(self, rng, length, cycle, calibrator="3C196", n_beams=3):
+        targets = [
+            tuple((rng.randint(0, 5), rng.randint(0, 5)) for beam in range(n_beams))
+            for i in range(cycle / 2)
+        ]
+        features = []
+        for i in range(length / 2):
+            features.append((calibrator, 1, [(0, 0)]))
+            features.append((False, n_beams, list(targets[i % (cycle / 2)])))
+        return features
+
+    def _noise(self, rng, n):
+        return [
+            rng.choice([
+                ("3C196", 1, [(0, 0)]), ("3C295", 1, [(0, 0)]), (False, 1, [(1, 1)]),
+                (False, 3, [(1, 2), (2, 3), (3, 4)]), (False, 4, [(1, 2), (2, 3), (3, 4), (5, 5)])
+            ]) for i in range(n)
+        ]
+
+    def _corrupt(self, rng, features):
+        features = list(features)
+        i = rng.randrange(len(features))
+        calibrator, n_beams, positions = features[i]
+        kind = rng.randrange(3)
+        if kind == 0:
+            features[i] = ("3C295" if calibrator else "3C196", n_beams, positions)
+        elif kind == 1:
+            features[i] = (calibrator, 4 if n_beams == 3 else 3, positions)
+        else:
+            features[i] = (calibrator, n_beams, [(9, 9)] + list(positions[1:]))
+        return features
+
+    def test_clean_runs(self):
+        rng = random.Random(0)
+        features = (
+            self._noise(rng, 5) + self._run(rng, 72, 8) + self._run(rng, 54, 6, "3C295", 4) +
+            self._noise(rng, 3) + self._run(rng, 54, 6)
+        )
+        self.assertEqual(find_runs(features), [(5, 72), (77, 54), (134, 54)])
+        self.assertEqual(find_runs(features), legacy_find_runs(features))
+
+    def test_matches_legacy_search(self):
+        rng = random.Random(1)
+        n_runs = 0
+        for trial in range(60):
+            features = []
+            for segment in range(rng.randint(1, 6)):
+                choice = rng.randrange(5)
+                if choice == 0:
+                    features += self._noise(rng, rng.randint(0, 10))
+                else:
+                    length, cycle = rng.choice([(72, 8), (54, 6)])
+                    run = self._run(
+                        rng, length, cycle, rng.choice(["3C196", "3C295"]), rng.choice([3, 4])
+                    )
+                    if choice == 1:
+                        run = self._corrupt(rng, run)
+                    elif choice == 2:
+                        # Runs which are cut short or start part way through.
+                        run = run[rng.randint(0, 20):] if rng.random() < 0.5 else run[:-rng.randint(1, 20)]
+                    features += run
+            runs = find_runs(features)
+            self.assertEqual(runs, legacy_find_runs(features))
+            n_runs += len(runs)
+        self.assertTrue(n_runs > 20)
+
+    def test_empty(self):
+        self.assertEqual(find_runs([]), [])
+
+
+class FakeParset(object):
+    # Provides the interface of load_data.Parset.
+    def __init__(self, obsid, start, fields, subbands, stations):
+        self.filename = "/data/%s/%s.parset" % (obsid, obsid)
+        self.text = "Observation.ObsID = %s" % obsid
+        self.antennaset, self.clock, self.filter = "LBA_INNER", 200, "LBA_30_90"
+        self.start, self.fields, self.subbands = start, fields, subbands
+        self.positions = [(0, 0)] * len(fields)
+        self.stations = stations
+
+    def start_time(self):
+        return self.start
+
+    def duration(self):
+        return 300
+
+    def get_field(self, beam, survey_name):
+        return self.fields[beam]
+
+    def get_subbands(self, beam):
+        return self.subbands[beam]
+
+
+def legacy_upload(parsets, survey_name):
+    # The per-object upload formerly used by load_data.py, for comparison.
+    for parset in parsets:
+        obsid = os.path.basename(parset.filename).rstrip(".parset")
+        observation = Observation.objects.create(
+            obsid=obsid, antennaset=parset.antennaset, start_time=parset.start_time(),
+            duration=parset.duration(), parset=parset.text, clock=parset.clock,
+            filter=parset.filter
+        )
+        observation.stations = Station.objects.filter(name__in=parset.stations)
+        observation.save()
+        sb_ctr = 0
+        for beam_number in range(len(parset.positions)):
+            field = parset.get_field(beam_number, survey_name)
+            if field:
+                beam = Beam.objects.create(observation=observation, field=field, beam=beam_number)
+                beam.subbands = Subband.objects.filter(number__in=parset.get_subbands(beam_number))
+                beam.save()
+                sb_list = []
+                for subband in beam.subbands.all():
+                    sb_list.append(SubbandData(
+                        id=obsid+"_"+str(sb_ctr), beam=beam, number=sb_ctr, subband=subband
+                    ))
+                    sb_ctr += 1
+                SubbandData.objects.bulk_create(sb_list)
+
+
+class BulkUploadTest(TestCase):
+    def setUp(self):
+        self.survey = create_survey("MSSS LBA", beams_per_field=1, n_fields=4)
+        fields = list(self.survey.field_set.order_by('pk'))
+        Subband.objects.bulk_create([Subband(number=n) for n in range(513)])
+        for n, name in enumerate(["CS001", "CS002", "RS106"]):
+            Station.objects.create(idnumber=n, name=name, longitude=0, latitude=0, altitude=0)
+        start = timezone.now()
+        self.parsets = [
+            FakeParset(
+                "L%d" % n, start + datetime.timedelta(minutes=n),
+                [fields[(n + i) % 4] if (n + i) % 5 else None for i in range(n % 4)],
+                [[5, 3, 3, 600] + range(n, n + 10 * i) for i in range(n % 4)],
+                ["CS001", "CS002", "CS002", "XX999"][:n % 5]
+            ) for n in range(25)
+        ]
+
+    def _snapshot(self):
+        return (
+            list(Observation.objects.order_by('pk').values_list(
+                'obsid', 'parset_text__data', 'start_time', 'archived', 'on_cep'
+            )),
+            sorted(Observation.stations.through.objects.values_list('observation', 'station')),
+            list(Beam.objects.order_by('observation', 'beam').values_list(
+                'observation', 'beam', 'field', 'subband_ranges', 'archived', 'on_cep'
+            )),
+            sorted(SubbandData.objects.values_list('id', 'beam__observation', 'beam__beam', 'number', 'subband')),
+            list(Field.objects.order_by('pk').values_list('archived', 'on_cep', 'done')),
+        )
+
+    def test_matches_legacy_upload(self):
+        legacy_upload(self.parsets, "MSSS LBA")
+        expected = self._snapshot()
+        Observation.objects.all().delete()
+        Field.objects.update(archived=Constants.FALSE, on_cep=Constants.FALSE, done=False)
+
+        n_created, n_updated, unmatched = bulk_upload(self.parsets, "MSSS LBA", batch_size=7)
+        self.assertEqual((n_created, n_updated), (len(self.parsets), 0))
+        self.assertEqual(unmatched, [
+            (parset.filename.split("/")[2], beam) for parset in self.parsets
+            for beam, field in enumerate(parset.fields) if field is None
+        ])
+        self.assertEqual(self._snapshot(), expected)
+
+    def test_incremental_upload(self):
+        bulk_upload(self.parsets[:20], "MSSS LBA", batch_size=7)
+        SubbandData.objects.filter(id="L7_0").update(hostname="locus001", path="/data")
+        expected = self._snapshot()
+
+        # Unchanged parsets are skipped.
+        self.assertEqual(bulk_upload(self.parsets[:20], "MSSS LBA")[:2], (0, 0))
+        self.assertEqual(self._snapshot(), expected)
+
+        # A changed parset with the same beams keeps its data...
+        self.parsets[7].text += "\n# Edited"
+        # ...but one with different subbands gets new Beams.
+        self.parsets[6].text += "\n# Edited"
+        self.parsets[6].subbands[1] = [100, 101]
+        self.assertEqual(bulk_upload(self.parsets, "MSSS LBA")[:2], (5, 2))
+        self.assertEqual(
+            SubbandData.objects.get(id="L7_0").hostname, "locus001"
+        )
+        self.assertEqual(
+            list(SubbandData.objects.filter(beam__observation="L6").values_list('id', 'subband')),
+            [("L6_0", 3), ("L6_1", 5), ("L6_2", 100), ("L6_3", 101)]
+        )
+        self.assertEqual(
+            Observation.objects.get(pk="L7").parset, self.parsets[7].text
+        )
+
+    def test_upload_over_unencoded_beams(self):
+        # As in a database upgraded without running encode_subbands.
+        bulk_upload(self.parsets, "MSSS LBA")
+        SubbandData.objects.filter(id="L7_0").update(hostname="locus001", path="/data")
+        unencode_subbands()
+        self.parsets[7].text += "\n# Edited"
+        self.assertEqual(bulk_upload(self.parsets, "MSSS LBA")[:2], (0, 1))
+        self.assertEqual(SubbandData.objects.get(id="L7_0").hostname, "locus001")
+
+
+class SetLocationsTest(TestCase):
+    def setUp(self):
+        survey = create_survey(beams_per_field=1)
+        fields = list(survey.field_set.order_by('pk'))
+        for n in range(4):
+            create_observation("L%d" % n, fields[1:])
+        self.locations = dict(
+            ("L%d_%d" % (n, sb), ("locus%03d" % n, 1024 * sb, "/data/L%d/L%d_SB%03d_uv.MS" % (n, n, sb)))
+            for n in range(3) for sb in range(8 - 2 * n)
+        )
+        self.locations["L99_0"] = ("locus099", 0, "/data/L99/L99_SB000_uv.MS")
+
+    def test_matches_per_subband_updates(self):
+        # The per-subband approach formerly used by insert_node_data_list.py.
+        for id, (hostname, size, path) in self.locations.iteritems():
+            SubbandData.objects.filter(id=id).update(hostname=hostname, size=size, path=path)
+        for beam in Beam.objects.filter(observation__obsid__in=["L0", "L1", "L2"]):
+            beam._update_status()
+        expected = status_snapshot(), list(
+            SubbandData.objects.order_by('pk').values_list('hostname', 'size', 'path')
+        )
+        SubbandData.objects.update(hostname="", size=None, path="")
+        Beam.objects.update(on_cep=Constants.FALSE)
+        Observation.objects.update(on_cep=Constants.FALSE)
+        Field.objects.update(on_cep=Constants.FALSE, done=False)
+
+        n_updated, changed = set_locations(self.locations)
+        self.assertEqual(n_updated, len(self.locations) - 1)
+        self.assertEqual(changed["beams"], 5)
+        self.assertEqual(expected, (status_snapshot(), list(
+            SubbandData.objects.order_by('pk').values_list('hostname', 'size', 'path')
+        )))
+
+
+class MarkArchivedTest(TestCase):
+    def setUp(self):
+        survey = create_survey(beams_per_field=2)
+        fields = list(survey.field_set.order_by('pk'))
+        for n in range(10, 16):
+            create_observation("L%d" % n, fields[n % 2:])
+        create_observation("L16", [])
+        Observation.objects.filter(obsid="L13").update(invalid=True)
+
+    def test_matches_per_observation_marking(self):
+        # The approach formerly used by mark_as_archived.py and lta.py.
+        site = ArchiveSite.objects.create(name="SARA")
+        with deferred_status():
+            for obsid in ["L%d" % n for n in range(8, 14)] + ["L16"]:
+                try:
+                    obs = Observation.objects.get(obsid=obsid)
+                except Observation.DoesNotExist:
+                    continue
+                SubbandData.objects.filter(beam__in=obs.beam_set.all()).update(archive=site)
+                for beam in obs.beam_set.all():
+                    beam.archived = Constants.TRUE
+                    beam.save()
+        expected = status_snapshot(), list(
+            SubbandData.objects.order_by('pk').values_list('archive', flat=True)
+        )
+        SubbandData.objects.update(archive=None)
+        Beam.objects.update(archived=Constants.FALSE)
+        Observation.objects.update(archived=Constants.FALSE)
+        Field.objects.update(archived=Constants.FALSE, done=False)
+
+        self.assertEqual(
+            mark_range_archived([(8, 11), (11, 13)], "SARA"), (["L10", "L11", "L12", "L13"], 2)
+        )
+        self.assertEqual(mark_archived(["L16", "L8"], "SARA"), (["L16"], ["L8"]))
+        self.assertEqual(expected, (status_snapshot(), list(
+            SubbandData.objects.order_by('pk').values_list('archive', flat=True)
+        )))
+
+    def test_obsid_range(self):
+        for obsid in ("L9", "L99", "L100", "L1000", "L1001"):
+            create_observation(obsid, [])
+        self.assertEqual(
+            sorted(Observation.objects.filter(obsid_range(9, 1000)).values_list('pk', flat=True)),
+            sorted(["L9", "L99", "L100", "L1000"] + ["L%d" % n for n in range(10, 17)])
+        )
+        self.assertEqual(Observation.objects.filter(obsid_range(17, 98)).count(), 0)
+        self.assertEqual(Observation.objects.filter(obsid_range(20, 10)).count(), 0)
+
+
+class SubbandSetTest(TestCase):
+    def test_operations(self):
+        numbers = [12, 13, 14, 15, 100, 200, 201, 202, 512, 0]
+        subband_set = SubbandSet(numbers + [13, 100])
+        self.assertEqual(subband_set.encode(), "0,12..15,100,200..202,512")
+        self.assertEqual(SubbandSet.decode(subband_set.encode()), subband_set)
+        self.assertEqual(len(subband_set), len(numbers))
+        self.assertEqual(list(subband_set), sorted(numbers))
+        self.assertEqual([n for n in range(513) if n in subband_set], sorted(numbers))
+        self.assertEqual(len(SubbandSet.decode("")), 0)
+        self.assertFalse(0 in SubbandSet())
+
+    def test_subbands_accessor(self):
+        survey = create_survey()
+        observation = create_observation("L1", survey.field_set.all()[:1], n_subbands=10)
+        beam = observation.beam_set.get()
+        self.assertEqual((beam.subband_ranges, beam.n_subbands), ("0..9", 10))
+        beam.subbands = beam.subbands.exclude(number=5)
+        beam = Beam.objects.get(pk=beam.pk)
+        self.assertEqual(list(beam.subband_numbers), [0, 1, 2, 3, 4, 6, 7, 8, 9])
+        self.assertEqual(
+            list(beam.subbands.values_list('number', flat=True)), [0, 1, 2, 3, 4, 6, 7, 8, 9]
+        )
+        beam.subbands = []
+        self.assertEqual(list(Beam.objects.get(pk=beam.pk).subbands), [])
+
+    def test_encode_subbands_command(self):
+        survey = create_survey()
+        for n in range(3):
+            create_observation("L%d" % n, survey.field_set.all(), n_subbands=4 + n)
+        expected = list(Beam.objects.order_by('pk').values_list('subband_ranges', 'n_subbands'))
+        unencode_subbands()
+        call_command("encode_subbands", stdout=StringIO())
+        self.assertEqual(
+            list(Beam.objects.order_by('pk').values_list('subband_ranges', 'n_subbands')),
+            expected
+        )
+
+
+class BeamSubbandDataTest(TestCase):
+    def setUp(self):
+        survey = create_survey()
+        self.observation = create_observation("L1", survey.field_set.all()[:2], n_subbands=10)
+        locations = dict(
+            ("L1_%d" % n, ("locus001" if n < 5 else "locus002", 1000, "/data/L1/L1_SAP000_SB%03d_uv.MS" % n))
+            for n in range(10) if n != 6
+        )
+        set_locations(locations)
+        SubbandData.objects.filter(number__in=[8, 9]).update(archive=ArchiveSite.objects.create(name="LTA"))
+
+    def test_collapse(self):
+        rows = [
+            (0, 100, 10, "locus001", "/data/L1/a", None),
+            (1, 101, None, "locus001", "/data/L1/b", None),
+            (2, 103, 10, "locus001", "/data/L1/c", None),
+            (4, 104, 10, "locus001", "/data/L1/d", None),
+        ]
+        self.assertEqual(collapse_subband_data(rows), [
+            {"first": 0, "last": 2, "count": 3, "subbands": "100..101,103", "size": 20,
+             "hostname": "locus001", "path": "/data/L1", "archive": None},
+            {"first": 4, "last": 4, "count": 1, "subbands": "104", "size": 10,
+             "hostname": "locus001", "path": "/data/L1", "archive": None},
+        ])
+        self.assertEqual(collapse_subband_data([]), [])
+
+    def test_endpoint(self):
+        response = self.client.get(reverse('beam_subbands', args=("L1", 0)))
+        self.assertEqual(response["Content-Type"], "application/json")
+        ranges = json.loads(response.content)["ranges"]
+        self.assertEqual(
+            [(r["first"], r["last"], r["hostname"], r["archive"], r["size"]) for r in ranges], [
+                (0, 4, "locus001", None, 5000), (5, 5, "locus002", None, 1000),
+                (6, 6, "", None, None), (7, 7, "locus002", None, 1000), (8, 9, "locus002", "LTA", 2000)
+            ]
+        )
+        with self.assertNumQueries(2):
+            ranges = json.loads(self.client.get(reverse('beam_subbands', args=("L1", 1))).content)["ranges"]
+        self.assertEqual([(r["first"], r["last"], r["count"], r["subbands"]) for r in ranges], [(10, 19, 10, "0..9")])
+        self.assertEqual(self.client.get(reverse('beam_subbands', args=("L1", 2))).status_code, 404)
+
+    def test_detail_page(self):
+        with self.assertNumQueries(5):
+            response = self.client.get(self.observation.get_absolute_url())
+        self.assertContains(response, reverse('beam_subbands', args=("L1", 1)))
+        self.assertNotContains(response, "locus001")
+
+
+class ObservationListTest(TestCase):
+    def setUp(self):
+        self.survey = create_survey()
+        self.states = [Constants.TRUE, Constants.PARTIAL, Constants.FALSE]
+
+    def _create(self, n):
+        fields = list(self.survey.field_set.all())
+        for i in range(n):
+            obsid = "L%d" % (Observation.objects.count() + 1)
+            create_observation(obsid, fields[:i % 3], n_subbands=1)
+            Observation.objects.filter(pk=obsid).update(
+                archived=self.states[i % 3], on_cep=self.states[i // 3 % 3], invalid=(i % 7 == 6)
+            )
+
+    def test_constant_queries(self):
+        self._create(10)
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('obs_list'))
+        self._create(20)
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('obs_list'))
+
+        good = Observation.objects.filter(invalid=False)
+        for name, count in (
+            ("n_archived", good.filter(archived=Constants.TRUE).count()),
+            ("n_part_archived", good.filter(archived=Constants.PARTIAL).count()),
+            ("n_on_cep", good.filter(on_cep=Constants.TRUE).count()),
+            ("n_part_on_cep", good.filter(on_cep=Constants.PARTIAL).count()),
+            ("n_unknown", good.filter(on_cep=Constants.FALSE, archived=Constants.FALSE).count()),
+            ("n_invalid", Observation.objects.filter(invalid=True).count()),
+        ):
+            self.assertEqual(response.context[name], count)
+        for obs in response.context["obs_list"]:
+            self.assertEqual(obs.status(), Observation.objects.get(pk=obs.pk).status())
+
+
+class FieldStatusFilterTest(TestCase):
+    def setUp(self):
+        survey = create_survey(n_fields=10)
+        fields = list(survey.field_set.order_by('pk'))
+        create_observation("L1", fields[:8:2], n_subbands=1)
+        create_observation("L2", fields[:9:4], n_subbands=1)
+        states = [Constants.TRUE, Constants.PARTIAL, Constants.FALSE]
+        for i, field in enumerate(Field.objects.order_by('pk')):
+            field.archived, field.on_cep = states[i % 3], states[i // 3 % 3]
+            field.save()
+
+    def test_matches_column_filters(self):
+        annotated = Field.objects.annotate(num_beams=Count('beam'))
+        for status, expected in (
+            (DataStatus.CALIBRATOR, annotated.filter(calibrator=True)),
+            (DataStatus.NOT_OBSERVED, annotated.filter(num_beams=0)),
+            (DataStatus.ARCHIVED, annotated.filter(archived=Constants.TRUE)),
+            (DataStatus.ON_CEP, annotated.filter(on_cep=Constants.TRUE)),
+            (DataStatus.PARTIAL_ARCHIVED, annotated.filter(archived=Constants.PARTIAL)),
+            (DataStatus.PARTIAL_CEP, annotated.filter(on_cep=Constants.PARTIAL)),
+            (DataStatus.UNKNOWN, annotated.filter(
+                calibrator=False, archived=Constants.FALSE, on_cep=Constants.FALSE
+            ).exclude(num_beams=0)),
+        ):
+            response = self.client.get(reverse('field_list'), {"status": status})
+            self.assertEqual(
+                sorted(field.pk for field in response.context["object_list"]),
+                sorted(expected.values_list('pk', flat=True))
+            )
+            self.assertTrue(response.context["object_list"])
+
+    def test_status_needs_no_queries(self):
+        fields = list(Field.objects.order_by('pk'))
+        with self.assertNumQueries(0):
+            statuses = [field.status() for field in fields]
+        self.assertEqual(statuses[0], [DataStatus.CALIBRATOR, DataStatus.ARCHIVED, DataStatus.ON_CEP])
+        self.assertEqual(statuses[5], [DataStatus.NOT_OBSERVED, DataStatus.PARTIAL_CEP])
+        self.assertEqual(statuses[8], [DataStatus.UNKNOWN])
+
+
+def legacy_survey_summary(s):
+    # SurveyDetailView's summary as it was computed with many queries.
+    field_list = []
+    counts = {}
+    non_calibrators = s.field_set.filter(calibrator=False).annotate(num_beams=Count('beam'))
+    for name, colour, fields in (
+        ("not_observed", 'o', non_calibrators.filter(num_beams=0)),
+        ("on_cep", 'p', non_calibrators.filter(on_cep=Constants.TRUE)),
+        ("archived", 'g', non_calibrators.filter(archived=Constants.TRUE).exclude(on_cep=Constants.TRUE)),
+        ("partial", 'b', non_calibrators.filter(Q(archived=Constants.PARTIAL) | Q(on_cep=Constants.PARTIAL)).exclude(on_cep=Constants.TRUE).exclude(archived=Constants.TRUE)),
+        ("missing", 'r', non_calibrators.filter(num_beams__gt=0).filter(archived=Constants.FALSE, on_cep=Constants.FALSE)),
+    ):
+        field_list.extend([ra, dec, colour] for ra, dec in fields.values_list("ra", "dec"))
+        counts[name] = fields.count()
+    n_targets = s.field_set.filter(calibrator=False).count()
+    n_done = s.field_set.filter(calibrator=False, done=True).count()
+    percentages = dict((key, 100 * float(value)/n_targets) for key, value in counts.iteritems())
+    percentages["done"] = 100 * float(n_done)/n_targets
+    return {
+        "n_targets": n_targets, "n_done": n_done,
+        "n_cals": s.field_set.filter(calibrator=True).count(),
+        "start_time": s.field_set.aggregate(Min('beam__observation__start_time')).values()[0],
+        "stop_time": s.field_set.aggregate(Max('beam__observation__start_time')).values()[0],
+        "percentages": percentages,
+        "field_list": field_list,
+    }
+
+class SurveyDetailTest(TestCase):
+    def test_matches_legacy_summary(self):
+        survey = create_survey(n_fields=12)
+        fields = list(survey.field_set.order_by('pk'))
+        start = timezone.now()
+        for n in range(8):
+            create_observation(
+                "L%d" % n, [fields[n % 3], fields[3 + n]],
+                start_time=start + datetime.timedelta(days=n)
+            )
+        states = [Constants.TRUE, Constants.PARTIAL, Constants.FALSE]
+        for n, field in enumerate(fields):
+            Field.objects.filter(pk=field.pk).update(
+                archived=states[n % 3], on_cep=states[n // 3 % 3], done=(n % 4 == 1)
+            )
+        create_survey(name="Other Survey")
+        create_observation("L99", Survey.objects.get(name="Other Survey").field_set.all())
+        # The updates above bypass the SurveyStats' own bookkeeping.
+        SurveyStats.rebuild()
+
+        expected = legacy_survey_summary(survey)
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('survey_detail', args=(survey.name,)))
+        for key, value in expected.iteritems():
+            self.assertEqual(response.context[key], value, key)
+
+        # A survey with no targets is summarised rather than crashing.
+        Survey.objects.create(name="Empty", field_size=1.0)
+        response = self.client.get(reverse('survey_detail', args=("Empty",)))
+        self.assertEqual(response.context["n_targets"], 0)
+        self.assertEqual(response.context["start_time"], None)
+
+
+class SurveyStatsTest(TestCase):
+    def setUp(self):
+        self.survey = create_survey("MSSS LBA", beams_per_field=1, n_fields=6)
+        self.fields = list(self.survey.field_set.order_by('pk'))
+        Subband.objects.bulk_create([Subband(number=n) for n in range(10)])
+
+    def _check(self):
+        # The maintained stats should match a rebuild from scratch.
+        current = list(SurveyStats.objects.order_by('survey').values())
+        SurveyStats.rebuild()
+        self.assertEqual(list(SurveyStats.objects.order_by('survey').values()), current)
+        return current[0]
+
+    def test_maintained(self):
+        fields = self.fields
+        stats = self._check()
+        self.assertEqual((stats["n_targets"], stats["n_calibrators"], stats["n_not_observed"]), (5, 1, 5))
+
+        start = timezone.now()
+        bulk_upload([
+            FakeParset(
+                "L%d" % n, start + datetime.timedelta(minutes=n),
+                [fields[n], fields[n + 1]], [[1, 2], [3, 4]], []
+            ) for n in range(3)
+        ], "MSSS LBA")
+        stats = self._check()
+        self.assertEqual((stats["n_not_observed"], stats["n_missing"]), (2, 3))
+
+        set_locations(dict(
+            ("L0_%d" % n, ("locus001", 10, "/data/L0/L0_SB%03d_uv.MS" % n)) for n in range(4)
+        ))
+        set_locations({"L1_3": ("locus002", 10, "/data/L1/L1_SB003_uv.MS")})
+        mark_archived(["L2"], "LTA")
+        stats = self._check()
+        self.assertEqual(stats["n_done"], 3)
+
+        # The per-object cascade, and Fields edited by hand.
+        with deferred_status():
+            observation = create_observation("L9", [], start_time=start - datetime.timedelta(days=1))
+            Beam(observation=observation, field=fields[5], beam=0).save()
+        field = Field.objects.get(pk=fields[4].pk)
+        field.done = True
+        field.save()
+        Field.objects.create(name="New", survey=self.survey, ra=1.0, dec=0.5)
+        stats = self._check()
+        self.assertEqual(stats["start_time"], start - datetime.timedelta(days=1))
+
+        # Deletions.
+        for observation in Observation.objects.filter(pk__in=["L9", "L0"]):
+            observation.delete()
+        self._check()
+        for field in Field.objects.filter(pk__in=[fields[2].pk, fields[3].pk]):
+            field.delete()
+        stats = self._check()
+        self.assertEqual(stats["start_time"], Observation.objects.get(pk="L1").start_time)
+        self.assertEqual(delete_beams(Beam.objects.filter(observation="L1")), 1)
+        stats = self._check()
+        self.assertEqual((stats["start_time"], stats["n_not_observed"]), (None, stats["n_targets"]))
+
+    def test_saves_keep_stats(self):
+        observation = create_observation("L1", self.fields[:1])
+        field = Field.objects.get(pk=self.fields[1].pk)
+        Beam(observation=observation, field=field, beam=1).save()
+        stats = self._check()
+        self.assertEqual((stats["n_not_observed"], stats["n_missing"]), (4, 1))
+        # Saving the copy of the Field given to the Beam.
+        field.on_cep = Constants.TRUE
+        field.save()
+        stats = self._check()
+        self.assertEqual((stats["n_on_cep"], stats["n_missing"]), (1, 0))
+        # Likewise within a batch, where the stats are recounted on flushing.
+        field = Field.objects.get(pk=self.fields[2].pk)
+        with deferred_status():
+            Beam(observation=observation, field=field, beam=2).save()
+            field.done = True
+            field.save()
+        stats = self._check()
+        self.assertEqual((stats["n_done"], stats["n_not_observed"]), (1, 3))
+
+    def test_views(self):
+        create_observation("L1", self.fields[:2])
+        SurveyStats.rebuild()
+        response = self.client.get(reverse('introduction'))
+        self.assertEqual(
+            (response.context["n_fields"], response.context["n_targets"], response.context["n_calibrators"]),
+            (6, 5, 1)
+        )
+        # Surveys are counted when first shown if they have no stats yet.
+        SurveyStats.objects.all().delete()
+        response = self.client.get(self.survey.get_absolute_url())
+        self.assertEqual((response.context["n_targets"], response.context["n_cals"]), (5, 1))
+        self.assertEqual(SurveyStats.objects.count(), 1)
+
+    def test_command(self):
+        SurveyStats.objects.update(n_targets=0)
+        out = StringIO()
+        call_command("rebuild_survey_stats", "MSSS LBA", stdout=out)
+        self.assertEqual(SurveyStats.objects.get().n_targets, 5)
+        self.assertIn("5 targets", out.getvalue())
+
+
+class BeamCountTest(TestCase):
+    def setUp(self):
+        self.survey = create_survey("MSSS LBA", beams_per_field=1, n_fields=4)
+        self.fields = list(self.survey.field_set.order_by('pk'))
+        Subband.objects.bulk_create([Subband(number=n) for n in range(10)])
+
+    def _counts(self):
+        return (
+            list(Observation.objects.order_by('pk').values_list('n_beams', flat=True)),
+            list(Field.objects.order_by('pk').values_list('n_beams', flat=True)),
+        )
+
+    def _check(self):
+        # The maintained counts should match a recount.
+        self.assertEqual(update_beam_counts(Observation.objects.all()), 0)
+        self.assertEqual(update_beam_counts(Field.objects.all()), 0)
+        return self._counts()
+
+    def test_maintained(self):
+        fields = self.fields
+        start = timezone.now()
+        parsets = [
+            FakeParset(
+                "L%d" % n, start + datetime.timedelta(minutes=n),
+                [fields[n], fields[n + 1]], [[1, 2], [3, 4]], []
+            ) for n in range(3)
+        ]
+        bulk_upload(parsets, "MSSS LBA")
+        self.assertEqual(self._check(), ([2, 2, 2], [1, 2, 2, 1]))
+
+        # Re-ingest with fewer Beams.
+        parsets[1] = FakeParset("L1", parsets[1].start, [fields[3]], [[5]], [])
+        parsets[1].text += "\n# Edited"
+        bulk_upload(parsets, "MSSS LBA")
+        self.assertEqual(self._check(), ([2, 1, 2], [1, 1, 1, 2]))
+
+        # Copies given to a new Beam are kept in step, so can be saved.
+        observation = Observation.objects.get(pk="L1")
+        field = Field.objects.get(pk=fields[0].pk)
+        Beam(observation=observation, field=field, beam=1).save()
+        observation.save()
+        field.save()
+        self.assertEqual(self._check(), ([2, 2, 2], [2, 1, 1, 2]))
+
+        # Saving only other columns of a stale copy leaves the stored count,
+        # from which status_code is set.
+        stale = Field.objects.get(pk=fields[1].pk)
+        stale.n_beams = 0
+        Beam(observation=observation, field=Field.objects.get(pk=fields[1].pk), beam=2).save()
+        stale.done = True
+        stale.save(update_fields=['done'])
+        self.assertEqual(self._check(), ([2, 3, 2], [2, 2, 1, 2]))
+        self.assertTrue(Field.objects.get(pk=fields[1].pk).done)
+
+        # The count itself can still be saved.
+        observation = Observation.objects.get(pk="L1")
+        observation.n_beams = 0
+        observation.save(update_fields=['n_beams'])
+        self.assertEqual(
+            Observation.objects.filter(pk="L1").values_list('n_beams', 'status_code').get(),
+            (0, Observation.status_code_for(observation.archived, observation.on_cep, 0))
+        )
+        update_beam_counts(Observation.objects.all())
+
+        Observation.objects.get(pk="L0").delete()
+        Observation.objects.get(pk="L2").delete()
+        self.assertEqual(self._check(), ([3], [1, 1, 0, 1]))
+        self.assertEqual(Field.objects.filter(n_beams=0).get().status(), [DataStatus.NOT_OBSERVED])
+
+    def test_delete_queries(self):
+        # Deleting an Observation takes as many queries however many Beams
+        # it has.
+        for n_repeats in (1, 5):
+            create_observation("L1", self.fields[2:] * n_repeats)
+            observation = Observation.objects.get(pk="L1")
+            with self.assertNumQueries(20):
+                observation.delete()
+            self.assertEqual(self._check(), ([], [0, 0, 0, 0]))
+
+    def test_command(self):
+        create_observation("L1", self.fields[1:])
+        Observation.objects.update(n_beams=0)
+        Field.objects.update(n_beams=5, status_code=0)
+        # As any later save of a Field would.
+        SurveyStats.recount([self.survey.pk])
+        out = StringIO()
+        call_command("recount_beams", stdout=out)
+        self.assertEqual(self._counts(), ([3], [0, 1, 1, 1]))
+        self.assertIn("Corrected 1 observations and 4 fields", out.getvalue())
+        stats = list(SurveyStats.objects.values())
+        SurveyStats.rebuild()
+        self.assertEqual(list(SurveyStats.objects.values()), stats)
+        self.assertEqual((stats[0]["n_calibrators"], stats[0]["n_not_observed"]), (1, 0))
+
+class ParsetTextTest(TestCase):
+    def test_stored_compressed_and_loaded_on_demand(self):
+        text = EXAMPLE_PARSET * 20
+        observation = Observation.objects.create(
+            obsid="L1", antennaset="LBA_INNER", duration=60, clock=200,
+            filter="LBA_30_90", parset=text, start_time=timezone.now()
+        )
+        self.assertTrue(len(ParsetText.objects.get(pk="L1").data) < len(text) / 5)
+        with self.assertNumQueries(1):
+            observation = Observation.objects.get(pk="L1")
+        with self.assertNumQueries(1):
+            self.assertEqual(observation.parset, text)
+            self.assertEqual(observation.parset, text)
+
+        observation.parset = u"Observation.Campaign.title = \u00e9"
+        observation.save()
+        self.assertEqual(
+            Observation.objects.get(pk="L1").parset, u"Observation.Campaign.title = \u00e9"
+        )
+
+
+class ParsetKeyTest(TestCase):
+    def setUp(self):
+        for n in range(4):
+            Observation.objects.create(
+                obsid="L%d" % n, antennaset="LBA_INNER", duration=60, clock=200,
+                filter="LBA_30_90", start_time=timezone.now(),
+                parset=EXAMPLE_PARSET + (
+                    "Observation.Beam[0].momID = %d\nOLAP.foo = 1\n"
+                    "Observation.DataProducts.Output_Correlated.filenames = [L%d_SB000_uv.MS]\n"
+                ) % (100 + n % 2, n)
+            )
+
+    def test_with_parset_key(self):
+        self.assertEqual(
+            sorted(Observation.objects.with_parset_key("Observation.Beam[0].momID", 101).values_list('pk', flat=True)),
+            ["L1", "L3"]
+        )
+        self.assertEqual(
+            Observation.objects.with_parset_key("Observation.Beam[0].momID", ["100", 101]).count(), 4
+        )
+        self.assertEqual(Observation.objects.with_parset_key("Observation.Campaign.title", "MSSS # LBA").count(), 4)
+        # Only the indexed keys are stored.
+        self.assertFalse(Observation.objects.with_parset_key("OLAP.foo").exists())
+        self.assertFalse(Observation.objects.with_parset_key("Observation.VirtualInstrument.stationList").exists())
+        self.assertFalse(
+            Observation.objects.with_parset_key("Observation.DataProducts.Output_Correlated.filenames").exists()
+        )
+        self.assertEqual(Observation.objects.get(pk="L2").parset_value("Observation.nrBeams"), "3")
+        self.assertEqual(Observation.objects.get(pk="L2").parset_value("Observation.missing"), None)
+
+    def test_updated_with_parset(self):
+        observation = Observation.objects.get(pk="L0")
+        observation.parset = "Observation.Beam[0].momID = 5"
+        observation.save()
+        self.assertEqual(
+            list(observation.parset_keys.values_list('key', 'value')),
+            [("Observation.Beam[0].momID", "5")]
+        )
+
+    def test_index_parsets_command(self):
+        expected = sorted(ParsetKey.objects.values_list('observation', 'key', 'value'))
+        ParsetKey.objects.all().delete()
+        call_command("index_parsets", stdout=StringIO())
+        self.assertEqual(sorted(ParsetKey.objects.values_list('observation', 'key', 'value')), expected)
+
+
+def legacy_mom_mapping(output_dir, project_name, n_slices):
+    # The loop formerly in scripts/generate_mom_mapping.py.
+    from cStringIO import StringIO as cStringIO
+    from itertools import izip
+
+    def get_mom_id(parset, beam):
+        m = re.search(r"Observation.Beam\[%d\].momID = (\d+)" % (beam,), parset)
+        return int(m.groups()[0])
+
+    for field in Field.objects.filter(survey__name=project_name):
+        if field.name == "NCP" or field.calibrator:
+            continue
+        if not field.on_cep in (Constants.TRUE, Constants.PARTIAL):
+            continue
+        if field.beam_set.count() % n_slices:
+            continue
+        for beam_group in izip(*[iter(field.beam_set.all())]*n_slices):
+            output = cStringIO()
+            package_name = "%d_Slices_%s" % (n_slices, beam_group[0].observation.start_time.strftime("%b%d_%H:%M"))
+            package_description = "%s %s %d-slices" % (beam_group[0].observation.start_time.strftime("%b%d %H:%M"), project_name, n_slices)
+            print >>output, "projectName=%s;" % (project_name,)
+            print >>output, "packageName=%s;" % (package_name,)
+            print >>output, "packageDescription=%s;" % (package_description,)
+            have_data = False
+            for ctr, beam in enumerate(beam_group):
+                if beam.on_cep in (Constants.TRUE, Constants.PARTIAL):
+                    have_data = True
+                n_slice = ctr+1
+                observation = beam.observation
+                cal_observation = observation.get_previous_by_start_time()
+                assert(cal_observation.beam_set.count() == 1)
+                print >>output, ""
+                print >>output, "slice%d.calibrator.mom2Id:mom2Id=%d;" % (n_slice, get_mom_id(cal_observation.parset, 0)-1)
+                print >>output, "slice%d.calibrator.calibratorSource=%s;" % (n_slice, cal_observation.beam_set.all()[0].field.name)
+                print >>output, "slice%d.beam0.mom2Id:mom2Id=%d;" % (n_slice, get_mom_id(cal_observation.parset, 0),)
+                print >>output, "slice%d.target.mom2Id:mom2Id=%d;" % (n_slice, get_mom_id(observation.parset, 0)-1)
+                for n_beam in range(3):
+                    try:
+                        print >>output, "slice%d.beam%d.mom2Id:mom2Id=%d;" % (n_slice, n_beam+1, get_mom_id(observation.parset, n_beam))
+                    except AttributeError:
+                        pass
+            if have_data:
+                with open(os.path.join(output_dir, package_name), 'w') as f:
+                    f.write(output.getvalue())
+
+
+class MomMappingTest(TestCase):
+    def setUp(self):
+        survey = create_survey("MSSS LBA", beams_per_field=1, n_fields=6)
+        fields = list(survey.field_set.order_by('pk'))
+        Field.objects.filter(calibrator=False).update(on_cep=Constants.PARTIAL)
+        Field.objects.filter(pk=fields[5].pk).update(on_cep=Constants.FALSE)
+        start = datetime.datetime(2013, 1, 1, 20, 0, tzinfo=timezone.utc)
+        for n in range(12):
+            calibrator = create_observation(
+                "L%d" % (1000 + 2 * n), fields[:1], start_time=start + datetime.timedelta(minutes=20 * n)
+            )
+            calibrator.parset = "Observation.Beam[0].momID = %d" % (5000 + 2 * n)
+            calibrator.save()
+            # Targets observe three of fields 1-5; some lack a MoM ID, and
+            # one has one which isn't a number.
+            target_fields = [fields[1 + (n + i) % 5] for i in range(3)]
+            target = create_observation(
+                "L%d" % (1001 + 2 * n), target_fields,
+                start_time=start + datetime.timedelta(minutes=20 * n + 1)
+            )
+            target.parset = "\n".join(
+                "Observation.Beam[%d].momID = %s" % (
+                    beam, "unknown" if (n, beam) == (4, 2) else 6000 + 10 * n + beam
+                ) for beam in range(3) if beam == 0 or (n + beam) % 7
+            )
+            target.save()
+        Beam.objects.filter(observation__obsid__in=["L1003", "L1009"]).update(on_cep=Constants.TRUE)
+        self.dirs = [tempfile.mkdtemp(), tempfile.mkdtemp()]
+
+    def tearDown(self):
+        for directory in self.dirs:
+            shutil.rmtree(directory)
+
+    def _contents(self, directory):
+        return dict(
+            (filename, open(os.path.join(directory, filename)).read())
+            for filename in os.listdir(directory)
+        )
+
+    def test_matches_legacy_output(self):
+        for n_slices, processes in ((1, 1), (2, 2)):
+            if processes > 1:
+                # Use the recorded calibrators the second time around.
+                self.assertTrue(pair_calibrators())
+            for directory in self.dirs:
+                for filename in os.listdir(directory):
+                    os.unlink(os.path.join(directory, filename))
+            legacy_mom_mapping(self.dirs[0], "MSSS LBA", n_slices)
+            call_command(
+                "generate_mom_mapping", output_dir=self.dirs[1], n_slices=n_slices,
+                processes=processes, stdout=StringIO()
+            )
+            expected = self._contents(self.dirs[0])
+            self.assertTrue(expected)
+            self.assertEqual(self._contents(self.dirs[1]), expected)
+
+
+class PairCalibratorsTest(TestCase):
+    def test_pairing(self):
+        survey = create_survey(n_fields=3)
+        calibrator, target, other = survey.field_set.order_by('pk')
+        start = timezone.now()
+        for n, fields in enumerate((
+            [calibrator], [target, other], [target], [calibrator], [calibrator],
+            [other], [], [calibrator, target]
+        )):
+            create_observation("L%d" % n, fields, start_time=start + datetime.timedelta(minutes=n))
+
+        self.assertEqual(pair_calibrators(), 2)
+        self.assertEqual(
+            list(Observation.objects.order_by('start_time').values_list('calibrator', flat=True)),
+            [None, "L0", None, None, None, "L4", None, None]
+        )
+        self.assertEqual(pair_calibrators(), 0)
+        with self.assertNumQueries(1):
+            observations = list(Observation.objects.select_related('calibrator').filter(calibrator__isnull=False))
+            self.assertEqual([obs.calibrator.obsid for obs in observations], ["L0", "L4"])
+        self.assertEqual(
+            list(Observation.objects.get(pk="L0").targets.values_list('pk', flat=True)), ["L1"]
+        )
+
+        # A new calibrator scan takes over its following target.
+        create_observation("L9", [calibrator], start_time=start + datetime.timedelta(seconds=30))
+        self.assertEqual(pair_calibrators(), 1)
+        self.assertEqual(Observation.objects.get(pk="L1").calibrator_id, "L9")
+
+
+
+class RequestProfileTest(TestCase):
+    def setUp(self):
+        endpoint_stats.reset()
+        create_survey(n_fields=2)
+
+    @override_settings(PROFILE_REQUESTS=True)
+    def test_profiled(self):
+        response = self.client.get(reverse('field_list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(int(response["X-Query-Count"]) > 0)
+        for header in ("X-Query-Time", "X-Render-Time", "X-Total-Time"):
+            self.assertTrue(response[header].endswith(" ms"))
+        self.assertTrue(float(response["X-Render-Time"].split()[0]) > 0)
+        self.client.get(reverse('field_list'))
+
+        response = self.client.get(reverse('profile'))
+        self.assertEqual(response.status_code, 200)
+        endpoints = dict((entry["endpoint"], entry) for entry in response.context["endpoints"])
+        self.assertEqual(endpoints["field_list"]["requests"], 2)
+
+        self.client.get(reverse('profile') + "?reset")
+        self.assertEqual([entry["endpoint"] for entry in endpoint_stats.slowest()], ["profile"])
+
+    def test_disabled(self):
+        response = self.client.get(reverse('field_list'))
+        self.assertFalse(response.has_header("X-Query-Count"))
+        self.assertEqual(endpoint_stats.slowest(), [])
+        self.assertEqual(self.client.get(reverse('profile')).status_code, 404)
+
+
+class GridTest(TestCase):
+    def test_parse_angle(self):
+        ra, dec = parse_angle("01:37:41.3", "+33.09.35")
+        self.assertAlmostEqual(ra, math.radians(15 * (1 + 37 / 60.0 + 41.3 / 3600)))
+        self.assertAlmostEqual(dec, math.radians(33 + 9 / 60.0 + 35 / 3600.0))
+        self.assertEqual(parse_angle("00:00:00", "+33:09:35")[1], dec)
+        self.assertEqual(parse_angle("00:00:00", "-0:30:00")[1], -math.radians(0.5))
+
+    def test_insert_grid(self):
+        survey = Survey.objects.create(name="MSSS LBA", field_size=2.885, beams_per_field=9)
+        self.assertEqual(
+            insert_grid(survey, os.path.join(METADATA_DIR, "calibrators.lba.txt"), calibrator=True), 8
+        )
+        field = Field.objects.get(name="3C48")
+        self.assertEqual((field.ra, field.dec), parse_angle("01:37:41.3", "+33.09.35"))
+        self.assertEqual(field.pixel, sky_pixel(field.ra, field.dec))
+        self.assertEqual(field.status(), [DataStatus.CALIBRATOR, DataStatus.NOT_OBSERVED])
+        self.assertEqual(SurveyStats.objects.get(survey=survey).n_calibrators, 8)
@@ -6,7 +6,9 @@ from .views import SurveyDetailView
 from .views import FieldDetailView
 from .views import FieldListView
 from .views import ObservationDetailView
+from .views import BeamSubbandDataView
 from .views import ObservationListView
+from .profiling import ProfileView
 
 from ..settings import PAGE_SIZE
 
@@ -21,5 +23,9 @@ urlpatterns = patterns('obsdb.observationdb.views',
 
     # Observations
     url(r'^observation/(?P<pk>L\d+)/$', ObservationDetailView.as_view(), name="observation_detail"),
+    url(r'^observation/(?P<pk>L\d+)/beam/(?P<beam>\d+)/subbands/$', BeamSubbandDataView.as_view(), name="beam_subbands"),
     url(r'^observation/$', ObservationListView.as_view(), name="obs_list"),
+
+    # Request profiling, if enabled
+    url(r'^profile/$', ProfileView.as_view(), name="profile"),
 )
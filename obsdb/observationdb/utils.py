@@ -8,6 +8,22 @@ RADIANS_IN_CIRCLE = 2 * math.pi
 ASEC_IN_AMIN = 60
 ASEC_IN_DEGREE = 60**2
 
+# Keep well below SQLite's default limit of 999 variables per statement.
+CHUNK_SIZE = 500
+
+def chunked(iterable, size=CHUNK_SIZE):
+    """
+    Yield successive lists of at most size elements from iterable.
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
 def radians_to_hms(rad):
     rad = rad % (RADIANS_IN_CIRCLE)
     seconds = SECONDS_IN_DAY * rad / RADIANS_IN_CIRCLE
@@ -1,19 +1,22 @@
+import json
 import math
 from random import choice
 
 from django.http import Http404
+from django.http import HttpResponse
 from django.http import HttpResponseRedirect
-from django.shortcuts import render_to_response
-from django.db.models import Min, Max, Count, Q
+from django.shortcuts import render_to_response, get_object_or_404
+from django.db.models import Count, Sum
 from django.core.urlresolvers import reverse
 from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
 from django.db.models.query import QuerySet
-from django.views.generic import TemplateView, ListView, DetailView
+from django.views.generic import View, TemplateView, ListView, DetailView
 from django.views.generic.edit import FormMixin, ProcessFormView
 from django.utils.safestring import mark_safe
 
-from .models import Survey, Field, Observation, Constants, DataStatus
+from .models import Survey, SurveyStats, Field, Observation, Beam, Constants, DataStatus
 from .forms import LookupForm, FieldFilterForm
+from .subbands import collapse_subband_data
 
 from ..settings import PAGE_SIZE
 from ..settings import SPLASH_IMAGES
@@ -39,12 +42,17 @@ class IntroView(TemplateView, ProcessFormView, FormMixin):
     def get_context_data(self, **kwargs):
         context = super(IntroView, self).get_context_data(**kwargs)
         image_url, image_caption = choice(SPLASH_IMAGES)
+        survey_list = list(Survey.objects.all())
+        totals = SurveyStats.objects.aggregate(
+            n_targets=Sum('n_targets'), n_calibrators=Sum('n_calibrators')
+        )
+        n_targets, n_calibrators = totals['n_targets'] or 0, totals['n_calibrators'] or 0
         context.update({
-            'n_surveys': Survey.objects.count(),
-            'survey_list': Survey.objects.all(),
-            'n_fields': Field.objects.count(),
-            'n_targets': Field.objects.filter(calibrator=False).count(),
-            'n_calibrators': Field.objects.filter(calibrator=True).count(),
+            'n_surveys': len(survey_list),
+            'survey_list': survey_list,
+            'n_fields': n_targets + n_calibrators,
+            'n_targets': n_targets,
+            'n_calibrators': n_calibrators,
             'n_observations': Observation.objects.count(),
             'n_archived': Observation.objects.filter(archived=Constants.TRUE).count(),
             'image_url': image_url,
@@ -54,61 +62,54 @@ class IntroView(TemplateView, ProcessFormView, FormMixin):
 
 
 class SurveyDetailView(DetailView):
-    model = Survey
+    queryset = Survey.objects.select_related('stats')
     template_name = 'survey_detail.html'
     context_object_name = "survey"
 
+    # Categories of target Field shown on the map: their names in the
+    # template, SurveyStats counters and colours.
+    CATEGORIES = (
+        ("not_observed", "n_not_observed", 'o'), ("on_cep", "n_on_cep", 'p'),
+        ("archived", "n_archived", 'g'), ("partial", "n_partial", 'b'),
+        ("missing", "n_missing", 'r')
+    )
+
     def _generate_field_list(self):
+        # The [ra, dec, colour] points for the map, grouped by category.
+        points = dict((counter, []) for category, counter, colour in self.CATEGORIES)
+        for ra, dec, archived, on_cep, n_beams in self.object.field_set.filter(
+            calibrator=False
+        ).values_list('ra', 'dec', 'archived', 'on_cep', 'n_beams'):
+            for counter in SurveyStats.counters(False, False, archived, on_cep, n_beams > 0):
+                if counter in points:
+                    points[counter].append([ra, dec])
         field_list = []
-        counts = {}
-        non_calibrators = self.object.field_set.filter(calibrator=False).annotate(n_beams=Count('beam'))
-
-        not_obs = non_calibrators.filter(n_beams=0)
-        field_list.extend([ra, dec, 'o'] for ra, dec in not_obs.values_list("ra", "dec"))
-        counts["not_observed"] = not_obs.count()
-
-        on_cep = non_calibrators.filter(on_cep=Constants.TRUE)
-        field_list.extend([ra, dec, 'p'] for ra, dec in on_cep.values_list("ra", "dec"))
-        counts["on_cep"] = on_cep.count()
-
-        archived = non_calibrators.filter(archived=Constants.TRUE).exclude(on_cep=Constants.TRUE)
-        field_list.extend([ra, dec, 'g'] for ra, dec in archived.values_list("ra", "dec"))
-        counts["archived"] = archived.count()
-
-        partial = non_calibrators.filter(Q(archived=Constants.PARTIAL) | Q(on_cep=Constants.PARTIAL)).exclude(on_cep=Constants.TRUE).exclude(archived=Constants.TRUE)
-        field_list.extend([ra, dec, 'b'] for ra, dec in partial.values_list("ra", "dec"))
-        counts["partial"] = partial.count()
-
-        # This includes data which both couldn't be located at all and also
-        # data which is accounted for but has been marked as invalid by the
-        # observers.
-        missing = non_calibrators.filter(n_beams__gt=0).filter(archived=Constants.FALSE, on_cep=Constants.FALSE).prefetch_related('beam_set', 'beam_set__observation')
-        field_list.extend([ra, dec, 'r'] for ra, dec in missing.values_list("ra", "dec"))
-        counts["missing"] = missing.count()
-
-        return field_list, counts
+        for category, counter, colour in self.CATEGORIES:
+            field_list.extend([ra, dec, colour] for ra, dec in points[counter])
+        return field_list
 
     def get_context_data(self, **kwargs):
         context = super(SurveyDetailView, self).get_context_data(**kwargs)
-        s = self.object
-        n_targets = s.field_set.filter(calibrator=False).count()
-        n_done = s.field_set.filter(calibrator=False, done=True).count()
-        field_list, counts = self._generate_field_list()
+        stats = SurveyStats.for_survey(self.object)
+        n_targets = stats.n_targets
+        counts = dict(
+            (category, getattr(stats, counter)) for category, counter, colour in self.CATEGORIES
+        )
         if n_targets > 0:
             percentages = { key : 100 * float(value)/n_targets for key, value in counts.iteritems() }
-            percentages["done"] = 100 * float(n_done)/n_targets
+            percentages["done"] = 100 * float(stats.n_done)/n_targets
         else:
-            percentages = { key : 0 for key, value in counts }
+            percentages = { key : 0 for key in counts }
             percentages["done"] = 0
 
         context.update({
-            "n_targets": n_targets, "n_done": n_done,
-            "n_cals": s.field_set.filter(calibrator=True).count(),
-            "start_time": s.field_set.aggregate(Min('beam__observation__start_time')).values()[0],
-            "stop_time": s.field_set.aggregate(Max('beam__observation__start_time')).values()[0],
+            "n_targets": n_targets, "n_done": stats.n_done,
+            "n_cals": stats.n_calibrators,
+            "start_time": stats.start_time,
+            "stop_time": stats.stop_time,
             "percentages": percentages,
-            "field_list": field_list,
-            'field_size': s.field_size,
+            "field_list": self._generate_field_list(),
+            'field_size': self.object.field_size,
         })
         return context
 
@@ -172,29 +173,19 @@ class FieldListView(ListView, FormMixin):
             fields = fields.filter(survey_id=form.cleaned_data['survey'])
 
         # Filter by status
-        fields = fields.annotate(num_beams=Count('beam'))
         if form.cleaned_data['status'] and form.cleaned_data['status'] != "None":
             status = form.cleaned_data['status']
-            if status == DataStatus.CALIBRATOR:
-                fields = fields.filter(calibrator=True)
-            elif status == DataStatus.NOT_OBSERVED:
-                fields = fields.filter(num_beams=0)
-            elif status == DataStatus.ARCHIVED:
-                fields = fields.filter(archived=Constants.TRUE)
-            elif status == DataStatus.ON_CEP:
-                fields = fields.filter(on_cep=Constants.TRUE)
-            elif status == DataStatus.PARTIAL_ARCHIVED:
-                fields = fields.filter(archived=Constants.PARTIAL)
-            elif status == DataStatus.PARTIAL_CEP:
-                fields = fields.filter(on_cep=Constants.PARTIAL)
+            if status == DataStatus.UNKNOWN:
+                # Calibrators are never counted as missing.
+                fields = fields.filter(status_code=0)
             else:
-                fields = fields.filter(calibrator=False, archived=Constants.FALSE, on_cep=Constants.FALSE).exclude(num_beams=0)
+                fields = fields.filter(status_code__in=DataStatus.status_codes(status))
 
         # Prepare for display
         if form.cleaned_data['sort_by'] in ("name", "ra", "dec"):
             fields = fields.order_by(form.cleaned_data['sort_by'])
         elif form.cleaned_data['sort_by'] == "obs":
-            fields = fields.order_by('-num_beams')
+            fields = fields.order_by('-n_beams')
         elif form.cleaned_data['sort_by'] == "dist":
             fields = sorted(fields, key=lambda x: x.distance)
         if form.cleaned_data['reverse']:
@@ -222,25 +213,63 @@ class FieldListView(ListView, FormMixin):
 
 
 class ObservationDetailView(DetailView):
-    model = Observation
+    queryset = Observation.objects.select_related('calibrator')
     template_name = 'observation_detail.html'
 
+    def get_context_data(self, **kwargs):
+        context = super(ObservationDetailView, self).get_context_data(**kwargs)
+        # The SubbandData are fetched by the page from BeamSubbandDataView.
+        context['beams'] = self.object.beam_set.select_related('field')
+        return context
+
+
+class BeamSubbandDataView(View):
+    """
+    The SubbandData of a Beam as JSON, collapsed into runs of subbands which
+    are stored alike.
+    """
+    def get(self, request, pk, beam):
+        beam = get_object_or_404(Beam, observation=pk, beam=beam)
+        rows = beam.subbanddata_set.order_by('number').values_list(
+            'number', 'subband', 'size', 'hostname', 'path', 'archive'
+        )
+        content = {
+            "observation": pk, "beam": beam.beam, "n_subbands": beam.n_subbands,
+            "ranges": collapse_subband_data(rows),
+        }
+        return HttpResponse(json.dumps(content), content_type="application/json")
+
 
 class ObservationListView(ListView):
-    queryset = Observation.objects.all()
+    # The list of targets needs the Beams' Fields; fetch them for the whole
+    # page at once.
+    queryset = Observation.objects.prefetch_related('beam_set__field')
     context_object_name = 'obs_list'
     template_name = 'observation_list.html'
     paginate_by = PAGE_SIZE
 
     def get_context_data(self, **kwargs):
         context = super(ObservationListView, self).get_context_data(**kwargs)
-        good_observations = Observation.objects.filter(invalid=False)
-        context.update({
-            "n_archived": good_observations.filter(archived=Constants.TRUE).count(),
-            "n_part_archived": good_observations.filter(archived=Constants.PARTIAL).count(),
-            "n_on_cep": good_observations.filter(on_cep=Constants.TRUE).count(),
-            "n_part_on_cep": good_observations.filter(on_cep=Constants.PARTIAL).count(),
-            "n_unknown": good_observations.filter(on_cep=Constants.FALSE, archived=Constants.FALSE).count(),
-            "n_invalid": Observation.objects.filter(invalid=True).count()
-        })
+        counts = dict.fromkeys((
+            "n_archived", "n_part_archived", "n_on_cep", "n_part_on_cep",
+            "n_unknown", "n_invalid"
+        ), 0)
+        # One query counts the Observations in each combination of states.
+        for invalid, archived, on_cep, n in Observation.objects.values_list(
+            'invalid', 'archived', 'on_cep'
+        ).annotate(n=Count('pk')).order_by():
+            if invalid:
+                counts["n_invalid"] += n
+                continue
+            if archived == Constants.TRUE:
+                counts["n_archived"] += n
+            elif archived == Constants.PARTIAL:
+                counts["n_part_archived"] += n
+            if on_cep == Constants.TRUE:
+                counts["n_on_cep"] += n
+            elif on_cep == Constants.PARTIAL:
+                counts["n_part_on_cep"] += n
+            if archived == Constants.FALSE and on_cep == Constants.FALSE:
+                counts["n_unknown"] += n
+        context.update(counts)
         return context
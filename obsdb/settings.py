@@ -93,6 +93,8 @@ MIDDLEWARE_CLASSES = (
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    # Does nothing unless PROFILE_REQUESTS is set.
+    'obsdb.observationdb.profiling.RequestProfileMiddleware',
 )
 
 ROOT_URLCONF = 'obsdb.urls'
@@ -132,6 +134,13 @@ LOGGING = {
             'level': 'ERROR',
             'filters': ['require_debug_false'],
             'class': 'django.utils.log.AdminEmailHandler'
+        },
+        'console': {
+            'level': 'INFO',
+            'class': 'logging.StreamHandler'
+        },
+        'null': {
+            'class': 'django.utils.log.NullHandler'
         }
     },
     'loggers': {
@@ -140,12 +149,23 @@ LOGGING = {
             'level': 'ERROR',
             'propagate': True,
         },
+        # Use the console handler to see the figures for each request when
+        # PROFILE_REQUESTS is set.
+        'obsdb.profiling': {
+            'handlers': ['null'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     }
 }
 
 # Default size for paginated pages
 PAGE_SIZE = 100
 
+# Record SQL queries and timings for each request, reporting them in response
+# headers, the obsdb.profiling log and at /profile/.
+PROFILE_REQUESTS = False
+
 # These images are suitable for adding some bling to the front page
 # We need a tuple of URL & (if required) caption.
 SPLASH_IMAGES = [
@@ -0,0 +1,219 @@
+# Time the building and browsing of a database holding a synthetic dataset
+# made by synthetic_data.py, writing the results as JSON so that runs on
+# different commits can be compared.
+#
+# The database named by DJANGO_SETTINGS_MODULE is populated just as
+# prime_db.sh would do it, timing each of the scripts; the views are then
+# timed with the Django test client. Use a settings module which points at a
+# scratch database: it must not already hold any observations.
+#
+# Usage: benchmark.py [options] dataset_directory
+
+import datetime
+import glob
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+import urllib
+from optparse import OptionParser
+
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.client import Client
+from django.test.utils import setup_test_environment
+
+from obsdb.observationdb.models import Survey, Field, Observation, Beam, SubbandData, Station
+from obsdb.observationdb.grid import insert_grid
+from synthetic_data import METADATA_DIR, SURVEYS
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(SCRIPT_DIR)
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT_DIR, stderr=open(os.devnull, 'w')
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def create_surveys():
+    # As create_survey.py does for each survey in prime_db.sh.
+    for name, field_size, beams_per_field, calibrators, grid in SURVEYS:
+        survey = Survey.objects.create(
+            name=name, field_size=field_size, beams_per_field=beams_per_field
+        )
+        insert_grid(survey, os.path.join(METADATA_DIR, calibrators), calibrator=True)
+        insert_grid(survey, os.path.join(METADATA_DIR, grid), calibrator=False)
+
+def run_script(name, args, log):
+    """
+    Run one of the scripts in this directory, as prime_db.sh would, and
+    return the time it took.
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT_DIR, env.get("PYTHONPATH")]))
+    start = time.time()
+    returncode = subprocess.call(
+        [sys.executable, os.path.join(SCRIPT_DIR, name)] + args,
+        stdout=log, stderr=subprocess.STDOUT, env=env
+    )
+    elapsed = time.time() - start
+    if returncode:
+        raise RuntimeError("%s failed with status %d" % (name, returncode))
+    return elapsed
+
+def count_lines(filenames, skip=0):
+    total = 0
+    for filename in filenames:
+        with open(filename, 'r') as f:
+            total += max(0, sum(1 for line in f if line.strip()) - skip)
+    return total
+
+def benchmark_scripts(dataset, options, log):
+    """
+    Populate the database from dataset, returning a dict of timings for each
+    stage.
+    """
+    results = {}
+    def record(name, elapsed, items):
+        results[name] = {"seconds": elapsed, "items": items, "rate": items / elapsed}
+        print "%-30s %8.2f s %10.1f items/s" % (name, elapsed, items / elapsed)
+
+    call_command("syncdb", interactive=False, verbosity=0)
+    if Observation.objects.exists():
+        raise RuntimeError("The database already holds observations")
+    if not Station.objects.exists():
+        run_script("create_stations.py", [os.path.join(METADATA_DIR, "StationInfo.dat")], log)
+    if not Survey.objects.exists():
+        create_surveys()
+
+    parsets = glob.glob(os.path.join(dataset, "parsets", "*.parset"))
+    args = ["-j", str(options.processes), os.path.join(dataset, "parsets")]
+    record("ingest", run_script("load_data.py", args, log), len(parsets))
+
+    archived = os.path.join(dataset, "archived_data.txt")
+    n_archived = sum(
+        int(line.split()[1]) - int(line.split()[0]) + 1
+        for line in open(archived) if line.strip()
+    )
+    record("mark_as_archived", run_script("mark_as_archived.py", [archived], log), n_archived)
+
+    lta = os.path.join(dataset, "archived_lta.csv")
+    record("lta", run_script("lta.py", [lta], log), count_lines([lta], skip=1))
+
+    listings = sorted(glob.glob(os.path.join(dataset, "node_listing", "*.log")))
+    record(
+        "insert_node_data_list",
+        run_script("insert_node_data_list.py", listings, log),
+        count_lines(listings)
+    )
+    return results
+
+def view_urls():
+    """
+    Return a list of (name, url) tuples for the views to time, using some of
+    the busiest objects in the database.
+    """
+    field = Field.objects.filter(calibrator=False).order_by('-n_beams', 'pk')[0]
+    observation = Beam.objects.filter(
+        field__calibrator=False
+    ).order_by('observation')[0].observation
+    urls = [("intro", reverse('introduction'))]
+    for survey in Survey.objects.order_by('name'):
+        urls.append(("survey_detail %s" % survey.name, reverse('survey_detail', args=(survey.name,))))
+    urls.extend([
+        ("field_list", reverse('field_list')),
+        ("field_list cone search", reverse('field_list') + "?" + urllib.urlencode({
+            "ra": "%.4f" % math.degrees(field.ra),
+            "dec": "%.4f" % math.degrees(field.dec),
+            "radius": 10, "sort_by": "dist"
+        })),
+        ("field_detail", reverse('field_detail', args=(field.pk,))),
+        ("observation_list", reverse('obs_list')),
+        ("observation_detail", reverse('observation_detail', args=(observation.pk,))),
+    ])
+    return urls
+
+def benchmark_views(repeat):
+    """
+    Request each view repeat times, after a first request to warm up, and
+    return a dict of the timings and number of queries for each.
+    """
+    setup_test_environment()
+    client = Client()
+    connection.use_debug_cursor = True
+    results = {}
+    for name, url in view_urls():
+        response = client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError("%s returned status %d" % (url, response.status_code))
+        times = []
+        for n in xrange(repeat):
+            start = time.time()
+            client.get(url)
+            times.append(time.time() - start)
+        times.sort()
+        # Queries are logged afresh for each request.
+        results["view %s" % name] = {
+            "url": url, "seconds": times[len(times) // 2],
+            "min": times[0], "max": times[-1], "queries": len(connection.queries),
+        }
+        print "%-30s %8.3f s %8d queries" % ("view %s" % name, times[len(times) // 2], len(connection.queries))
+    return results
+
+def compare(previous, current):
+    print
+    print "%-30s %10s %10s %8s" % ("", "previous", "current", "ratio")
+    for name in sorted(set(previous["results"]) & set(current["results"])):
+        before = previous["results"][name]["seconds"]
+        after = current["results"][name]["seconds"]
+        print "%-30s %9.3fs %9.3fs %8.2f" % (name, before, after, after / before if before else float("inf"))
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="%prog [options] dataset_directory")
+    parser.add_option("-o", "--output", default="benchmark.json",
+        help="file to which to write the results [default: %default]")
+    parser.add_option("-r", "--repeat", type="int", default=5,
+        help="number of times to request each view [default: %default]")
+    parser.add_option("-j", "--processes", type="int", default=1,
+        help="number of processes for load_data.py to use [default: %default]")
+    parser.add_option("-l", "--log", default=os.devnull,
+        help="file to which to write the output of the scripts [default: %default]")
+    parser.add_option("--views-only", action="store_true", default=False,
+        help="only time the views, using the data already in the database")
+    parser.add_option("-c", "--compare", default=None,
+        help="results of an earlier run with which to compare")
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error("please specify a dataset directory")
+
+    results = {}
+    if not options.views_only:
+        with open(options.log, 'a') as log:
+            results.update(benchmark_scripts(args[0], options, log))
+    results.update(benchmark_views(options.repeat))
+
+    output = {
+        "commit": git_commit(),
+        "date": datetime.datetime.now().isoformat(),
+        "dataset": os.path.abspath(args[0]),
+        "counts": {
+            "observations": Observation.objects.count(),
+            "beams": Beam.objects.count(),
+            "subband_data": SubbandData.objects.count(),
+            "fields": Field.objects.count(),
+        },
+        "results": results,
+    }
+    with open(options.output, 'w') as f:
+        json.dump(output, f, indent=2, sort_keys=True)
+    print "Wrote results to %s" % (options.output,)
+
+    if options.compare:
+        with open(options.compare, 'r') as f:
+            compare(json.load(f), output)
@@ -0,0 +1,33 @@
+# Compare the time taken to read the parsets in a directory with the
+# pure-Python ParameterSet and, if it is available, lofar.parameterset.
+#
+# Usage: benchmark_parset.py <parset directory>
+
+import sys
+import time
+
+from obsdb.observationdb.parset import ParameterSet
+from load_data import get_file_list, Parset, PARSET_KEYS
+
+def benchmark(name, function, filenames):
+    start = time.time()
+    for filename in filenames:
+        function(filename)
+    elapsed = time.time() - start
+    print "%-30s %8.3f s %10.1f parsets/s" % (name, elapsed, len(filenames) / max(elapsed, 1e-6))
+
+if __name__ == "__main__":
+    filenames = get_file_list(sys.argv[1])
+    print "%d parsets." % (len(filenames),)
+
+    start = time.time()
+    try:
+        from lofar.parameterset import parameterset
+    except ImportError:
+        print "lofar.parameterset not available"
+    else:
+        print "%-30s %8.3f s" % ("Import lofar.parameterset", time.time() - start)
+        benchmark("lofar.parameterset", parameterset, filenames)
+    benchmark("ParameterSet (all keys)", ParameterSet, filenames)
+    benchmark("ParameterSet (ingest keys)", lambda f: ParameterSet(f, PARSET_KEYS), filenames)
+    benchmark("load_data.Parset", Parset, filenames)
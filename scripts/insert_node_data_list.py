@@ -9,42 +9,30 @@
 
 import sys
 import os
-from obsdb.observationdb.models import Observation, SubbandData
-from collections import defaultdict
+from obsdb.observationdb.locations import set_locations
 
-class SubbandFileData(object):
-    def __init__(self, band_number, size, hostname, path):
-        self.band_number = band_number
-        self.size = size
-        self.hostname = hostname
-        self.path = path
+def read_node_listing(filename, locations):
+    """
+    Add the contents of the listing for a single node to locations, a dict
+    mapping SubbandData.id to (hostname, size, path).
+    """
+    hostname = os.path.splitext(os.path.basename(filename))[0]
+    with open(filename, 'r') as f:
+        for line in f:
+            size, path = line.split()
+            size = int(size) * 1024
+            band_number = int(path.split("_")[2][-3:], 10)
+            obsid = path.split("/")[2]
+            locations["%s_%d" % (obsid, band_number)] = (hostname, size, path)
 
 if __name__ == "__main__":
-    per_obs_id = defaultdict(list)
+    locations = {}
     for filename in sys.argv[1:]:
-        hostname = os.path.splitext(os.path.basename(filename))[0]
-        with open(filename, 'r') as f:
-            for line in f:
-                size, path = line.split()
-                size = int(size) * 1024
-                band_number = int(path.split("_")[2][-3:], 10)
-                obsid = path.split("/")[2]
-                per_obs_id[obsid].append(SubbandFileData(band_number, size, hostname, path))
-
-    for obs in Observation.objects.all():
-        if not per_obs_id.has_key(obs.obsid):
-#            print "Obsid %s not recorded" % obs.obsid
-            pass
-        else:
-            print "Processing %s" % obs.obsid
-            subbands = SubbandData.objects.filter(beam__observation__obsid=obs.obsid)
-            for subband in per_obs_id[obs.obsid]:
-                print "Processing SB %d" % subband.band_number
-                subbands.filter(number=subband.band_number).update(
-                    hostname=subband.hostname,
-                    size=subband.size,
-                    path=subband.path
-                )
-            for beam in obs.beam_set.all():
-                beam._update_status()
+        print "Reading %s" % filename
+        read_node_listing(filename, locations)
 
+    n_updated, changed = set_locations(locations)
+    print "Updated %d of %d listed subbands." % (n_updated, len(locations))
+    print "Status changed for %d beams, %d observations and %d fields." % (
+        changed["beams"], changed["observations"], changed["fields"]
+    )
@@ -1,26 +1,73 @@
-import sys
 import os
-import gc
 import fnmatch
 import datetime
-from pyrap.quanta import quantity
-from lofar.parameterset import parameterset
-from pyrap.measures import measures
-
-from obsdb.observationdb.models import Survey
-from obsdb.observationdb.models import Field
-from obsdb.observationdb.models import Station
-from obsdb.observationdb.models import Observation
-from obsdb.observationdb.models import Beam
+import sqlite3
+import cPickle
+import multiprocessing
+import re
+import resource
+import time
+from itertools import imap
+from optparse import OptionParser
+
 from obsdb.observationdb.models import Subband
-from obsdb.observationdb.models import SubbandData
+from obsdb.observationdb.crossmatch import FieldMatcher
+from obsdb.observationdb.parset import ParameterSet
+from obsdb.observationdb.msss import find_runs
+from obsdb.observationdb.pairing import pair_calibrators
+from obsdb.observationdb.ingest import bulk_upload, BATCH_SIZE
+from obsdb.observationdb.utils import chunked
 
 SURVEY = "MSSS LBA"
 
+# The only parset keys we need to read.
+PARSET_KEYS = re.compile(
+    r"Observation\.(nrBeams|startTime|stopTime|clockMode|antennaSet|bandFilter|"
+    r"VirtualInstrument\.stationList|Campaign\.(name|title)|"
+    r"Beam\[\d+\]\.(angle1|angle2|subbandList))$"
+)
+
+# Maximum separation (radians) between a beam and the Field it observes.
+MATCH_THRESHOLD = 0.05
+
+# Number of parsets parsed, or uploaded to MSSS HBA, at a time. This bounds
+# the number of full parsets held in memory.
+CHUNK_SIZE = 500
+
+_matchers = {}
+
+def get_matcher(survey_name, calibrator=None):
+    key = (survey_name, calibrator)
+    if not key in _matchers:
+        _matchers[key] = FieldMatcher.for_survey(survey_name, calibrator)
+    return _matchers[key]
+
+def crossmatch(parsets, survey_name, threshold=MATCH_THRESHOLD):
+    """
+    Identify the Field observed by every beam of every parset, and the
+    calibrator observed by each single-beam parset, with one batched match
+    per survey.
+    """
+    positions = [position for parset in parsets for position in parset.positions]
+    fields = get_matcher(survey_name).match(positions, threshold)
+    single_beam = [parset for parset in parsets if len(parset.positions) == 1]
+    calibrators = get_matcher(survey_name, calibrator=True).match(
+        [parset.positions[0] for parset in single_beam], threshold
+    )
+
+    idx = 0
+    for parset in parsets:
+        n_beams = len(parset.positions)
+        parset.fields[survey_name] = [field for field, separation in fields[idx:idx+n_beams]]
+        parset.calibrators[survey_name] = False
+        idx += n_beams
+    for parset, (field, separation) in zip(single_beam, calibrators):
+        if field:
+            parset.calibrators[survey_name] = field.name
+
 class Parset(object):
     __slots__ = [
         "filename",
-        "allocated",
         "positions",
         "time",
         "stations",
@@ -28,13 +75,20 @@ class Parset(object):
         "clock",
         "antennaset",
         "filter",
-        "campaign"
+        "campaign",
+        "fields",
+        "calibrators",
+        "text"
     ]
 
     def __init__(self, filename):
-        parset = parameterset(filename)
         self.filename = filename
-        self.allocated = False
+        with open(filename, 'r') as parset_file:
+            self.text = parset_file.read()
+        parset = ParameterSet.from_string(self.text, PARSET_KEYS)
+        # Filled in by crossmatch(), keyed by survey name.
+        self.fields = {}
+        self.calibrators = {}
 
         self.positions = []
         self.subbands = []
@@ -44,7 +98,7 @@ class Parset(object):
                 dec = parset.getFloat("Observation.Beam[%d].angle2" % beam)
                 self.positions.append((ra, dec))
                 try:
-                    self.subbands.append(parset.get('Observation.Beam[%d].subbandList' % beam).expand().getIntVector())
+                    self.subbands.append(parset.getIntVector('Observation.Beam[%d].subbandList' % beam, True))
                 except RuntimeError:
                     self.subbands.append([])
         except RuntimeError:
@@ -59,7 +113,7 @@ class Parset(object):
             self.time = []
 
         try:
-            self.stations = parset.get('Observation.VirtualInstrument.stationList').expand().getStringVector()
+            self.stations = parset.getStringVector('Observation.VirtualInstrument.stationList', True)
         except RuntimeError:
             self.stations = []
         try:
@@ -75,38 +129,34 @@ class Parset(object):
         except RuntimeError:
             self.filter = None
         self.campaign = {}
-        if "Observation.Campaign.name" in parset.keys():
+        if "Observation.Campaign.name" in parset:
             self.campaign['name'] = parset.getString("Observation.Campaign.name")
         else:
             self.campaign['name'] = None
-        if "Observation.Campaign.title" in parset.keys():
+        if "Observation.Campaign.title" in parset:
             self.campaign['title'] = parset.getString("Observation.Campaign.title")
         else:
             self.campaign['title'] = None
 
-    def get_field(self, beam, survey_name, threshold=0.05):
-        ra, dec = self.positions[beam]
-        try:
-            return Field.objects.near_position(
-                ra, dec, threshold
-            ).filter(
-                survey__name=survey_name
-            ).order_by("distance")[0]
-        except:
-            pass
+    # Pickling support, so Parsets can be returned from worker processes and
+    # stored in the ParsetCache.
+    def __getstate__(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
 
-    def is_calibrator(self, survey_name, threshold=0.05):
-        if len(self.positions) == 1:
-            ra, dec = self.positions[0]
-            try:
-                return Field.objects.near_position(
-                    ra, dec, threshold
-                ).filter(
-                    survey__name=survey_name, calibrator=True
-                ).order_by("distance")[0].name
-            except:
-                pass
-        return False
+    def __setstate__(self, state):
+        for name, value in state.iteritems():
+            if name in self.__slots__:
+                setattr(self, name, value)
+
+    def get_field(self, beam, survey_name):
+        if not survey_name in self.fields:
+            crossmatch([self], survey_name)
+        return self.fields[survey_name][beam]
+
+    def is_calibrator(self, survey_name):
+        if not survey_name in self.calibrators:
+            crossmatch([self], survey_name)
+        return self.calibrators[survey_name]
 
     def start_time(self):
         return datetime.datetime.strptime(self.time[0], "%Y-%m-%d %H:%M:%S")
@@ -119,156 +169,300 @@ class Parset(object):
     def get_subbands(self, beam):
         return self.subbands[beam]
 
-def load_parsets(filenames):
-    return [Parset(filename) for filename in filenames]
-
-def check_for_msss_lba_run(parsets, length, start_positions, step):
-    assert(len(parsets) == length)
-    survey_name="MSSS LBA"
-
-    # Zeroth check: no data reuse
-    if True in [parset.allocated for parset in parsets]:
-        return False
-
-    # First check: every second observation is of the same calibrator
-    calibrators = {parset.is_calibrator(survey_name) for parset in parsets[::2]}
-    if False in calibrators or len(calibrators) != 1:
-        return False
-
-    # Second check: every other observation has 3 or 4 beams
-    nr_beams = {len(parset.positions) for parset in parsets[1::2]}
-    if (not 3 in nr_beams and not 4 in nr_beams) or len(nr_beams) != 1:
-        return False
-
-    # Third check: every eighth observation should be of the same field *or*
-    # might be None
-    targets = []
-    for start_position in start_positions:
-        for beam in [0,1,2]:
-            targets.append(
-                {
-                    (
-                        parset.positions[beam]
-                    )
-                    for parset in parsets[start_position::step]
-                }
-            )
-    for target in targets:
-        if len(target) != 1:
-            return False
-
-    # All done!
-    return True
+    def discard_contents(self):
+        """
+        Drop everything which isn't needed to identify MSSS LBA runs, leaving
+        a lightweight index entry. Use load_parsets() to get it back.
+        """
+        self.text = None
+        self.subbands = None
+        self.stations = None
+
+class ParsetCache(object):
+    """
+    Persistent store of parsed Parsets, keyed by filename and invalidated when
+    the file's modification time or size changes.
+    """
+    def __init__(self, filename):
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS parsets "
+            "(filename TEXT PRIMARY KEY, mtime REAL, size INTEGER, parset BLOB)"
+        )
 
-def check_for_high_dec(parsets):
-    return check_for_msss_lba_run(parsets, 72, [1,3,5,7], 8)
+    def get(self, filename):
+        stat = os.stat(filename)
+        row = self.connection.execute(
+            "SELECT mtime, size, parset FROM parsets WHERE filename = ?",
+            (os.path.abspath(filename),)
+        ).fetchone()
+        if row and row[0] == stat.st_mtime and row[1] == stat.st_size:
+            parset = cPickle.loads(str(row[2]))
+            parset.filename = filename
+            return parset
+
+    def put(self, parset):
+        # Only store the results of parsing: cross-matching depends on the
+        # contents of the database, not just the file.
+        parset.fields, parset.calibrators = {}, {}
+        stat = os.stat(parset.filename)
+        self.connection.execute(
+            "INSERT OR REPLACE INTO parsets VALUES (?, ?, ?, ?)", (
+                os.path.abspath(parset.filename), stat.st_mtime, stat.st_size,
+                sqlite3.Binary(cPickle.dumps(parset, cPickle.HIGHEST_PROTOCOL))
+            )
+        )
 
-def check_for_low_dec(parsets):
-    return check_for_msss_lba_run(parsets, 54, [1,3,5], 6)
+    def commit(self):
+        self.connection.commit()
 
+class Checkpoint(object):
+    """
+    Persistent record of the parset files which have been dealt with, so that
+    an interrupted or repeated run can pick up where it left off. As with the
+    ParsetCache, a file is processed again if it changes.
 
-def upload_to_djangodb(parsets, survey_name):
-    survey = Survey.objects.get(name=survey_name)
+    The index entries of MSSS LBA candidates are kept, since runs can only be
+    identified once all of them have been seen.
+    """
+    IGNORED = "ignored"
+    CANDIDATE = "candidate"
+    UPLOADED = "uploaded"
 
-    for parset in parsets:
-        obsid = os.path.basename(parset.filename).rstrip(".parset")
-        with open(parset.filename, 'r') as parset_file:
-            parset_contents = parset_file.read()
-
-        observation = Observation.objects.create(
-            obsid=obsid,
-            antennaset=parset.antennaset,
-            start_time=parset.start_time(),
-            duration=parset.duration(),
-            parset=parset_contents,
-            clock=parset.clock,
-            filter=parset.filter
+    def __init__(self, filename):
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoint "
+            "(filename TEXT PRIMARY KEY, mtime REAL, size INTEGER, state TEXT, parset BLOB)"
         )
-        observation.stations = Station.objects.filter(name__in=parset.stations)
-        observation.save()
-
-        sb_ctr = 0
-        for beam_number in range(len(parset.positions)):
-            field = parset.get_field(beam_number, survey_name)
-            if field:
-                beam = Beam.objects.create(
-                    observation=observation,
-                    field=field,
-                    beam=beam_number
-                )
-                beam.subbands = Subband.objects.filter(number__in=parset.get_subbands(beam_number))
-                beam.save()
-                sb_list = []
-                for subband in beam.subbands.all():
-                    sb_list.append(
-                        SubbandData(
-                            id=obsid+"_"+str(sb_ctr),
-                            beam=beam,
-                            number=sb_ctr,
-                            subband=subband
-                        )
-                    )
-                    sb_ctr += 1
-                SubbandData.objects.bulk_create(sb_list)
-            else:
-                print "WARNING! Unrecognized field: %s beam %d" % (obsid, beam_number)
-    # Ensure we don't have any garbage lying around.
-    gc.collect()
 
+    def get(self, filename):
+        """
+        Return a tuple of the recorded state of filename and its index entry
+        (or None), or None if it needs processing.
+        """
+        stat = os.stat(filename)
+        row = self.connection.execute(
+            "SELECT mtime, size, state, parset FROM checkpoint WHERE filename = ?",
+            (os.path.abspath(filename),)
+        ).fetchone()
+        if row and row[0] == stat.st_mtime and row[1] == stat.st_size:
+            parset = None
+            if row[3] is not None:
+                parset = cPickle.loads(str(row[3]))
+                parset.filename = filename
+            return row[2], parset
+
+    def put(self, parset, state):
+        entry = None
+        if state == self.CANDIDATE:
+            parset.fields, parset.calibrators = {}, {}
+            entry = sqlite3.Binary(cPickle.dumps(parset, cPickle.HIGHEST_PROTOCOL))
+        stat = os.stat(parset.filename)
+        self.connection.execute(
+            "INSERT OR REPLACE INTO checkpoint VALUES (?, ?, ?, ?, ?)", (
+                os.path.abspath(parset.filename), stat.st_mtime, stat.st_size,
+                state, entry
+            )
+        )
 
-def get_file_list(root_dir):
-    matches = []
+    def mark_uploaded(self, filenames):
+        self.connection.executemany(
+            "UPDATE checkpoint SET state = ? WHERE filename = ?",
+            [(self.UPLOADED, os.path.abspath(filename)) for filename in filenames]
+        )
+        self.commit()
+
+    def is_uploaded(self, filename):
+        entry = self.get(filename)
+        return entry is not None and entry[0] == self.UPLOADED
+
+    def commit(self):
+        self.connection.commit()
+
+
+def load_parsets(filenames, pool=None, cache=None):
+    """
+    Parse filenames, using pool (a multiprocessing.Pool) if supplied. If a
+    ParsetCache is supplied, only those files which are not already cached
+    (or have changed) are parsed.
+    """
+    parsets = {}
+    to_parse = []
+    for filename in filenames:
+        parset = cache.get(filename) if cache else None
+        if parset:
+            parsets[filename] = parset
+        else:
+            to_parse.append(filename)
+
+    if pool and len(to_parse) > 1:
+        parsed = pool.imap_unordered(Parset, to_parse, chunksize=16)
+    else:
+        parsed = imap(Parset, to_parse)
+    for parset in parsed:
+        if cache:
+            cache.put(parset)
+        parsets[parset.filename] = parset
+    if cache:
+        cache.commit()
+    return [parsets[filename] for filename in filenames]
+
+def find_msss_lba_runs(parsets):
+    """
+    Return a list of (start index, length) tuples describing the MSSS LBA runs
+    in parsets, which must be sorted by start time.
+    """
+    return find_runs([
+        (parset.is_calibrator("MSSS LBA"), len(parset.positions), parset.positions)
+        for parset in parsets
+    ])
+
+
+def upload_to_djangodb(parsets, survey_name, batch_size=BATCH_SIZE):
+    """
+    Create or update Observations for parsets in survey_name. Returns the
+    numbers of Observations created and updated.
+    """
+    n_created, n_updated, unmatched = bulk_upload(parsets, survey_name, batch_size)
+    for obsid, beam_number in unmatched:
+        print "WARNING! Unrecognized field: %s beam %d" % (obsid, beam_number)
+    return n_created, n_updated
+
+
+def iter_file_list(root_dir):
     seen = set()
     for root, dirnames, filenames in os.walk(root_dir):
         for filename in fnmatch.filter(filenames, "*.parset"):
             if filename not in seen:
-                matches.append(os.path.join(root, filename))
+                yield os.path.join(root, filename)
                 seen.add(filename)
-    return matches
+
+def get_file_list(root_dir):
+    return list(iter_file_list(root_dir))
+
+def is_msss_hba(parset):
+    return (parset.campaign["name"] == "MSSS_HBA_2013" and
+        parset.campaign["title"] == "MSSS HBA Survey"
+    )
+
+def upload_msss_hba(parsets, batch_size=BATCH_SIZE, checkpoint=None):
+    if not parsets:
+        return 0, 0
+    crossmatch(parsets, "MSSS HBA")
+    for parset in parsets:
+        print "Adding %s to MSSS HBA" % parset.filename
+    counts = upload_to_djangodb(parsets, "MSSS HBA", batch_size)
+    if checkpoint:
+        for parset in parsets:
+            checkpoint.put(parset, Checkpoint.UPLOADED)
+        checkpoint.commit()
+    return counts
+
+def report(start_time, n_parsets, n_resumed, n_created, n_updated):
+    elapsed = time.time() - start_time
+    # ru_maxrss is in kilobytes on Linux.
+    peak_rss = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    ) / 1024.0
+    print "Read %d parsets (%d more already done) in %.1f s." % (
+        n_parsets, n_resumed, elapsed
+    )
+    print "Created %d and updated %d observations." % (n_created, n_updated)
+    print "%.1f parsets/s; %.1f observations/s; peak RSS %.1f MB." % (
+        n_parsets / elapsed, (n_created + n_updated) / elapsed, peak_rss
+    )
 
 if __name__ == "__main__":
+    parser = OptionParser(usage="%prog [options] parset_directory")
+    parser.add_option("-j", "--processes", type="int", default=1,
+        help="number of processes to use for parsing [default: %default]")
+    parser.add_option("-c", "--cache", default=None,
+        help="file in which to cache parsed parsets between runs")
+    parser.add_option("-b", "--batch-size", type="int", default=BATCH_SIZE,
+        help="number of observations to upload per transaction [default: %default]")
+    parser.add_option("-k", "--checkpoint", default=None,
+        help="file in which to record progress, so that a later run need only "
+             "process new or changed parsets")
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error("please specify a parset directory")
+
     if not Subband.objects.count() == 513:
         Subband.objects.bulk_create(
             [Subband(number=number) for number in xrange(513)]
         )
 
-    print "Getting filenames..."
-    filenames = get_file_list(sys.argv[1])
-    print "%d filenames." % (len(filenames),)
-
-    print "Loading parsets..."
-    parsets = load_parsets(filenames)
-    print "%d parsets." % (len(parsets),)
-
-    print "Searching for MSSS HBA..."
-    for parset in parsets:
-        if (parset.campaign["name"] == "MSSS_HBA_2013" and
-            parset.campaign["title"] == "MSSS HBA Survey"
-        ):
-            print "Adding %s to MSSS HBA" % parset.filename
-            upload_to_djangodb([parset], "MSSS HBA")
+    start_time = time.time()
+    pool = multiprocessing.Pool(options.processes) if options.processes > 1 else None
+    cache = ParsetCache(options.cache) if options.cache else None
+    checkpoint = Checkpoint(options.checkpoint) if options.checkpoint else None
+    n_parsets, n_resumed, n_created, n_updated = 0, 0, 0, 0
+
+    # MSSS HBA observations are uploaded as they are found; for MSSS LBA we
+    # keep a lightweight index of candidates, since runs can only be
+    # identified once we have seen them all.
+    print "Reading parsets and searching for MSSS HBA..."
+    parsets = []
+    hba_parsets = []
+    for filenames in chunked(iter_file_list(args[0]), CHUNK_SIZE):
+        to_read = []
+        for filename in filenames:
+            entry = checkpoint.get(filename) if checkpoint else None
+            if entry is None:
+                to_read.append(filename)
+            else:
+                n_resumed += 1
+                if entry[1] is not None:
+                    parsets.append(entry[1])
+        for parset in load_parsets(to_read, pool, cache):
+            n_parsets += 1
+            if is_msss_hba(parset):
+                hba_parsets.append(parset)
+                if len(hba_parsets) >= CHUNK_SIZE:
+                    created, updated = upload_msss_hba(hba_parsets, options.batch_size, checkpoint)
+                    n_created, n_updated = n_created + created, n_updated + updated
+                    hba_parsets = []
+            elif parset.campaign['name'] == "MSSS":
+                parset.discard_contents()
+                parsets.append(parset)
+                if checkpoint:
+                    checkpoint.put(parset, Checkpoint.CANDIDATE)
+            elif checkpoint:
+                checkpoint.put(parset, Checkpoint.IGNORED)
+        if checkpoint:
+            checkpoint.commit()
+    created, updated = upload_msss_hba(hba_parsets, options.batch_size, checkpoint)
+    n_created, n_updated = n_created + created, n_updated + updated
+    print "%d parsets; %d MSSS LBA candidates." % (n_parsets + n_resumed, len(parsets))
+
+    print "Cross-matching parsets..."
+    crossmatch(parsets, "MSSS LBA")
     print "done."
 
-    print "Filtering parsets..."
-    parsets = [parset for parset in parsets if parset.campaign['name'] == "MSSS"]
-    print "%d filtered parsets." % (len(parsets),)
-
     print "Sorting parsets..."
     parsets.sort(key=lambda parset: parset.start_time())
     print "%d sorted parsets." % (len(parsets),)
 
     print "Searching for MSSS LBA..."
-    for idx, parset in enumerate(parsets):
-        if not parset.allocated and len(parsets[idx:idx+72]) == 72:
-            if check_for_high_dec(parsets[idx:idx+72]):
-                print "Got a run of 36 calibrators starting at %s %d" % (parset.filename, idx)
-                upload_to_djangodb(parsets[idx:idx+72], "MSSS LBA")
-                for pset in  parsets[idx:idx+72]:
-                    pset.allocated = True
-        if not parset.allocated and len(parsets[idx:idx+54]) == 54:
-            if check_for_low_dec(parsets[idx:idx+54]):
-                print "Got a run of 27 calibrators starting at %s %d" % (parset.filename, idx)
-                upload_to_djangodb(parsets[idx:idx+54], "MSSS LBA")
-                for pset in  parsets[idx:idx+54]:
-                    pset.allocated = True
+    for start, length in find_msss_lba_runs(parsets):
+        filenames = [parset.filename for parset in parsets[start:start+length]]
+        if checkpoint and all(checkpoint.is_uploaded(filename) for filename in filenames):
+            continue
+        print "Got a run of %d calibrators starting at %s %d" % (length / 2, parsets[start].filename, start)
+        run = load_parsets(filenames, pool, cache)
+        crossmatch(run, "MSSS LBA")
+        created, updated = upload_to_djangodb(run, "MSSS LBA", options.batch_size)
+        n_created, n_updated = n_created + created, n_updated + updated
+        if checkpoint:
+            checkpoint.mark_uploaded(filenames)
     print "done."
+
+    print "Pairing targets with calibrators..."
+    print "%d observations paired." % (pair_calibrators(),)
+
+    if pool:
+        pool.close()
+        pool.join()
+    report(start_time, n_parsets, n_resumed, n_created, n_updated)
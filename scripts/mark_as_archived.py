@@ -1,21 +1,6 @@
 import sys
-from django.core.exceptions import ObjectDoesNotExist
-from obsdb.observationdb.models import SubbandData, Observation, ArchiveSite, Constants
-
-def mark_as_archived(lower, upper, location):
-    site, created = ArchiveSite.objects.get_or_create(name=location)
-
-    for obsid in xrange(lower, upper+1):
-        obsid = "L" + str(obsid)
-        try:
-            obs = Observation.objects.get(obsid=obsid)
-            SubbandData.objects.filter(beam__in=obs.beam_set.all()).update(archive=site)
-            for beam in obs.beam_set.all():
-                beam.archived = Constants.TRUE
-                beam.save()
-            print "Done %s" % obsid
-        except ObjectDoesNotExist:
-            print "%s is not in the database" % obsid
+from collections import OrderedDict
+from obsdb.observationdb.archive import mark_range_archived
 
 if __name__ == "__main__":
     archive_list = sys.argv[1]
@@ -23,9 +8,17 @@ if __name__ == "__main__":
     with open(archive_list, 'r') as f:
         l = f.readlines()
 
+    # Gather up the ranges archived at each location, so that each location
+    # can be handled in one go.
+    per_location = OrderedDict()
     for line in l:
         lower = int(line.split()[0])
         upper = int(line.split()[1])
         location = line.split()[2]
-        mark_as_archived(lower, upper, location)
+        per_location.setdefault(location, []).append((lower, upper))
 
+    for location, ranges in per_location.iteritems():
+        matched, n_missing = mark_range_archived(ranges, location)
+        print "%s: marked %d observations; %d not in the database" % (
+            location, len(matched), n_missing
+        )
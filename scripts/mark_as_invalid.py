@@ -1,5 +1,6 @@
 import sys
 from obsdb.observationdb.models import Observation
+from obsdb.observationdb.models import deferred_status
 
 if __name__ == "__main__":
     bad_list = sys.argv[1]
@@ -7,10 +8,11 @@ if __name__ == "__main__":
     with open(bad_list, 'r') as f:
         l = f.readlines()
 
-    for line in l:
-        o = Observation.objects.get(obsid=line.strip())
-        print o.obsid
-        o.invalid = True
-        o.save()
-        for beam in o.beam_set.all():
-            beam.save()
+    with deferred_status():
+        for line in l:
+            o = Observation.objects.get(obsid=line.strip())
+            print o.obsid
+            o.invalid = True
+            o.save()
+            for beam in o.beam_set.all():
+                beam.save()
@@ -0,0 +1,211 @@
+# Generate a synthetic dataset of full MSSS scale, for benchmarking.
+#
+# Observations are laid out as the real surveys were: MSSS LBA runs of 72
+# observations alternating calibrator scans with three-beam target
+# observations over the fields of metadata/grid.lba.txt, and MSSS HBA
+# observations over metadata/grid.hba.txt, interspersed with a few
+# observations belonging to other projects. The output directory mirrors the
+# layout prime_db.sh expects:
+#
+#   parsets/             one parset per observation, for load_data.py
+#   node_listing/        locusNNN.log files, for insert_node_data_list.py
+#   archived_data.txt    archived obsid ranges, for mark_as_archived.py
+#   archived_lta.csv     obsids archived at the LTA, for lta.py
+#
+# The same options and seed always produce the same dataset.
+#
+# Usage: synthetic_data.py [options] output_directory
+
+import datetime
+import os
+import random
+from optparse import OptionParser
+
+from obsdb.observationdb.grid import read_grid
+
+METADATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "metadata")
+
+# (name, field size, beams per field, calibrator list, grid) for each survey,
+# as created by prime_db.sh.
+SURVEYS = (
+    ("MSSS LBA", 2.885, 9, "calibrators.lba.txt", "grid.lba.txt"),
+    ("MSSS HBA", 1.21, 2, "calibrators.hba.txt", "grid.hba.txt"),
+)
+
+# A high declination MSSS LBA run: 36 calibrator scans alternating with 36
+# target observations, cycling through four sets of three fields.
+LBA_RUN_LENGTH = 72
+LBA_FIELD_SETS = 4
+LBA_BEAMS = 3
+HBA_BEAMS = 3
+
+SUBBANDS_PER_BEAM = 80
+N_NODES = 100
+
+FIRST_OBSID = 100000
+START_TIME = datetime.datetime(2012, 9, 1)
+
+def read_stations(filename=os.path.join(METADATA_DIR, "StationInfo.dat")):
+    with open(filename, 'r') as f:
+        return [line.split()[0] for line in f if line.strip()]
+
+
+class SyntheticObservation(object):
+    """
+    A synthetic observation: enough to write its parset and to list its
+    data.
+    """
+    def __init__(self, obsid, start_time, duration, positions, subbands, stations, campaign, antennaset):
+        self.obsid = obsid
+        self.start_time = start_time
+        self.duration = duration
+        self.positions = positions
+        self.subbands = subbands
+        self.stations = stations
+        self.campaign = campaign
+        self.antennaset = antennaset
+
+    def parset(self):
+        lines = ["Observation.nrBeams = %d" % len(self.positions)]
+        for beam, ((ra, dec), (first, last)) in enumerate(zip(self.positions, self.subbands)):
+            lines.append("Observation.Beam[%d].angle1 = %.10f" % (beam, ra))
+            lines.append("Observation.Beam[%d].angle2 = %.10f" % (beam, dec))
+            lines.append("Observation.Beam[%d].momID = %d" % (beam, 1000000 + 4 * int(self.obsid[1:]) + beam))
+            lines.append("Observation.Beam[%d].subbandList = [%d..%d]" % (beam, first, last))
+        stop_time = self.start_time + datetime.timedelta(seconds=self.duration)
+        lines.extend([
+            "Observation.startTime = %s" % self.start_time.strftime("%Y-%m-%d %H:%M:%S"),
+            "Observation.stopTime = %s" % stop_time.strftime("%Y-%m-%d %H:%M:%S"),
+            "Observation.VirtualInstrument.stationList = [%s]" % ",".join(self.stations),
+            "Observation.clockMode = <<Clock200",
+            "Observation.antennaSet = %s" % self.antennaset,
+            "Observation.bandFilter = %s" % ("LBA_30_90" if self.antennaset.startswith("LBA") else "HBA_110_190"),
+            'Observation.Campaign.name = "%s"' % self.campaign[0],
+            'Observation.Campaign.title = "%s"' % self.campaign[1],
+        ])
+        return "".join(line + "\n" for line in lines)
+
+    def data_paths(self):
+        # SubbandData are numbered across all the beams of an observation.
+        ctr = 0
+        for beam, (first, last) in enumerate(self.subbands):
+            for subband in xrange(first, last + 1):
+                yield "/data/%s/%s_SAP%03d_SB%03d_uv.MS" % (self.obsid, self.obsid, beam, ctr)
+                ctr += 1
+
+
+def beam_subbands(n_beams, n_subbands=SUBBANDS_PER_BEAM):
+    return [(beam * n_subbands, (beam + 1) * n_subbands - 1) for beam in xrange(n_beams)]
+
+def generate_observations(n_observations, rng, other_fraction=0.05):
+    """
+    Return a list of about n_observations synthetic Observations in time
+    order, split roughly equally between MSSS LBA and MSSS HBA.
+    """
+    lba_calibrators = read_grid(os.path.join(METADATA_DIR, SURVEYS[0][3]))
+    lba_fields = read_grid(os.path.join(METADATA_DIR, SURVEYS[0][4]))
+    hba_fields = read_grid(os.path.join(METADATA_DIR, SURVEYS[1][4]))
+    stations = read_stations()
+
+    observations = []
+    start_time = [START_TIME]
+    def add(duration, positions, subbands, campaign, antennaset):
+        observations.append(SyntheticObservation(
+            "L%d" % (FIRST_OBSID + len(observations)), start_time[0], duration,
+            positions, subbands, rng.sample(stations, min(40, len(stations))),
+            campaign, antennaset
+        ))
+        start_time[0] += datetime.timedelta(seconds=duration + 60)
+
+    n_lba_runs = max(1, n_observations // (2 * LBA_RUN_LENGTH))
+    n_hba = max(0, n_observations - n_lba_runs * LBA_RUN_LENGTH)
+    hba_per_run = n_hba // n_lba_runs
+    for run in xrange(n_lba_runs):
+        calibrator = rng.choice(lba_calibrators)[1:3]
+        field_sets = [
+            [(ra, dec) for name, ra, dec, description in rng.sample(lba_fields, LBA_BEAMS)]
+            for field_set in xrange(LBA_FIELD_SETS)
+        ]
+        for n in xrange(LBA_RUN_LENGTH // 2):
+            add(60, [calibrator], beam_subbands(1, 3 * SUBBANDS_PER_BEAM), ("MSSS", "MSSS"), "LBA_INNER")
+            add(660, field_sets[n % LBA_FIELD_SETS], beam_subbands(LBA_BEAMS), ("MSSS", "MSSS"), "LBA_INNER")
+
+        for n in xrange(hba_per_run + (n_hba % n_lba_runs if run == n_lba_runs - 1 else 0)):
+            if rng.random() < other_fraction:
+                name, ra, dec, description = rng.choice(hba_fields)
+                add(3600, [(ra, dec)], beam_subbands(1, 244), ("LC0_001", "Other project"), "HBA_DUAL")
+            else:
+                positions = [(ra, dec) for name, ra, dec, description in rng.sample(hba_fields, HBA_BEAMS)]
+                add(420, positions, beam_subbands(HBA_BEAMS), ("MSSS_HBA_2013", "MSSS HBA Survey"), "HBA_DUAL")
+    return observations
+
+def write_dataset(output_dir, observations, rng, on_cep_fraction=0.8, archived_fraction=0.3):
+    """
+    Write parsets and data listings for observations to output_dir.
+
+    About on_cep_fraction of the observations have their data listed on a CEP
+    node, and about archived_fraction are listed as archived, half in the
+    ranges read by mark_as_archived.py and half in the LTA list.
+    """
+    parset_dir = os.path.join(output_dir, "parsets")
+    listing_dir = os.path.join(output_dir, "node_listing")
+    for directory in (parset_dir, listing_dir):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    for observation in observations:
+        with open(os.path.join(parset_dir, "%s.parset" % observation.obsid), 'w') as f:
+            f.write(observation.parset())
+
+    listings = [
+        open(os.path.join(listing_dir, "locus%03d.log" % (node + 1)), 'w')
+        for node in xrange(N_NODES)
+    ]
+    try:
+        for observation in observations:
+            if rng.random() < on_cep_fraction:
+                # Missing subbands leave some beams partly on CEP.
+                for path in observation.data_paths():
+                    if rng.random() < 0.99:
+                        rng.choice(listings).write("%d %s\n" % (rng.randint(10000, 20000), path))
+    finally:
+        for listing in listings:
+            listing.close()
+
+    # Archived observations come in blocks of consecutive obsids.
+    obsids = [int(observation.obsid[1:]) for observation in observations]
+    ranges, lta = [], []
+    for lower in xrange(obsids[0], obsids[-1] + 1, 50):
+        upper = min(lower + 49, obsids[-1])
+        if rng.random() < archived_fraction:
+            if rng.random() < 0.5:
+                ranges.append((lower, upper, rng.choice(("SARA", "Juelich"))))
+            else:
+                lta.extend(xrange(lower, upper + 1))
+    with open(os.path.join(output_dir, "archived_data.txt"), 'w') as f:
+        for lower, upper, location in ranges:
+            f.write("%d  %d  %s\n" % (lower, upper, location))
+    with open(os.path.join(output_dir, "archived_lta.csv"), 'w') as f:
+        f.write("observationId\n")
+        for obsid in lta:
+            f.write('"%d"\n' % (obsid,))
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="%prog [options] output_directory")
+    parser.add_option("-n", "--observations", type="int", default=20000,
+        help="approximate number of observations to generate [default: %default]")
+    parser.add_option("-s", "--seed", type="int", default=0,
+        help="random seed [default: %default]")
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error("please specify an output directory")
+
+    rng = random.Random(options.seed)
+    observations = generate_observations(options.observations, rng)
+    write_dataset(args[0], observations, rng)
+    print "Wrote %d observations with %d beams and %d subbands to %s" % (
+        len(observations),
+        sum(len(observation.positions) for observation in observations),
+        sum(last - first + 1 for observation in observations for first, last in observation.subbands),
+        args[0]
+    )